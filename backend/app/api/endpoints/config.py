@@ -6,12 +6,15 @@ from app.schemas.config import (
     FullConfigUpdate,
     UpdateApiUrlRequest,
     UpdateGeminiKeyRequest,
+    AddGeminiKeyRequest,
+    GeminiKeysResponse,
     UpdatePromptRequest,
     UpdateWebhookRequest,
     UpdateProxyRequest,
     ConfigUpdateResponse
 )
 from app.core.config import settings
+from app.services.gemini_quota import KEY_POOL_REDIS_KEY, api_key_id, get_key_pool
 import redis
 import json
 
@@ -118,6 +121,7 @@ CONFIG_KEYS = (
     "config:proxy", "config:proxy_host", "config:proxy_http_port",
     "config:proxy_socks_port", "config:proxy_login", "config:proxy_password",
     "config:domains", "config:domains_count", "config:domain_names",
+    KEY_POOL_REDIS_KEY,
 )
 
 
@@ -165,6 +169,7 @@ async def get_effective_config(db: Session = Depends(get_db)):
     result["gemini"] = {
         "key_set_in_redis": bool(_redis_str("config:gemini_key")),
         "key_set_in_env": bool(settings.GEMINI_API_KEY),
+        "pool_keys_count": redis_client.hlen(KEY_POOL_REDIS_KEY),
         "model": settings.GEMINI_MODEL
     }
     
@@ -230,6 +235,57 @@ async def update_gemini_key(
     )
 
 
+@router.get("/gemini-keys", response_model=GeminiKeysResponse)
+async def get_gemini_keys(db: Session = Depends(get_db)):
+    """
+    Ключі пулу Gemini (разом з основним ключем) та їх поточний запас RPM/TPM і cooldown
+    """
+    primary_key = _redis_str("config:gemini_key") or settings.GEMINI_API_KEY
+    try:
+        keys = await get_key_pool().get_stats(primary_key)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Не вдалося отримати стан квот: {e}"
+        )
+    return GeminiKeysResponse(keys=keys)
+
+
+@router.post("/gemini-keys", response_model=ConfigUpdateResponse)
+async def add_gemini_key(
+    request: AddGeminiKeyRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    Додати ключ у пул Gemini. Worker-и підхоплюють пул без рестарту.
+    """
+    api_key = request.api_key.strip()
+    key_id = api_key_id(api_key)
+    redis_client.hset(KEY_POOL_REDIS_KEY, key_id, api_key)
+
+    return ConfigUpdateResponse(
+        success=True,
+        message=f"Ключ {key_id} додано в пул"
+    )
+
+
+@router.delete("/gemini-keys/{key_id}", response_model=ConfigUpdateResponse)
+async def delete_gemini_key(key_id: str, db: Session = Depends(get_db)):
+    """
+    Видалити ключ з пулу Gemini
+    """
+    if not redis_client.hdel(KEY_POOL_REDIS_KEY, key_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Ключ {key_id} не знайдено в пулі"
+        )
+
+    return ConfigUpdateResponse(
+        success=True,
+        message=f"Ключ {key_id} видалено з пулу"
+    )
+
+
 @router.put("/prompt", response_model=ConfigUpdateResponse)
 async def update_prompt(
     request: UpdatePromptRequest,
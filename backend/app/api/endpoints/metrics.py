@@ -0,0 +1,40 @@
+"""
+Metrics endpoints
+
+Операційні метрики worker-ів (таймінги та лічильники з Redis)
+"""
+from fastapi import APIRouter, HTTPException
+from typing import Dict
+from app.core.metrics import get_metrics, reset_metrics
+
+router = APIRouter()
+
+
+@router.get("", response_model=Dict)
+async def list_metrics():
+    """
+    Отримати всі метрики
+
+    Returns:
+        {name: {count, sum, avg, max}} — таймінги в секундах; для лічильників лише count
+        (похідні частки, напр. structured.resolved_share — {ratio})
+    """
+    try:
+        return await get_metrics()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Помилка отримання метрик: {e}")
+
+
+@router.delete("")
+async def clear_metrics():
+    """
+    Скинути всі метрики
+    """
+    try:
+        deleted = await reset_metrics()
+        return {
+            "success": True,
+            "message": f"Скинуто метрик: {deleted}"
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Помилка скидання метрик: {e}")
@@ -19,7 +19,18 @@ class Settings(BaseSettings):
     # Gemini AI
     GEMINI_API_KEY: str
     GEMINI_MODEL: str = "gemini-2.0-flash"
-    GEMINI_MAX_CONTENT_LENGTH: int = 80000  # max chars HTML/email перед відправкою (0 = без обрізки)
+    GEMINI_MAX_CONTENT_LENGTH: int = 80000  # застаріле: обрізка тепер за токенами (GEMINI_MAX_INPUT_TOKENS)
+    GEMINI_MAX_INPUT_TOKENS: int = 24000  # бюджет вхідних токенів на запит: шаблон + контент (0 = лише вікно контексту)
+    GEMINI_CONTEXT_WINDOW: int = 1048576  # вікно контексту моделі (вхід + max_output_tokens)
+    GEMINI_COUNT_TOKENS: bool = False  # рахувати токени промпту через count_tokens API (точніше, +1 запит)
+    GEMINI_RPM_LIMIT: int = 10  # запитів/хв на API ключ (спільно для всіх worker-ів)
+    GEMINI_TPM_LIMIT: int = 1000000  # токенів/хв на API ключ
+    GEMINI_QUOTA_WAIT_TIMEOUT: int = 120  # макс. очікування слоту квоти (секунди)
+    GEMINI_KEY_COOLDOWN: int = 60  # пауза для ключа пулу після 429 (секунди)
+    GEMINI_MAX_IN_FLIGHT: int = 20  # макс. одночасних запитів до Gemini на worker процес
+    GEMINI_STRUCTURED_OUTPUT: bool = False  # JSON mode + response_schema з DealSchema замість regex парсингу
+    GEMINI_CHUNKED_MODE: bool = False  # контент більший за бюджет — кілька запитів по частинах замість обрізки
+    GEMINI_MAX_CHUNKS: int = 4  # макс. частин (запитів) на сторінку; решта вміщується за пріоритетом секцій
     
     # Domains API
     DOMAINS_API_URL: Optional[str] = None
@@ -38,6 +49,40 @@ class Settings(BaseSettings):
     # Scraping
     SCRAPING_TIMEOUT: int = 30
     SCRAPING_MAX_RETRIES: int = 3
+    FETCH_STRATEGY_MEMORY_ENABLED: bool = True  # пам'ятати для домену робочу стратегію (direct/proxy/browser)
+    FETCH_STRATEGY_REPROBE_RATE: float = 0.1  # ймовірність повторно спробувати дешевшу стратегію
+    FETCH_STRATEGY_MAX_AGE: int = 604800  # старший запис (секунди) — завжди перевіряти дешевшу стратегію
+    PLAYWRIGHT_POOL_SIZE: int = 2  # прогрітих контекстів браузера = макс. одночасних рендерів на процес
+    PLAYWRIGHT_CONTEXT_MAX_USES: int = 50  # після стількох рендерів контекст перестворюється
+    PLAYWRIGHT_ACQUIRE_TIMEOUT: int = 60  # макс. очікування вільного контексту (секунди)
+    CLEARANCE_COOKIES_ENABLED: bool = True  # зберігати антибот cookies Playwright (cf_clearance) для aiohttp
+    PLAYWRIGHT_PRUNE_IN_BROWSER: bool = False  # чистити DOM у браузері (page.evaluate) замість передачі повного page.content()
+    PLAYWRIGHT_RENDER_QUEUE: bool = False  # staged: рендер браузером у черзі render, а не в fetch worker-і
+    PLAYWRIGHT_MAX_TREE_MEMORY_MB: int = 1500  # render: перезапуск браузера, коли процес + Chromium займають більше (0 = вимкнено)
+    # Прогрівати браузер і пул контекстів на старті worker-а (render worker-и): prefork —
+    # у кожному дочірньому процесі (worker_process_init), solo / threads — на worker_ready
+    PLAYWRIGHT_WARM_UP: bool = False
+    SCRAPING_MAX_BYTES: int = 2000000  # макс. байт тіла сторінки, решта не завантажується (0 = без ліміту)
+    SCRAPING_STOP_AT_BODY_END: bool = True  # припиняти завантаження після </body>
+    DOMAIN_REVALIDATION_ENABLED: bool = True  # ETag/Last-Modified/hash: незмінені сторінки без Gemini
+    SIMHASH_MAX_DISTANCE: int = 3  # макс. відстань Хеммінга SimHash для повторного використання угод (-1 = вимкнено)
+    SCRAPING_CHUNK_SIZE: int = 50  # доменів в одній Celery задачі
+    SCRAPING_CHUNK_CONCURRENCY: int = 20  # доменів одночасно в межах пачки
+    SCRAPING_DOMAIN_TIMEOUT: int = 300  # ліміт часу на один домен (секунди)
+    SCRAPING_PIPELINE_MODE: str = "chunk"  # chunk | staged (черги fetch/extract/llm/sink)
+    HTML_EXTRACTOR_BACKEND: str = "lxml"  # lxml | bs4 (попередня реалізація на BeautifulSoup)
+    EXTRACTION_POOL_ENABLED: bool = True  # парсинг HTML у пулі процесів, а не в event loop
+    EXTRACTION_POOL_SIZE: int = 0  # процесів у пулі (0 = кількість ядер)
+    EXTRACTION_INLINE_MAX_BYTES: int = 65536  # менші сторінки парсяться на місці (IPC дорожчий)
+    PROMO_EXTRACTOR_ENABLED: bool = False  # відправляти в Gemini лише акційні блоки сторінки
+    PROMO_TOP_K: int = 8  # скільки акційних блоків лишати
+    PROMO_CONTEXT_BLOCKS: int = 1  # сусідніх блоків контексту до/після кожного
+    STRUCTURED_OFFERS_MODE: str = "off"  # off | merge (додавати до угод Gemini) | replace (без Gemini, якщо покривають сторінку)
+    SHOP_TEMPLATES_ENABLED: bool = False  # вивчені DOM шаблони магазинів замість Gemini на стабільних сторінках
+    SHOP_TEMPLATE_MAX_HITS: int = 20  # після стількох попадань шаблону сторінка знову перевіряється Gemini
+    PROMO_GATE_MODE: str = "off"  # off | shadow (лише логувати рішення) | on (пропускати Gemini)
+    PROMO_GATE_THRESHOLD: float = 0.08  # ймовірність акцій, нижче якої Gemini пропускається
+    PROMO_GATE_MODEL_PATH: str = ""  # joblib модель scikit-learn (scripts/train_promo_classifier.py); порожньо — лише ключові слова
     
     # Celery
     CELERY_BROKER_URL: Optional[str] = None
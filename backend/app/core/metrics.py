@@ -0,0 +1,95 @@
+"""
+Операційні метрики в Redis
+
+Лічильники та таймінги спільні для всіх worker-ів і контейнерів, тож їх видно
+через GET /api/v1/metrics незалежно від того, де виконувалась задача.
+Кожна метрика — hash metrics:{name} з полями count/sum/max (таймінги в секундах).
+Запис метрик ніколи не ламає основний код — помилки Redis лише логуються.
+"""
+import logging
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = "metrics:"
+
+# Похідні частки: назва → (чисельник, знаменник); обчислюються в get_metrics
+RATIOS = {
+    # Частка доменів, повністю оброблених за структурованими даними без Gemini
+    "structured.resolved_share": ("structured.resolved", "structured.domains"),
+    # Частка застосувань вивченого шаблону магазину без дрейфу
+    "template.hit_rate": ("template.hit", "template.applied"),
+}
+
+# Атомарно: count += 1, sum += value, max = max(max, value)
+_RECORD_LUA = """
+redis.call('HINCRBY', KEYS[1], 'count', 1)
+redis.call('HINCRBYFLOAT', KEYS[1], 'sum', ARGV[1])
+local current = tonumber(redis.call('HGET', KEYS[1], 'max') or '0')
+if tonumber(ARGV[1]) > current then
+    redis.call('HSET', KEYS[1], 'max', ARGV[1])
+end
+return 1
+"""
+
+_script = None
+_script_client = None
+
+
+async def _client():
+    from app.services.gemini import get_async_redis_client
+    return await get_async_redis_client()
+
+
+async def record_timing(name: str, seconds: float):
+    """Записати тривалість операції (секунди)"""
+    global _script, _script_client
+    try:
+        client = await _client()
+        if _script is None or _script_client is not client:
+            _script = client.register_script(_RECORD_LUA)
+            _script_client = client
+        await _script(keys=[f"{METRICS_PREFIX}{name}"], args=[f"{max(0.0, seconds):.6f}"])
+    except Exception as e:
+        logger.debug(f"[Metrics] Не вдалося записати {name}: {e}")
+
+
+async def incr(name: str, amount: int = 1):
+    """Збільшити лічильник"""
+    try:
+        client = await _client()
+        await client.hincrby(f"{METRICS_PREFIX}{name}", "count", amount)
+    except Exception as e:
+        logger.debug(f"[Metrics] Не вдалося збільшити {name}: {e}")
+
+
+async def get_metrics() -> Dict[str, Dict]:
+    """Усі метрики: count, а для таймінгів також sum/avg/max; для RATIOS — ratio"""
+    client = await _client()
+    metrics = {}
+    async for key in client.scan_iter(match=f"{METRICS_PREFIX}*"):
+        data = await client.hgetall(key)
+        count = int(data.get("count", 0))
+        item = {"count": count}
+        if "sum" in data:
+            total = float(data["sum"])
+            item.update({
+                "sum": round(total, 6),
+                "avg": round(total / count, 6) if count else 0.0,
+                "max": round(float(data.get("max", 0)), 6),
+            })
+        metrics[key[len(METRICS_PREFIX):]] = item
+    for name, (numerator, denominator) in RATIOS.items():
+        total = metrics.get(denominator, {}).get("count", 0)
+        if total:
+            metrics[name] = {"ratio": round(metrics.get(numerator, {}).get("count", 0) / total, 4)}
+    return dict(sorted(metrics.items()))
+
+
+async def reset_metrics() -> int:
+    """Видалити всі метрики; повертає кількість видалених"""
+    client = await _client()
+    keys = [key async for key in client.scan_iter(match=f"{METRICS_PREFIX}*")]
+    if keys:
+        await client.delete(*keys)
+    return len(keys)
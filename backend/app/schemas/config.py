@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, HttpUrl
-from typing import Optional
+from typing import List, Optional
 
 
 class ConfigResponse(BaseModel):
@@ -28,6 +28,26 @@ class UpdateGeminiKeyRequest(BaseModel):
     api_key: str = Field(..., min_length=20, description="Gemini API ключ")
 
 
+class AddGeminiKeyRequest(BaseModel):
+    """Запит на додавання ключа в пул Gemini"""
+    api_key: str = Field(..., min_length=20, description="Gemini API ключ")
+
+
+class GeminiKeyStatus(BaseModel):
+    """Стан ключа пулу (сам ключ не повертаємо)"""
+    key_id: str
+    masked_key: str
+    source: str  # pool | primary
+    remaining_rpm: float
+    remaining_tpm: int
+    cooldown_seconds: float
+
+
+class GeminiKeysResponse(BaseModel):
+    """Ключі пулу Gemini з поточним запасом квоти"""
+    keys: List[GeminiKeyStatus]
+
+
 class UpdatePromptRequest(BaseModel):
     """Запит на оновлення промпту"""
     prompt: str = Field(..., min_length=10, description="Промпт для Gemini AI")
@@ -0,0 +1,119 @@
+"""
+Антибот cookies (cf_clearance тощо), отримані Playwright, для швидкого HTTP шляху
+
+Після того як браузер пройшов Cloudflare/DataDome challenge, сайт видає
+cookie-перепустку (cf_clearance, __cf_bm, datadome), прив'язану до User-Agent.
+Раніше вони зникали разом з контекстом і кожен наступний запуск знову платив
+за повний рендер. Тепер cookies сторінки разом з UA браузера зберігаються в
+Redis (clearance:{host}) до завершення терміну дії перепустки, а
+WebScraper.fetch_page надсилає їх з тим самим UA — повторні візити лишаються
+на aiohttp, поки перепустка дійсна.
+
+cf_clearance прив'язана до IP, з якого її отримано, тому разом з cookies
+зберігається вихідна точка браузера (egress: проксі "http://host:port" або
+"direct"). aiohttp надсилає cookies лише з тієї ж точки (запит закріплюється
+за цим проксі) і видаляє перепустку лише після 403 з тієї ж точки.
+
+Метрики: clearance.saved, clearance.hit, clearance.rejected.
+"""
+import json
+import logging
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from app.core import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+CLEARANCE_PREFIX = "clearance:"
+# Cookies, за якими видно, що challenge пройдено (нижній регістр)
+CLEARANCE_COOKIE_NAMES = ("cf_clearance", "__cf_bm", "datadome", "_abck")
+CLEARANCE_SESSION_TTL = 1800  # сесійні cookies (без expires) — 30 хвилин
+CLEARANCE_MAX_TTL = 86400  # не довіряти перепустці довше доби
+
+
+async def _client():
+    from app.services.gemini import get_async_redis_client
+    return await get_async_redis_client()
+
+
+def _host(url: str) -> str:
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    return (urlparse(url).hostname or "").removeprefix("www.")
+
+
+def clearance_ttl(cookies: List[Dict], now: Optional[float] = None) -> Optional[int]:
+    """
+    Скільки секунд дійсна перепустка (найменший expires серед антибот cookies)
+
+    Returns:
+        TTL або None — антибот cookies немає чи вони вже прострочені
+    """
+    now = now or time.time()
+    ttl = None
+    for cookie in cookies:
+        if cookie.get("name", "").lower() not in CLEARANCE_COOKIE_NAMES:
+            continue
+        expires = cookie.get("expires") or -1
+        cookie_ttl = CLEARANCE_SESSION_TTL if expires <= 0 else int(expires - now)
+        ttl = cookie_ttl if ttl is None else min(ttl, cookie_ttl)
+    if ttl is None or ttl <= 0:
+        return None
+    return min(ttl, CLEARANCE_MAX_TTL)
+
+
+def egress_id(proxy_base_url: Optional[str]) -> str:
+    """Вихідна точка запиту: base URL проксі (http://host:port) або "direct" """
+    return proxy_base_url or "direct"
+
+
+async def save_clearance(url: str, cookies: List[Dict], user_agent: str, egress: str):
+    """Зберегти cookies браузера (формат Playwright context.cookies()), якщо серед них є перепустка"""
+    if not settings.CLEARANCE_COOKIES_ENABLED:
+        return
+    ttl = clearance_ttl(cookies)
+    if ttl is None:
+        return
+    record = {
+        "user_agent": user_agent,
+        "egress": egress,
+        "cookies": {c["name"]: c["value"] for c in cookies if c.get("name")},
+        "saved_at": time.time(),
+    }
+    try:
+        client = await _client()
+        await client.setex(f"{CLEARANCE_PREFIX}{_host(url)}", ttl, json.dumps(record))
+        await metrics.incr("clearance.saved")
+        logger.info(f"✓ Збережено антибот cookies для {_host(url)} на {ttl}с")
+    except Exception as e:
+        logger.debug(f"[Clearance] Не вдалося зберегти {url}: {e}")
+
+
+async def load_clearance(url: str) -> Optional[Dict]:
+    """Дійсна перепустка для хоста URL: {user_agent, egress, cookies, saved_at} або None"""
+    if not settings.CLEARANCE_COOKIES_ENABLED:
+        return None
+    try:
+        client = await _client()
+        raw = await client.get(f"{CLEARANCE_PREFIX}{_host(url)}")
+        return json.loads(raw) if raw else None
+    except Exception as e:
+        logger.debug(f"[Clearance] Не вдалося прочитати {url}: {e}")
+        return None
+
+
+async def drop_clearance(url: str):
+    """Перепустку відхилено сайтом — більше не надсилати"""
+    await metrics.incr("clearance.rejected")
+    try:
+        client = await _client()
+        await client.delete(f"{CLEARANCE_PREFIX}{_host(url)}")
+    except Exception as e:
+        logger.debug(f"[Clearance] Не вдалося видалити {url}: {e}")
+
+
+def cookie_header(clearance: Dict) -> str:
+    return "; ".join(f"{name}={value}" for name, value in clearance["cookies"].items())
@@ -0,0 +1,197 @@
+"""
+Стан домену між запусками: валідатори HTTP кешу та останній результат
+
+Повний парсинг кожні 6 годин завантажує всі головні сторінки та знову
+відправляє їх у Gemini, хоча більшість з них не змінюється. Тут для кожного
+домену зберігається (Redis, domain_state:{domain}):
+- ETag / Last-Modified / фінальний URL — для умовних запитів (If-None-Match,
+  If-Modified-Since)
+- hash тіла сторінки
+- угоди останнього успішного аналізу та відбиток промпту/моделі, з якими їх отримано
+
+На 304, при збігу hash або близькому SimHash відбитку акційного тексту (сторінка
+відрізняється лише CSRF токенами, часом, ротацією товарів) попередні угоди
+використовуються повторно без Gemini. SimHash довгого тексту майже не реагує на
+зміну самого промокоду чи знижки, тому для нього додатково мають збігтися
+промо токени сторінки (коди та розміри знижок).
+Відбиток промпту гарантує, що після зміни промпту чи моделі угоди не перевикористовуються.
+"""
+import hashlib
+import json
+import logging
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Union
+
+from app.core.config import settings
+from app.services.promo_extractor import code_tokens
+
+logger = logging.getLogger(__name__)
+
+DOMAIN_STATE_PREFIX = "domain_state:"
+DOMAIN_STATE_TTL = 7 * 86400  # 7 днів
+
+SIMHASH_BITS = 64
+SIMHASH_SHINGLE = 3  # слів в одній ознаці
+SIMHASH_MIN_FEATURES = 8  # на коротшому тексті відбиток нестабільний
+
+_WORD_RE = re.compile(r"\w+")
+_TAG_RE = re.compile(r"<[^>]+>")
+_WHITESPACE_RE = re.compile(r"\s+")
+_AMOUNT_RE = re.compile(r"\d+(?:[.,]\d+)?\s*(?:%|€|euros?\b)", re.IGNORECASE)
+
+
+def prompt_fingerprint(prompt_template: str, model_name: str) -> str:
+    """Відбиток промпту та моделі, з якими отримано угоди"""
+    return hashlib.sha256(f"{model_name}\n{prompt_template}".encode()).hexdigest()[:16]
+
+
+def content_hash(body: Union[str, bytes]) -> str:
+    """Hash тіла сторінки"""
+    if isinstance(body, str):
+        body = body.encode("utf-8", errors="replace")
+    return hashlib.sha256(body or b"").hexdigest()[:32]
+
+
+def simhash(text: str) -> Optional[int]:
+    """
+    64-бітний SimHash за шинглами слів
+
+    Схожі тексти дають відбитки з малою відстанню Хеммінга.
+    None — якщо тексту замало для стабільного відбитку.
+    """
+    words = _WORD_RE.findall((text or "").lower())
+    features = [" ".join(words[i:i + SIMHASH_SHINGLE]) for i in range(max(0, len(words) - SIMHASH_SHINGLE + 1))]
+    if len(features) < SIMHASH_MIN_FEATURES:
+        return None
+
+    weights = [0] * SIMHASH_BITS
+    for feature in features:
+        h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _promo_text(content: Dict) -> str:
+    promo_html = content.get('promo_html')
+    return _TAG_RE.sub(" ", promo_html) if promo_html else content.get('text', "")
+
+
+def page_simhash(content: Optional[Dict]) -> Optional[str]:
+    """SimHash акційного тексту сторінки (promo_html, інакше весь видимий текст) у hex"""
+    if not content:
+        return None
+    fingerprint = simhash(_promo_text(content))
+    return f"{fingerprint:016x}" if fingerprint is not None else None
+
+
+def promo_tokens(text: str) -> List[str]:
+    """Промокоди та розміри знижок (-30%, 10€) тексту — відсортований список"""
+    amounts = (_WHITESPACE_RE.sub("", a).lower() for a in _AMOUNT_RE.findall(text))
+    return sorted(set(code_tokens(text)) | set(amounts))
+
+
+def page_promo_tokens(content: Optional[Dict]) -> Optional[List[str]]:
+    """Промокоди та розміри знижок акційного тексту сторінки (promo_html, інакше весь текст)"""
+    if not content:
+        return None
+    return promo_tokens(_promo_text(content))
+
+
+async def _client():
+    from app.services.gemini import get_async_redis_client
+    return await get_async_redis_client()
+
+
+async def load_domain_state(domain: str) -> Optional[Dict]:
+    """Останній збережений стан домену або None"""
+    try:
+        client = await _client()
+        raw = await client.get(f"{DOMAIN_STATE_PREFIX}{domain}")
+        return json.loads(raw) if raw else None
+    except Exception as e:
+        logger.debug(f"[DomainState] Не вдалося прочитати стан {domain}: {e}")
+        return None
+
+
+async def save_domain_state(
+    domain: str,
+    scraped_data: Dict,
+    deals: List[Dict],
+    fingerprint: str
+):
+    """Зберегти валідатори, hash сторінки та угоди успішного аналізу"""
+    validators = scraped_data.get('validators') or {}
+    previous = scraped_data.get('previous_state') or {}
+    state = {
+        "etag": validators.get('etag') or previous.get('etag'),
+        "last_modified": validators.get('last_modified') or previous.get('last_modified'),
+        "final_url": validators.get('final_url') or previous.get('final_url'),
+        "content_hash": scraped_data.get('content_hash') or previous.get('content_hash'),
+        "simhash": scraped_data.get('simhash') or previous.get('simhash'),
+        "promo_tokens": (
+            scraped_data['promo_tokens'] if scraped_data.get('promo_tokens') is not None
+            else previous.get('promo_tokens')
+        ),
+        "prompt_fingerprint": fingerprint,
+        "deals": deals,
+        "updated_at": datetime.utcnow().isoformat(),
+    }
+    try:
+        client = await _client()
+        await client.setex(
+            f"{DOMAIN_STATE_PREFIX}{domain}", DOMAIN_STATE_TTL, json.dumps(state, default=str)
+        )
+    except Exception as e:
+        logger.debug(f"[DomainState] Не вдалося зберегти стан {domain}: {e}")
+
+
+def usable_state(state: Optional[Dict], fingerprint: str) -> Optional[Dict]:
+    """Стан, придатний для повторного використання з поточним промптом, або None"""
+    if not settings.DOMAIN_REVALIDATION_ENABLED or not state:
+        return None
+    if state.get("prompt_fingerprint") != fingerprint or "deals" not in state:
+        return None
+    return state
+
+
+def conditional_validators(state: Optional[Dict]) -> Optional[Dict]:
+    """ETag / Last-Modified для умовного запиту"""
+    if not state or not (state.get("etag") or state.get("last_modified")):
+        return None
+    return {"etag": state.get("etag"), "last_modified": state.get("last_modified")}
+
+
+def reuse_reason(scraped_data: Dict) -> Optional[str]:
+    """
+    Чому можна використати попередні угоди без Gemini
+
+    Returns:
+        "not_modified" (HTTP 304), "content_hash" (тіло не змінилось),
+        "simhash" (акційний текст майже не змінився, а коди й знижки ті самі) або None.
+        Відстань SimHash записується в scraped_data['simhash_distance'].
+    """
+    previous = scraped_data.get('previous_state')
+    if not previous:
+        return None
+    if scraped_data.get('not_modified'):
+        return "not_modified"
+    current_hash = scraped_data.get('content_hash')
+    if current_hash and current_hash == previous.get('content_hash'):
+        return "content_hash"
+
+    current_simhash = scraped_data.get('simhash')
+    previous_simhash = previous.get('simhash')
+    if current_simhash and previous_simhash:
+        distance = hamming_distance(int(current_simhash, 16), int(previous_simhash, 16))
+        scraped_data['simhash_distance'] = distance
+        # Без однакових кодів/знижок близький SimHash нічого не гарантує (HIVER30 → ETE15)
+        tokens = scraped_data.get('promo_tokens')
+        if distance <= settings.SIMHASH_MAX_DISTANCE and tokens is not None and tokens == previous.get('promo_tokens'):
+            return "simhash"
+    return None
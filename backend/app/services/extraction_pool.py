@@ -0,0 +1,141 @@
+"""
+Винесення парсингу HTML у пул процесів
+
+Парсинг сторінки на кілька MB займає десятки-сотні мс CPU і, виконаний прямо
+в корутині, зупиняє всі інші fetch та Gemini запити в loop worker-а.
+Тому великі сторінки парсяться в ProcessPoolExecutor (розмір — кількість ядер),
+куди передаються сирі bytes відповіді та кодування (без повторного кодування str).
+Маленькі сторінки парсяться на місці — IPC для них дорожчий за сам парсинг.
+
+Метрики (див. GET /api/v1/metrics):
+- extract.queue_wait — очікування вільного процесу пулу
+- extract.parse      — парсинг у пулі
+- extract.inline     — парсинг на місці (маленькі сторінки / пул недоступний)
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional, Tuple, Union
+
+from app.core import metrics
+from app.core.config import settings
+from app.services.html_extractors import get_html_extractor
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_unavailable = False
+# Обмеження задач у черзі пулу: (loop, semaphore)
+_pending: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+
+
+def _pool_size() -> int:
+    return settings.EXTRACTION_POOL_SIZE or os.cpu_count() or 1
+
+
+def get_extraction_pool() -> Optional[ProcessPoolExecutor]:
+    """Пул процесів парсингу (None — пул вимкнено або недоступний у цьому процесі)"""
+    global _pool, _pool_unavailable
+    if not settings.EXTRACTION_POOL_ENABLED or _pool_unavailable:
+        return None
+    if _pool is None:
+        if multiprocessing.current_process().daemon:
+            # daemon процес prefork пулу Celery не може мати дочірніх процесів;
+            # ProcessPoolExecutor створюється без помилки, але падає на submit
+            logger.info("Пул парсингу недоступний у daemon процесі, парсимо на місці")
+            _pool_unavailable = True
+            return None
+        try:
+            # spawn: fork процесу з потоками (event loop, gRPC) може зависнути
+            _pool = ProcessPoolExecutor(
+                max_workers=_pool_size(),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            logger.info(f"✓ Запущено пул парсингу HTML ({_pool_size()} процесів)")
+        except (AssertionError, OSError, ValueError) as e:
+            logger.warning(f"Пул парсингу недоступний ({e}), парсимо на місці")
+            _pool_unavailable = True
+            return None
+    return _pool
+
+
+def shutdown_extraction_pool():
+    """Зупинити пул процесів (при завершенні worker-а)"""
+    global _pool, _pending
+    pool, _pool, _pending = _pool, None, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _pending_semaphore() -> asyncio.Semaphore:
+    global _pending
+    loop = asyncio.get_running_loop()
+    if _pending is None or _pending[0] is not loop:
+        _pending = (loop, asyncio.Semaphore(_pool_size() * 2))
+    return _pending[1]
+
+
+def _extract_in_process(
+    body: Union[str, bytes],
+    base_url: str,
+    encoding: Optional[str]
+) -> Tuple[Dict[str, Any], float, float]:
+    """Виконується в процесі пулу: (content, час старту, тривалість парсингу)"""
+    started = time.time()
+    content = get_html_extractor().extract(body, base_url, encoding=encoding)
+    return content, started, time.time() - started
+
+
+async def extract_content(
+    body: Union[str, bytes],
+    base_url: str,
+    encoding: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Витягнути видимий контент, не блокуючи event loop
+
+    Args:
+        body: Сирі bytes відповіді (або str, напр. від Playwright)
+        base_url: URL сторінки
+        encoding: Кодування bytes (з заголовків відповіді)
+
+    Returns:
+        Dict як у WebScraper.extract_visible_content
+    """
+    global _pool_unavailable
+    pool = None
+    if len(body) >= settings.EXTRACTION_INLINE_MAX_BYTES:
+        pool = get_extraction_pool()
+
+    if pool is None:
+        started = time.perf_counter()
+        content = get_html_extractor().extract(body, base_url, encoding=encoding)
+        await metrics.record_timing("extract.inline", time.perf_counter() - started)
+        return content
+
+    loop = asyncio.get_running_loop()
+    submitted = time.time()
+    try:
+        async with _pending_semaphore():
+            content, started, parse_time = await loop.run_in_executor(
+                pool, _extract_in_process, body, base_url, encoding
+            )
+    except BrokenProcessPool as e:
+        # Процес пулу впав (OOM тощо) — перестворюємо пул, сторінку парсимо на місці
+        logger.warning(f"Пул парсингу зламано ({e}), перезапускаємо")
+        shutdown_extraction_pool()
+        await metrics.incr("extract.pool_broken")
+        return get_html_extractor().extract(body, base_url, encoding=encoding)
+    except AssertionError as e:
+        # "daemonic processes are not allowed to have children" — виникає лише на submit
+        logger.warning(f"Пул парсингу недоступний ({e}), парсимо на місці")
+        shutdown_extraction_pool()
+        _pool_unavailable = True
+        return get_html_extractor().extract(body, base_url, encoding=encoding)
+    await metrics.record_timing("extract.queue_wait", started - submitted)
+    await metrics.record_timing("extract.parse", parse_time)
+    return content
@@ -0,0 +1,90 @@
+"""
+Пам'ять стратегії завантаження для кожного домену
+
+fetch_website завжди починав з aiohttp і лише після 403 переходив на
+Playwright, а проксі вмикався просто за наявністю конфігурації. Домени за
+DataDome/Cloudflare щоразу витрачали повний HTTP запит (іноді з retry та
+backoff). Тут для домену зберігається (Redis, fetch_strategy:{domain}), яка
+стратегія спрацювала востаннє, її latency та час:
+- direct  — aiohttp без проксі
+- proxy   — aiohttp через проксі
+- browser — Playwright
+
+scrape_domain починає з відомої робочої стратегії і лише за потреби
+переходить до дорожчих. Зрідка (FETCH_STRATEGY_REPROBE_RATE, або коли запис
+старший за FETCH_STRATEGY_MAX_AGE) починає з найдешевшої — раптом захист зняли.
+"""
+import json
+import logging
+import random
+import time
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+STRATEGY_PREFIX = "fetch_strategy:"
+STRATEGY_TTL = 30 * 86400  # 30 днів
+
+# Від найдешевшої до найдорожчої
+STRATEGIES = ("direct", "proxy", "browser")
+
+
+async def _client():
+    from app.services.gemini import get_async_redis_client
+    return await get_async_redis_client()
+
+
+async def load_strategy(domain: str) -> Optional[Dict]:
+    """Остання успішна стратегія домену: {strategy, latency, updated_at} або None"""
+    if not settings.FETCH_STRATEGY_MEMORY_ENABLED:
+        return None
+    try:
+        client = await _client()
+        raw = await client.get(f"{STRATEGY_PREFIX}{domain}")
+        return json.loads(raw) if raw else None
+    except Exception as e:
+        logger.debug(f"[FetchStrategy] Не вдалося прочитати {domain}: {e}")
+        return None
+
+
+async def save_strategy(domain: str, strategy: Optional[str], latency: float = 0.0):
+    """Записати успішну стратегію (None — забути домен, напр. коли не спрацювала жодна)"""
+    if not settings.FETCH_STRATEGY_MEMORY_ENABLED:
+        return
+    try:
+        client = await _client()
+        key = f"{STRATEGY_PREFIX}{domain}"
+        if strategy is None:
+            await client.delete(key)
+        else:
+            record = {"strategy": strategy, "latency": round(latency, 3), "updated_at": time.time()}
+            await client.setex(key, STRATEGY_TTL, json.dumps(record))
+    except Exception as e:
+        logger.debug(f"[FetchStrategy] Не вдалося зберегти {domain}: {e}")
+
+
+def plan_strategies(record: Optional[Dict], proxy_available: bool) -> List[str]:
+    """
+    Порядок стратегій для спроби
+
+    Без запису — як раніше: проксі (якщо є), інакше напряму, потім браузер.
+    З записом — від відомої робочої стратегії вгору за вартістю; при повторній
+    перевірці перед нею одна спроба найдешевшою.
+    """
+    available = [s for s in STRATEGIES if s != "proxy" or proxy_available]
+    default_start = "proxy" if proxy_available else "direct"
+
+    if not record or record.get("strategy") not in available:
+        return available[available.index(default_start):]
+
+    known = available.index(record["strategy"])
+    plan = available[known:]
+    age = time.time() - record.get("updated_at", 0)
+    if known > 0 and (
+        age > settings.FETCH_STRATEGY_MAX_AGE or random.random() < settings.FETCH_STRATEGY_REPROBE_RATE
+    ):
+        # Повторна перевірка: одна спроба найдешевшою, далі — відома робоча
+        plan = [available[0]] + plan
+    return plan
@@ -6,10 +6,16 @@ import time
 import random
 import re
 import hashlib
-from typing import List, Dict, Optional, Tuple
+import weakref
+from typing import Any, List, Dict, Optional, Tuple
+from google.ai import generativelanguage as glm
 from app.schemas.deals import DealSchema
+from app.core import metrics
 from app.core.config import settings
 from app.prompts import EMAIL_DEALS_PROMPT
+from app.services.domain_state import prompt_fingerprint
+from app.services.token_budget import estimate_tokens, fit_to_budget, split_to_chunks
+from app.services.gemini_quota import api_key_id, estimate_request_tokens, get_distributed_limiter, get_key_pool
 from pydantic import ValidationError
 import redis.asyncio as aioredis
 
@@ -22,8 +28,25 @@ BACKOFF_JITTER = 0.2
 
 # Константи для кешування
 CACHE_TTL = 3600  # 1 година
+EMPTY_CACHE_TTL = 900  # 15 хвилин — "акцій немає" (валідна порожня відповідь, не помилка)
 CACHE_PREFIX = "gemini:deals:"
 
+# Канонізація контенту перед hash для ключа кешу: script/style/коментарі, nonce,
+# CSRF токени та пробіли не впливають на угоди, але давали промах кешу. Дати, час
+# та атрибути (href акції) лишаються — з них будуються date_end / target_url
+_CANONICAL_DROP_RE = re.compile(r"<script\b.*?</script\s*>|<style\b.*?</style\s*>|<!--.*?-->", re.I | re.S)
+_CANONICAL_VOLATILE_RE = re.compile(
+    r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"  # UUID
+    r"|\b[0-9a-fA-F]{16,}\b"  # hex nonce / hash
+    # base64 / CSRF токени: 32+ символи з цифрою та обома регістрами; з "-" чи "/"
+    # не чіпаємо — це може бути шлях посилання
+    r"|(?<![\w+/-])(?=[\w+]*\d)(?=[\w+]*[A-Z])(?=[\w+]*[a-z])[\w+]{32,}={0,2}(?![\w+/-])",
+)
+_CANONICAL_SPACE_RE = re.compile(r"\s+")
+
+# Ключі, за якими об'єкт у відповіді Gemini вважається однією угодою без обгортки
+DEAL_KEYS = ("code", "description", "discount")
+
 # Shared async Redis client pool (initialized lazily)
 _async_redis_client: Optional[aioredis.Redis] = None
 _async_redis_lock = asyncio.Lock()
@@ -79,8 +102,112 @@ class GeminiRateLimiter:
                 await asyncio.sleep(wait_time)
             self.last_request_time = time.time()
 
-# Глобальний інстанс rate limiter (10 запитів/хвилину для безкоштовного тарифу)
-_rate_limiter = GeminiRateLimiter(requests_per_minute=10)
+# Локальний rate limiter — fallback, якщо Redis (розподілена квота) недоступний
+_rate_limiter = GeminiRateLimiter(requests_per_minute=settings.GEMINI_RPM_LIMIT)
+
+# Async gRPC клієнти по ключах пулу (genai.configure глобальний, тож ключ задаємо на клієнті).
+# grpc.aio канал і семафор прив'язані до event loop, тому кешуємо їх окремо для кожного loop.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+_inflight_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _deals_response_schema() -> Dict:
+    """
+    Схема відповіді для structured output (OpenAPI підмножина Gemini), похідна від DealSchema.
+    Gemini не підтримує anyOf/maxLength/title, тож лишаємо тип, nullable, опис та required.
+    """
+    json_schema = DealSchema.model_json_schema()
+    properties = {}
+    for name, field in json_schema["properties"].items():
+        variants = field.get("anyOf", [field])
+        types = [v for v in variants if v.get("type") != "null"]
+        prop = {"type": types[0]["type"]}
+        if len(types) < len(variants):
+            prop["nullable"] = True
+        if prop["type"] == "array":
+            prop["items"] = {"type": types[0].get("items", {}).get("type", "string")}
+        if field.get("description"):
+            prop["description"] = field["description"]
+        properties[name] = prop
+    return {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": properties,
+            "required": json_schema.get("required", []),
+        },
+    }
+
+
+def canonicalize_content(content: str) -> str:
+    """
+    Канонічна форма контенту для ключа кешу: без script/style/коментарів,
+    UUID, nonce / CSRF токенів та зайвих пробілів
+    """
+    content = _CANONICAL_DROP_RE.sub(" ", content or "")
+    content = _CANONICAL_VOLATILE_RE.sub("#", content)
+    return _CANONICAL_SPACE_RE.sub(" ", content).strip()
+
+
+def _get_async_client(api_key: str) -> glm.GenerativeServiceAsyncClient:
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(api_key)
+    if client is None:
+        client = glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+        clients[api_key] = client
+    return client
+
+
+async def close_async_clients():
+    """Закрити async gRPC клієнти ключів поточного loop (при зупинці loop worker-а)."""
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        try:
+            await client.transport.close()
+        except Exception as e:
+            logger.debug(f"[Gemini] Помилка закриття gRPC клієнта: {e}")
+
+
+class _KeyModel:
+    """
+    Запити до моделі через async gRPC клієнт конкретного ключа пулу
+
+    genai.GenerativeModel бере клієнт з глобального genai.configure, тож запит
+    будуємо самі (protos) і відповідь загортаємо в публічний GenerateContentResponse.
+    """
+
+    def __init__(self, client: glm.GenerativeServiceAsyncClient, model_name: str,
+                 generation_config: Dict, safety_settings: List[Dict]):
+        self.client = client
+        self.model_name = model_name if model_name.startswith("models/") else f"models/{model_name}"
+        self.generation_config = generation_config
+        self.safety_settings = safety_settings
+
+    def _request(self, prompt: str) -> glm.GenerateContentRequest:
+        return glm.GenerateContentRequest(
+            model=self.model_name,
+            contents=[glm.Content(role="user", parts=[glm.Part(text=prompt)])],
+            generation_config=self.generation_config,
+            safety_settings=self.safety_settings,
+        )
+
+    async def generate_content_async(self, prompt: str) -> genai.types.GenerateContentResponse:
+        response = await self.client.generate_content(self._request(prompt))
+        return genai.types.GenerateContentResponse.from_response(response)
+
+    async def count_tokens_async(self, prompt: str) -> glm.CountTokensResponse:
+        request = glm.CountTokensRequest(model=self.model_name, generate_content_request=self._request(prompt))
+        return await self.client.count_tokens(request)
+
+
+def _get_inflight_semaphore() -> asyncio.Semaphore:
+    """Обмеження одночасних запитів до Gemini в межах процесу (GEMINI_MAX_IN_FLIGHT)"""
+    loop = asyncio.get_running_loop()
+    semaphore = _inflight_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max(1, settings.GEMINI_MAX_IN_FLIGHT))
+        _inflight_semaphores[loop] = semaphore
+    return semaphore
 
 
 class GeminiService:
@@ -145,6 +272,7 @@ HTML контент сайту {domain}:
             model_name: Назва моделі Gemini (якщо None - береться з settings.GEMINI_MODEL)
         """
         self.api_key = api_key or settings.GEMINI_API_KEY
+        self.key_id = api_key_id(self.api_key)
         self.prompt_template = prompt_template or self.DEFAULT_PROMPT
         self.model_name = model_name or getattr(settings, "GEMINI_MODEL", "gemini-2.0-flash")
         self.max_retries = 3
@@ -159,6 +287,11 @@ HTML контент сайту {domain}:
             "top_k": 40,
             "max_output_tokens": 8192,
         }
+        # Structured output: Gemini повертає чистий JSON масив за схемою DealSchema
+        self.structured_output = settings.GEMINI_STRUCTURED_OUTPUT
+        if self.structured_output:
+            self.generation_config["response_mime_type"] = "application/json"
+            self.generation_config["response_schema"] = _deals_response_schema()
         
         # Налаштування безпеки (дозволяємо весь контент для парсингу)
         self.safety_settings = [
@@ -174,27 +307,61 @@ HTML контент сайту {domain}:
             generation_config=self.generation_config,
             safety_settings=self.safety_settings
         )
+        # Конфіг генерації у формі protos (схема structured output нормалізується один раз)
+        self._request_generation_config = genai.types.generation_types.to_generation_config_dict(
+            self.generation_config
+        )
         
         logger.info(f"GeminiService ініціалізовано з моделлю {self.model_name}")
     
-    def _prepare_prompt(self, html_content: str, domain: str) -> str:
+    def _content_token_budget(self, template: str) -> int:
+        """
+        Бюджет токенів для контенту: GEMINI_MAX_INPUT_TOKENS мінус шаблон промпту,
+        але не більше, ніж лишається у вікні контексту після резерву на max_output_tokens.
+        """
+        template_tokens = estimate_tokens(template)
+        context_room = (
+            settings.GEMINI_CONTEXT_WINDOW - template_tokens - self.generation_config["max_output_tokens"]
+        )
+        budget = context_room
+        if settings.GEMINI_MAX_INPUT_TOKENS:
+            budget = min(budget, settings.GEMINI_MAX_INPUT_TOKENS - template_tokens)
+        return max(1, budget)
+
+    def _fit_content(self, content: str, template: str, domain: str, kind: str) -> Tuple[str, Dict]:
+        """Вмістити контент у бюджет токенів (по межах секцій, акційні секції першими)"""
+        template = template.replace("{domain}", domain)
+        content, budget_info = fit_to_budget(content, self._content_token_budget(template))
+        budget_info["template_tokens"] = estimate_tokens(template)
+        if budget_info["truncated"]:
+            logger.warning(
+                f"[Gemini] {kind} обрізано для {domain!r}: ~{budget_info['original_tokens']} → "
+                f"~{budget_info['content_tokens']} токенів, відкинуто секцій: {budget_info['dropped_sections']}"
+            )
+        return content, budget_info
+
+    def _prepare_prompt(self, html_content: str, domain: str, fit: bool = True) -> Tuple[str, Dict]:
         """
         Підготувати промпт з HTML контентом
         
         Args:
             html_content: Очищений HTML контент
             domain: Домен сайту
+            fit: Вміщувати контент у бюджет (False — частина вже поділена split_to_chunks)
         
         Returns:
-            Готовий промпт
+            (prompt, budget_info): готовий промпт та оцінка токенів контенту/шаблону
         """
-        max_len = getattr(settings, "GEMINI_MAX_CONTENT_LENGTH", 80000) or 0
-        if max_len and len(html_content) > max_len:
-            orig_len = len(html_content)
-            html_content = html_content[:max_len] + "\n...(контент обрізано)"
-            logger.warning(
-                f"[Gemini] HTML обрізано для {domain!r}: orig={orig_len} max={max_len} (GEMINI_MAX_CONTENT_LENGTH)"
-            )
+        template = self.prompt_template.replace("{html_content}", "")
+        if fit:
+            html_content, budget_info = self._fit_content(html_content, template, domain, "HTML")
+        else:
+            budget_info = {
+                "content_tokens": estimate_tokens(html_content),
+                "budget_tokens": self._content_token_budget(template.replace("{domain}", domain)),
+                "truncated": False,
+                "template_tokens": estimate_tokens(template.replace("{domain}", domain)),
+            }
         
         # Використовуємо .replace() замість .format() щоб уникнути KeyError
         # якщо промпт містить {shop}, {code} тощо як приклади JSON
@@ -202,23 +369,17 @@ HTML контент сайту {domain}:
         prompt = prompt.replace("{domain}", domain)
         prompt = prompt.replace("{html_content}", html_content)
         
-        return prompt
+        return prompt, budget_info
 
-    def _prepare_email_prompt(self, email_body: str, domain: str) -> str:
+    def _prepare_email_prompt(self, email_body: str, domain: str) -> Tuple[str, Dict]:
         """
         Підготувати промпт для листа (email); placeholder [EMAIL], {domain}.
-        Обрізає тіло листа до GEMINI_MAX_CONTENT_LENGTH при потребі.
+        Вміщує тіло листа в бюджет токенів при потребі.
         """
-        max_len = getattr(settings, "GEMINI_MAX_CONTENT_LENGTH", 80000) or 0
-        body = email_body
-        if max_len and len(body) > max_len:
-            orig_len = len(body)
-            body = body[:max_len] + "\n...(контент обрізано)"
-            logger.warning(
-                f"[Gemini] Тіло листа обрізано для {domain!r}: orig={orig_len} max={max_len} (GEMINI_MAX_CONTENT_LENGTH)"
-            )
+        template = EMAIL_DEALS_PROMPT.replace("[EMAIL]", "")
+        body, budget_info = self._fit_content(email_body, template, domain, "Тіло листа")
         # Використовуємо .replace() для обох плейсхолдерів, бо промпт містить JSON-приклад з {..}
-        return EMAIL_DEALS_PROMPT.replace("[EMAIL]", body).replace("{domain}", domain)
+        return EMAIL_DEALS_PROMPT.replace("[EMAIL]", body).replace("{domain}", domain), budget_info
     
     def _get_response_text(self, response) -> str:
         """Безпечно отримати текст з відповіді Gemini (SDK іноді кидає при .text)."""
@@ -268,13 +429,18 @@ HTML контент сайту {domain}:
         except Exception as e:
             logger.warning(f"[Gemini diag] domain={domain!r} diagnostic failed: {type(e).__name__}: {e}")
     
-    def _parse_json_response(self, response_text: str) -> List[Dict]:
+    def _parse_json_response(self, response_text: str) -> Optional[List[Dict]]:
         """
         Розпарсити JSON відповідь від Gemini.
         Підтримує масив [...], об'єкт {"deals": [...]} / {"data": [...]}, markdown блоки.
+        
+        Returns:
+            Список угод; [] — відповідь декодується, але угод у ній немає (порожній
+            масив/об'єкт, текст "акцій не знайдено" без JSON); None — порожня відповідь
+            або JSON, який не вдалося декодувати (обрізаний, зламаний)
         """
         if not response_text or not isinstance(response_text, str):
-            return []
+            return None
         raw = response_text.strip()
         # Прибираємо markdown
         for prefix in ("```json", "```"):
@@ -284,7 +450,7 @@ HTML контент сайту {domain}:
             raw = raw[:-3].strip()
         raw = raw.strip()
         if not raw:
-            return []
+            return None
 
         def as_list(obj) -> List[Dict]:
             if isinstance(obj, list):
@@ -293,36 +459,44 @@ HTML контент сайту {domain}:
                 for key in ("deals", "data", "items", "results"):
                     if key in obj and isinstance(obj[key], list):
                         return [x for x in obj[key] if isinstance(x, dict)]
-                return []
+                # Одна угода без обгортки: {"code": ..., "description": ...}
+                if any(key in obj for key in DEAL_KEYS):
+                    return [obj]
             return []
 
-        # Спочатку шукаємо масив [...]
-        m = re.search(r'\[[\s\S]*\]', raw)
-        if m:
-            try:
-                data = json.loads(m.group(0))
-                out = as_list(data)
-                if out:
-                    return out
-            except json.JSONDecodeError:
-                pass
-        # Потім об'єкт {...}
-        m = re.search(r'\{[\s\S]*\}', raw)
-        if m:
+        parsed = None
+        # Спочатку шукаємо масив [...], потім об'єкт {...}, потім прямий парс
+        candidates = [m.group(0) for m in (re.search(r'\[[\s\S]*\]', raw), re.search(r'\{[\s\S]*\}', raw)) if m]
+        for candidate in candidates + [raw]:
             try:
-                data = json.loads(m.group(0))
-                out = as_list(data)
-                if out:
-                    return out
+                out = as_list(json.loads(candidate))
             except json.JSONDecodeError:
-                pass
-        # Прямий парс
-        try:
-            data = json.loads(raw)
-            return as_list(data)
-        except json.JSONDecodeError:
-            return []
+                continue
+            if out:
+                return out
+            parsed = out
+        if parsed is not None:
+            return parsed
+        # Нічого не декодувалось: текст без JSON — відповідь "акцій немає",
+        # а JSON, що обривається чи зламаний, — помилка
+        if "[" in raw or "{" in raw:
+            return None
+        return []
     
+    def _parse_response(self, response_text: str) -> Optional[List[Dict]]:
+        """
+        Розпарсити відповідь Gemini. У режимі structured output — один json.loads,
+        а regex парсер лише як запасний варіант для невалідної відповіді.
+        """
+        if self.structured_output and response_text:
+            try:
+                data = json.loads(response_text)
+                if isinstance(data, list):
+                    return [x for x in data if isinstance(x, dict)]
+            except json.JSONDecodeError as e:
+                logger.warning(f"[Gemini] Structured output не є валідним JSON ({e}), fallback на regex парсер")
+        return self._parse_json_response(response_text)
+
     def _validate_deals(self, deals_data: List[Dict]) -> Tuple[List[DealSchema], List[Dict]]:
         """
         Валідувати дані через Pydantic схему.
@@ -346,8 +520,13 @@ HTML контент сайту {domain}:
         return valid_deals, invalid_deals
     
     def _get_content_hash(self, content: str) -> str:
-        """Отримати короткий hash контенту для кешування"""
-        return hashlib.sha256(content.encode()).hexdigest()[:16]
+        """Отримати короткий hash канонізованого контенту для кешування"""
+        return hashlib.sha256(canonicalize_content(content).encode()).hexdigest()[:16]
+
+    def _get_cache_key(self, content: str, domain: str) -> str:
+        """Ключ кешу: домен + відбиток промпту та моделі + hash канонізованого контенту"""
+        prompt_hash = prompt_fingerprint(self.prompt_template, self.model_name)
+        return f"{CACHE_PREFIX}{domain}:{prompt_hash}:{self._get_content_hash(content)}"
     
     async def _get_cached_result(self, cache_key: str) -> Optional[Tuple[List[DealSchema], Dict]]:
         """
@@ -368,7 +547,9 @@ HTML контент сайту {domain}:
             logger.debug(f"Cache read error: {e}")
         return None
     
-    async def _set_cached_result(self, cache_key: str, deals: List[DealSchema], metadata: Dict):
+    async def _set_cached_result(
+        self, cache_key: str, deals: List[DealSchema], metadata: Dict, ttl: int = CACHE_TTL
+    ):
         """
         Зберегти результат в кеш.
         Uses shared async Redis client for non-blocking operations.
@@ -380,7 +561,7 @@ HTML контент сайту {domain}:
                 "deals": [d.model_dump() for d in deals],
                 "metadata": {k: v for k, v in metadata.items() if k != "raw_response"}
             }
-            await redis_client.setex(cache_key, CACHE_TTL, json.dumps(data, default=str))
+            await redis_client.setex(cache_key, ttl, json.dumps(data, default=str))
             logger.debug(f"Cached result: {cache_key}")
         except Exception as e:
             logger.debug(f"Cache write error: {e}")
@@ -403,7 +584,8 @@ HTML контент сайту {domain}:
             Tuple[deals, error_message, metadata]:
             - deals: Список валідних DealSchema об'єктів
             - error_message: Повідомлення про помилку або None
-            - metadata: Додаткова інформація (кількість спроб, raw response тощо)
+            - metadata: Додаткова інформація (кількість спроб, raw response тощо);
+              "empty": True — Gemini валідно відповів, що акцій немає (не помилка)
         """
         metadata = {
             "attempts": 0,
@@ -415,23 +597,95 @@ HTML контент сайту {domain}:
         # Перевіряємо кеш
         cache_key = None
         if use_cache:
-            content_hash = self._get_content_hash(html_content)
-            cache_key = f"{CACHE_PREFIX}{domain}:{content_hash}"
+            cache_key = self._get_cache_key(html_content, domain)
             cached = await self._get_cached_result(cache_key)
             if cached:
+                await metrics.incr("gemini.cache.hit")
+                if cached[1].get("empty"):
+                    await metrics.incr("gemini.cache.hit_empty")
                 return cached[0], None, cached[1]
+            await metrics.incr("gemini.cache.miss")
 
-        prompt = self._prepare_prompt(html_content, domain)
-        deals, error, metadata = await self._extract_deals_core(prompt, domain)
+        template = self.prompt_template.replace("{html_content}", "").replace("{domain}", domain)
+        budget = self._content_token_budget(template)
+        if settings.GEMINI_CHUNKED_MODE and estimate_tokens(html_content) > budget:
+            deals, error, metadata = await self._extract_deals_chunked(html_content, domain, budget)
+        else:
+            prompt, budget_info = self._prepare_prompt(html_content, domain)
+            deals, error, metadata = await self._extract_deals_core(prompt, domain, budget_info)
         
-        # Кешуємо успішний результат
-        if cache_key and deals and not error:
-            await self._set_cached_result(cache_key, deals, metadata)
+        # Кешуємо успішний результат; "акцій немає" — з коротшим TTL.
+        # Помилки, частково невдалий chunked аналіз та відповідь, де всі угоди
+        # невалідні, не кешуються.
+        if cache_key and not error and not metadata.get("chunk_errors"):
+            if deals:
+                await self._set_cached_result(cache_key, deals, metadata)
+            elif metadata.get("empty"):
+                await self._set_cached_result(cache_key, deals, metadata, EMPTY_CACHE_TTL)
         
         return deals, error, metadata
 
+    async def _extract_deals_chunked(
+        self, html_content: str, domain: str, budget: int
+    ) -> Tuple[List[DealSchema], Optional[str], Dict]:
+        """
+        Map-reduce для контенту, більшого за бюджет токенів: частини по межах
+        секцій аналізуються паралельно (кожен запит проходить спільну квоту
+        RPM/TPM та GEMINI_MAX_IN_FLIGHT), угоди зводяться без дублікатів
+        за (code, description).
+        """
+        chunks, split_info = split_to_chunks(html_content, budget, settings.GEMINI_MAX_CHUNKS)
+        logger.info(f"[Gemini] {domain}: контент ~{split_info['content_tokens']} токенів, {len(chunks)} частин")
+
+        async def run_chunk(chunk: str):
+            started = time.perf_counter()
+            # Частина вже в межах бюджету — повторний fit_to_budget міг би її відкинути
+            prompt, budget_info = self._prepare_prompt(chunk, domain, fit=False)
+            result = await self._extract_deals_core(prompt, domain, budget_info)
+            elapsed = time.perf_counter() - started
+            await metrics.record_timing("gemini.chunk", elapsed)
+            return result, elapsed
+
+        results = await asyncio.gather(*(run_chunk(chunk) for chunk in chunks))
+
+        deals: List[DealSchema] = []
+        seen = set()
+        chunk_stats = []
+        errors = []
+        for index, ((chunk_deals, chunk_error, chunk_meta), elapsed) in enumerate(results):
+            chunk_stats.append({
+                "index": index,
+                "seconds": round(elapsed, 3),
+                "tokens": chunk_meta.get("tokens"),
+                "attempts": chunk_meta.get("attempts"),
+                "deals": len(chunk_deals),
+                "error": chunk_error,
+            })
+            if chunk_error:
+                errors.append(chunk_error)
+            for deal in chunk_deals:
+                key = (deal.code.strip().upper(), deal.description.strip().lower())
+                if key not in seen:
+                    seen.add(key)
+                    deals.append(deal)
+
+        metadata = {
+            "attempts": sum(s["attempts"] or 0 for s in chunk_stats),
+            "raw_response": None,
+            "invalid_deals_count": sum(meta.get("invalid_deals_count", 0) for (_, _, meta), _ in results),
+            "parse_error": errors[0] if errors else None,
+            "chunked": {**split_info, "stats": chunk_stats},
+        }
+        if errors:
+            metadata["chunk_errors"] = len(errors)
+        if len(errors) == len(chunks):
+            return [], errors[0], metadata
+        if not deals and not errors and all(meta.get("empty") for (_, _, meta), _ in results):
+            metadata["empty"] = True
+        return deals, None, metadata
+
     async def _extract_deals_core(
-        self, prompt: str, domain: str
+        self, prompt: str, domain: str, budget_info: Optional[Dict] = None
     ) -> Tuple[List[DealSchema], Optional[str], Dict]:
         """Спільна логіка: запит до Gemini, парсинг JSON, валідація угод (для HTML та email)."""
         metadata = {
@@ -441,15 +695,35 @@ HTML контент сайту {domain}:
             "parse_error": None,
         }
 
+        estimated_tokens = estimate_request_tokens(prompt)
+        metadata["tokens"] = {**(budget_info or {}), "prompt_tokens_estimated": estimated_tokens}
+        if settings.GEMINI_COUNT_TOKENS:
+            counted = await self._count_tokens(prompt)
+            if counted:
+                metadata["tokens"]["prompt_tokens_counted"] = counted
+                estimated_tokens = counted
+
         for attempt in range(1, self.max_retries + 1):
             metadata["attempts"] = attempt
+            key_id = self.key_id
             try:
-                # Rate limiting - чекаємо якщо потрібно
-                await _rate_limiter.acquire()
+                # Rate limiting - спільна квота RPM/TPM всіх worker-ів, ключ з найбільшим запасом
+                lease = await self._acquire_quota(estimated_tokens)
+                if lease is None:
+                    error_msg = "Gemini API: не дочекалися квоти (RPM/TPM)"
+                    logger.warning(f"{error_msg} для {domain}")
+                    metadata["parse_error"] = error_msg
+                    if attempt >= self.max_retries:
+                        return [], error_msg, metadata
+                    continue
+                key_id, api_key = lease
+                metadata["api_key_id"] = key_id
                 
-                logger.info(f"Спроба {attempt}/{self.max_retries}: Відправка запиту до Gemini для {domain}")
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(None, self.model.generate_content, prompt)
+                logger.info(f"Спроба {attempt}/{self.max_retries}: Відправка запиту до Gemini для {domain} (key={key_id})")
+                async with _get_inflight_semaphore():
+                    response = await self._get_model(api_key).generate_content_async(prompt)
+                await self._record_usage(response, estimated_tokens, key_id)
+                metadata["tokens"].update(self._usage_tokens(response))
                 response_text = self._get_response_text(response)
                 metadata["raw_response"] = (response_text or "")[:2000]
 
@@ -469,9 +743,21 @@ HTML контент сайту {domain}:
                 if response_text:
                     logger.debug(f"Перші 500 символів відповіді: {response_text[:500]}")
 
-                deals_data = self._parse_json_response(response_text)
+                deals_data = self._parse_response(response_text)
+                if deals_data is None:
+                    # Обрізана/невалідна відповідь — це помилка, а не "акцій немає" (не кешується)
+                    self._log_response_diagnostics(response, domain, response_text, "unparseable")
+                    error_msg = "Gemini: не вдалося розпарсити відповідь"
+                    logger.warning(f"{error_msg} для {domain}")
+                    metadata["parse_error"] = error_msg
+                    if attempt >= self.max_retries:
+                        return [], error_msg, metadata
+                    wait_time = min(BACKOFF_BASE ** attempt, BACKOFF_MAX) + random.uniform(0, 1)
+                    await asyncio.sleep(wait_time)
+                    continue
                 if not deals_data:
                     logger.info(f"Gemini не знайшов жодної акції на {domain}")
+                    metadata["empty"] = True
                     return [], None, metadata
                 valid_deals, invalid_deals = self._validate_deals(deals_data)
                 metadata["invalid_deals_count"] = len(invalid_deals)
@@ -506,10 +792,14 @@ HTML контент сайту {domain}:
                 is_rate_limit = "429" in s or "ResourceExhausted" in s or "Resource exhausted" in s
                 
                 if is_rate_limit:
-                    # Exponential backoff з jitter для 429 помилок
-                    base_wait = min(BACKOFF_BASE ** (attempt + 2), BACKOFF_MAX)  # 4, 8, 16, 32...
-                    jitter = random.uniform(0, base_wait * BACKOFF_JITTER)
-                    wait_time = base_wait + jitter
+                    if await self._report_rate_limited(key_id):
+                        # В пулі є інші ключі — наступна спроба піде на них без довгого backoff
+                        wait_time = random.uniform(0, 1)
+                    else:
+                        # Exponential backoff з jitter для 429 помилок
+                        base_wait = min(BACKOFF_BASE ** (attempt + 2), BACKOFF_MAX)  # 4, 8, 16, 32...
+                        jitter = random.uniform(0, base_wait * BACKOFF_JITTER)
+                        wait_time = base_wait + jitter
                     error_msg = f"Gemini API: Rate limit (429). Чекаємо {wait_time:.1f}с..."
                     logger.warning(error_msg)
                     metadata["parse_error"] = error_msg
@@ -530,6 +820,65 @@ HTML контент сайту {domain}:
 
         return [], "Не вдалося витягнути дані після всіх спроб", metadata
 
+    def _get_model(self, api_key: str) -> _KeyModel:
+        """Модель з async клієнтом конкретного ключа пулу (викликати всередині loop)."""
+        return _KeyModel(
+            _get_async_client(api_key), self.model_name, self._request_generation_config, self.safety_settings
+        )
+
+    async def _acquire_quota(self, tokens: int) -> Optional[Tuple[str, str]]:
+        """
+        Отримати слот у розподіленій квоті на ключі пулу з найбільшим запасом.
+        Повертає (key_id, api_key) або None; при недоступному Redis — основний ключ і локальний ліміт процесу.
+        """
+        try:
+            return await get_key_pool().acquire(tokens, primary_key=self.api_key)
+        except Exception as e:
+            logger.warning(f"[RateLimiter] Розподілена квота недоступна ({type(e).__name__}: {e}), локальний ліміт")
+            await _rate_limiter.acquire()
+            return self.key_id, self.api_key
+
+    async def _count_tokens(self, prompt: str) -> Optional[int]:
+        """Точна кількість токенів промпту через count_tokens (GEMINI_COUNT_TOKENS)."""
+        try:
+            response = await self._get_model(self.api_key).count_tokens_async(prompt)
+            return int(response.total_tokens)
+        except Exception as e:
+            logger.debug(f"[Gemini] count_tokens недоступний: {type(e).__name__}: {e}")
+            return None
+
+    @staticmethod
+    def _usage_tokens(response) -> Dict:
+        """Фактичні токени запиту з usage_metadata відповіді."""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return {}
+        return {
+            "prompt_tokens": int(getattr(usage, "prompt_token_count", 0) or 0),
+            "output_tokens": int(getattr(usage, "candidates_token_count", 0) or 0),
+            "total_tokens": int(getattr(usage, "total_token_count", 0) or 0),
+        }
+
+    async def _record_usage(self, response, estimated_tokens: int, key_id: str):
+        """Донарахувати в TPM фактичні токени (вхід + відповідь) понад оцінку."""
+        try:
+            usage = getattr(response, "usage_metadata", None)
+            total = int(getattr(usage, "total_token_count", 0) or 0)
+            if total > estimated_tokens:
+                await get_distributed_limiter().consume(key_id, total - estimated_tokens)
+        except Exception as e:
+            logger.debug(f"[RateLimiter] Не вдалося врахувати usage: {e}")
+
+    async def _report_rate_limited(self, key_id: str) -> bool:
+        """Поставити ключ на cooldown після 429; True, якщо в пулі є інші ключі."""
+        try:
+            pool = get_key_pool()
+            await pool.report_rate_limited(key_id)
+            return len(await pool.get_keys(self.api_key)) > 1
+        except Exception as e:
+            logger.debug(f"[KeyPool] Не вдалося позначити 429 для {key_id}: {e}")
+            return False
+
     async def extract_deals_from_email(
         self, email_body: str, domain: str
     ) -> Tuple[List[DealSchema], Optional[str], Dict]:
@@ -537,8 +886,8 @@ HTML контент сайту {domain}:
         Витягнути угоди з тіла листа (email) за промптом для coupon website (French).
         Використовує DEFAULT_EMAIL_PROMPT з плейсхолдерами [EMAIL] та {domain}.
         """
-        prompt = self._prepare_email_prompt(email_body, domain)
-        return await self._extract_deals_core(prompt, domain)
+        prompt, budget_info = self._prepare_email_prompt(email_body, domain)
+        return await self._extract_deals_core(prompt, domain, budget_info)
     
     async def extract_deals_from_scraped_data(
         self,
@@ -563,4 +912,9 @@ HTML контент сайту {domain}:
         if not clean_html:
             return [], "Немає HTML контенту для аналізу", {}
 
-        return await self.extract_deals(clean_html, domain)
+        # Якщо знайдено акційні блоки — відправляємо лише їх
+        promo_html = content.get('promo_html')
+        deals, error, metadata = await self.extract_deals(promo_html or clean_html, domain)
+        if content.get('promo_stats'):
+            metadata["promo"] = {**content['promo_stats'], "used": bool(promo_html)}
+        return deals, error, metadata
@@ -0,0 +1,344 @@
+"""
+Розподілені квоти Gemini API
+
+GeminiRateLimiter у services/gemini.py обмежує запити лише в межах одного
+процесу, тож при кількох worker-ах та контейнерах сумарно ми перевищуємо
+квоту й отримуємо хвилі 429. Тут — token bucket у Redis (атомарний Lua скрипт),
+спільний для всіх worker-ів, з окремими бюджетами RPM та TPM на API ключ.
+"""
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.token_budget import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+QUOTA_PREFIX = "gemini:quota:"
+
+# KEYS[1] — bucket запитів (RPM), KEYS[2] — bucket токенів (TPM)
+# ARGV[1] — ємність RPM, ARGV[2] — ємність TPM, ARGV[3] — токенів на запит,
+# ARGV[4] — "1": лише списати токени (донарахування за фактом), без перевірки
+# Повертає 0, якщо слот отримано, інакше — скільки мс чекати до наступної спроби.
+TOKEN_BUCKET_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local rpm_cap = tonumber(ARGV[1])
+local tpm_cap = tonumber(ARGV[2])
+local cost = math.min(tonumber(ARGV[3]), tpm_cap)
+local force = ARGV[4] == '1'
+
+local function level(key, capacity)
+    local data = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(data[1])
+    local ts = tonumber(data[2])
+    if tokens == nil or ts == nil then
+        return capacity
+    end
+    return math.min(capacity, tokens + math.max(0, now - ts) * capacity / 60000)
+end
+
+local function store(key, tokens)
+    redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+    redis.call('PEXPIRE', key, 120000)
+end
+
+local requests = level(KEYS[1], rpm_cap)
+local tokens = level(KEYS[2], tpm_cap)
+
+if force then
+    store(KEYS[2], tokens - cost)
+    return 0
+end
+
+local wait = 0
+if requests < 1 then
+    wait = math.max(wait, (1 - requests) * 60000 / rpm_cap)
+end
+if tokens < cost then
+    wait = math.max(wait, (cost - tokens) * 60000 / tpm_cap)
+end
+if wait > 0 then
+    return math.ceil(wait)
+end
+
+store(KEYS[1], requests - 1)
+store(KEYS[2], tokens - cost)
+return 0
+"""
+
+
+def api_key_id(api_key: str) -> str:
+    """Короткий ідентифікатор ключа для Redis (сам ключ не зберігаємо)"""
+    return hashlib.sha256((api_key or "").encode()).hexdigest()[:12]
+
+
+def estimate_request_tokens(prompt: str) -> int:
+    """Оцінка токенів запиту для резервування TPM"""
+    return max(1, estimate_tokens(prompt or ""))
+
+
+class DistributedRateLimiter:
+    """
+    Token bucket у Redis, спільний для всіх worker-ів
+
+    - RPM: 1 токен на запит, ємність = requests_per_minute
+    - TPM: оцінка токенів запиту, ємність = tokens_per_minute
+    - Поповнення лінійне, час береться з Redis (TIME), тож годинники worker-ів не важливі
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None
+    ):
+        self.requests_per_minute = requests_per_minute or settings.GEMINI_RPM_LIMIT
+        self.tokens_per_minute = tokens_per_minute or settings.GEMINI_TPM_LIMIT
+        self._script = None
+        self._script_client = None
+
+    async def _run_script(self, key_id: str, tokens: int, force: bool = False) -> int:
+        from app.services.gemini import get_async_redis_client
+
+        client = await get_async_redis_client()
+        if self._script is None or self._script_client is not client:
+            self._script = client.register_script(TOKEN_BUCKET_LUA)
+            self._script_client = client
+        wait_ms = await self._script(
+            keys=[f"{QUOTA_PREFIX}{key_id}:rpm", f"{QUOTA_PREFIX}{key_id}:tpm"],
+            args=[self.requests_per_minute, self.tokens_per_minute, int(tokens), "1" if force else "0"],
+        )
+        return int(wait_ms)
+
+    async def try_acquire(self, key_id: str, tokens: int = 0) -> float:
+        """Спробувати отримати слот; повертає 0 при успіху або секунди до наступної спроби"""
+        return await self._run_script(key_id, tokens) / 1000.0
+
+    async def acquire(self, key_id: str, tokens: int = 0, timeout: Optional[float] = None) -> bool:
+        """
+        Дочекатися слоту для запиту
+
+        Args:
+            key_id: Ідентифікатор API ключа (api_key_id)
+            tokens: Оцінка токенів запиту (для TPM)
+            timeout: Максимальний час очікування в секундах (None = GEMINI_QUOTA_WAIT_TIMEOUT)
+
+        Returns:
+            True якщо слот отримано, False якщо дедлайн минув
+        """
+        if timeout is None:
+            timeout = settings.GEMINI_QUOTA_WAIT_TIMEOUT
+        deadline = time.monotonic() + timeout
+
+        while True:
+            wait = await self.try_acquire(key_id, tokens)
+            if wait <= 0:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # Невеликий jitter, щоб worker-и не прокидалися одночасно
+            wait = min(wait + random.uniform(0, 0.1 * wait), remaining)
+            logger.info(f"[RateLimiter] Чекаємо {wait:.1f}с на квоту Gemini (key={key_id})...")
+            await asyncio.sleep(wait)
+
+    async def consume(self, key_id: str, tokens: int):
+        """Списати токени без перевірки (різниця між оцінкою та фактичним використанням)"""
+        if tokens > 0:
+            await self._run_script(key_id, tokens, force=True)
+
+
+# Глобальний інстанс (стан живе в Redis, тож інстанс на процес достатній)
+_distributed_limiter: Optional[DistributedRateLimiter] = None
+
+
+def get_distributed_limiter() -> DistributedRateLimiter:
+    global _distributed_limiter
+    if _distributed_limiter is None:
+        _distributed_limiter = DistributedRateLimiter()
+    return _distributed_limiter
+
+
+# ========== Пул API ключів ==========
+
+KEY_POOL_REDIS_KEY = "config:gemini_keys"  # hash: key_id → api_key
+KEY_POOL_REFRESH_INTERVAL = 10  # секунд між перечитуванням пулу з Redis
+
+# Поточний стан bucket-ів без списання: для кожного key_id повертає
+# {залишок RPM, залишок TPM, мс до кінця cooldown після 429}
+# KEYS — трійки на кожен key_id: bucket RPM, bucket TPM, ключ cooldown
+# ARGV[1] — ємність RPM, ARGV[2] — ємність TPM
+HEADROOM_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local rpm_cap = tonumber(ARGV[1])
+local tpm_cap = tonumber(ARGV[2])
+
+local function level(key, capacity)
+    local data = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(data[1])
+    local ts = tonumber(data[2])
+    if tokens == nil or ts == nil then
+        return capacity
+    end
+    return math.min(capacity, tokens + math.max(0, now - ts) * capacity / 60000)
+end
+
+local out = {}
+for i = 1, #KEYS, 3 do
+    local cooldown = redis.call('PTTL', KEYS[i + 2])
+    table.insert(out, {
+        tostring(level(KEYS[i], rpm_cap)),
+        tostring(level(KEYS[i + 1], tpm_cap)),
+        math.max(cooldown, 0)
+    })
+end
+return out
+"""
+
+
+def mask_api_key(api_key: str) -> str:
+    """Замаскований ключ для відображення в UI"""
+    if len(api_key) <= 8:
+        return "***"
+    return f"{api_key[:4]}...{api_key[-4:]}"
+
+
+class GeminiKeyPool:
+    """
+    Пул Gemini API ключів з квотами на кожен ключ
+
+    - Ключі зберігаються в Redis (config:gemini_keys), додаються/видаляються через
+      config API без рестарту — пул перечитується кожні KEY_POOL_REFRESH_INTERVAL секунд
+    - Кожен ключ має власний token bucket (RPM/TPM) у DistributedRateLimiter
+    - Після 429 ключ отримує cooldown (GEMINI_KEY_COOLDOWN), спільний для всіх worker-ів
+    - Запит іде на ключ з найбільшим запасом квоти
+    """
+
+    def __init__(self, limiter: Optional[DistributedRateLimiter] = None):
+        self.limiter = limiter or get_distributed_limiter()
+        self._keys: Dict[str, str] = {}
+        self._loaded_at = 0.0
+        self._headroom_script = None
+        self._script_client = None
+
+    async def _client(self):
+        from app.services.gemini import get_async_redis_client
+        return await get_async_redis_client()
+
+    async def get_keys(self, primary_key: Optional[str] = None) -> Dict[str, str]:
+        """Ключі пулу (key_id → api_key) разом з основним ключем сервісу"""
+        now = time.monotonic()
+        if now - self._loaded_at > KEY_POOL_REFRESH_INTERVAL:
+            client = await self._client()
+            self._keys = await client.hgetall(KEY_POOL_REDIS_KEY) or {}
+            self._loaded_at = now
+
+        keys = dict(self._keys)
+        if primary_key:
+            keys.setdefault(api_key_id(primary_key), primary_key)
+        return keys
+
+    async def get_headroom(self, key_ids: List[str]) -> Dict[str, Dict]:
+        """Поточний запас квоти та cooldown для ключів"""
+        if not key_ids:
+            return {}
+        client = await self._client()
+        if self._headroom_script is None or self._script_client is not client:
+            self._headroom_script = client.register_script(HEADROOM_LUA)
+            self._script_client = client
+        keys = []
+        for key_id in key_ids:
+            keys += [f"{QUOTA_PREFIX}{key_id}:rpm", f"{QUOTA_PREFIX}{key_id}:tpm", f"{QUOTA_PREFIX}{key_id}:cooldown"]
+        rows = await self._headroom_script(
+            keys=keys,
+            args=[self.limiter.requests_per_minute, self.limiter.tokens_per_minute],
+        )
+        headroom = {}
+        for key_id, (rpm_left, tpm_left, cooldown_ms) in zip(key_ids, rows):
+            rpm_left, tpm_left = float(rpm_left), float(tpm_left)
+            headroom[key_id] = {
+                "remaining_rpm": rpm_left,
+                "remaining_tpm": tpm_left,
+                "cooldown_seconds": int(cooldown_ms) / 1000.0,
+                # Запас — найвужче з двох обмежень
+                "score": min(rpm_left / self.limiter.requests_per_minute, tpm_left / self.limiter.tokens_per_minute),
+            }
+        return headroom
+
+    async def acquire(
+        self,
+        tokens: int,
+        primary_key: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Отримати слот на ключі з найбільшим запасом квоти
+
+        Returns:
+            (key_id, api_key) або None, якщо за timeout жоден ключ не звільнився
+        """
+        if timeout is None:
+            timeout = settings.GEMINI_QUOTA_WAIT_TIMEOUT
+        deadline = time.monotonic() + timeout
+
+        while True:
+            keys = await self.get_keys(primary_key)
+            if not keys:
+                return None
+
+            headroom = await self.get_headroom(list(keys))
+            ready = [k for k in keys if headroom[k]["cooldown_seconds"] <= 0]
+            ready.sort(key=lambda k: headroom[k]["score"], reverse=True)
+
+            waits = [headroom[k]["cooldown_seconds"] for k in keys if k not in ready]
+            for key_id in ready:
+                wait = await self.limiter.try_acquire(key_id, tokens)
+                if wait <= 0:
+                    return key_id, keys[key_id]
+                waits.append(wait)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            wait = min(min(waits) + random.uniform(0, 0.1), remaining)
+            logger.info(f"[KeyPool] Всі {len(keys)} ключів без квоти, чекаємо {wait:.1f}с...")
+            await asyncio.sleep(wait)
+
+    async def report_rate_limited(self, key_id: str, cooldown: Optional[float] = None):
+        """Позначити ключ як такий, що отримав 429 — інші worker-и його оминатимуть"""
+        cooldown = cooldown or settings.GEMINI_KEY_COOLDOWN
+        client = await self._client()
+        await client.set(f"{QUOTA_PREFIX}{key_id}:cooldown", "1", px=int(cooldown * 1000))
+        logger.warning(f"[KeyPool] Ключ {key_id} на cooldown {cooldown:.0f}с після 429")
+
+    async def get_stats(self, primary_key: Optional[str] = None) -> List[Dict]:
+        """Стан ключів для config API (без самих ключів)"""
+        keys = await self.get_keys(primary_key)
+        headroom = await self.get_headroom(list(keys))
+        pool_ids = set(self._keys)
+        return [
+            {
+                "key_id": key_id,
+                "masked_key": mask_api_key(api_key),
+                "source": "pool" if key_id in pool_ids else "primary",
+                "remaining_rpm": round(headroom[key_id]["remaining_rpm"], 2),
+                "remaining_tpm": int(headroom[key_id]["remaining_tpm"]),
+                "cooldown_seconds": headroom[key_id]["cooldown_seconds"],
+            }
+            for key_id, api_key in keys.items()
+        ]
+
+
+_key_pool: Optional[GeminiKeyPool] = None
+
+
+def get_key_pool() -> GeminiKeyPool:
+    global _key_pool
+    if _key_pool is None:
+        _key_pool = GeminiKeyPool()
+    return _key_pool
@@ -0,0 +1,257 @@
+"""
+Екстрактори видимого контенту з HTML
+
+WebScraper.extract_visible_content делегує сюди. Бекенд обирається через
+HTML_EXTRACTOR_BACKEND:
+- lxml — прямо через lxml.html: видалення тегів одним strip_elements,
+  текст через XPath, серіалізація без перебудови дерева (за замовчуванням)
+- bs4  — попередня реалізація на BeautifulSoup (для порівняння/відкату)
+
+Обидва повертають однаковий dict: title, text, links, meta_description,
+clean_html (+ promo_html/promo_stats при PROMO_EXTRACTOR_ENABLED,
+structured_offers/structured_stats при STRUCTURED_OFFERS_MODE != off).
+Порівняння швидкості: backend/scripts/bench_html_extractors.py
+"""
+import logging
+import re
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import urljoin
+
+import lxml.html
+from bs4 import BeautifulSoup
+from lxml import etree
+
+from app.core.config import settings
+from app.services.promo_extractor import extract_promo_blocks, select_promo_blocks
+from app.services.structured_offers import extract_structured_offers
+
+logger = logging.getLogger(__name__)
+
+# Константи
+MAX_TEXT_LENGTH = 50000
+MAX_LINKS_COUNT = 100
+MAX_HTML_LENGTH = 100000
+
+# Теги, що не потрапляють у контент
+REMOVED_TAGS = ('script', 'style', 'nav', 'footer', 'header', 'iframe', 'noscript')
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+_parsers: Dict[str, Any] = {}
+
+
+def _html_parser(encoding: str):
+    """HTMLParser з явним кодуванням (для bytes без charset у meta)"""
+    parser = _parsers.get(encoding)
+    if parser is None:
+        try:
+            parser = lxml.html.HTMLParser(encoding=encoding)
+        except LookupError:
+            parser = lxml.html.HTMLParser()
+        _parsers[encoding] = parser
+    return parser
+
+
+def _parse_lxml(html: Union[str, bytes], encoding: Optional[str]):
+    if isinstance(html, bytes) and encoding:
+        return lxml.html.document_fromstring(html, parser=_html_parser(encoding))
+    try:
+        return lxml.html.document_fromstring(html)
+    except ValueError:
+        # str з XML декларацією кодування lxml не приймає — парсимо як bytes
+        if isinstance(html, str):
+            return lxml.html.document_fromstring(html.encode('utf-8', errors='replace'))
+        raise
+
+
+def _structured_fields(root, base_url: str) -> Dict[str, Any]:
+    """structured_offers/structured_stats (дерево ще з <script>)"""
+    if settings.STRUCTURED_OFFERS_MODE == "off":
+        return {}
+    offers, stats = extract_structured_offers(root, base_url)
+    return {'structured_offers': offers, 'structured_stats': stats}
+
+
+class HtmlExtractor(ABC):
+    """Базовий екстрактор: спільна обрізка та виділення акційних блоків"""
+
+    name = ""
+
+    def extract(self, html: Union[str, bytes], base_url: str, encoding: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Витягнути видимий контент з HTML
+
+        Args:
+            html: HTML контент (str або сирі bytes)
+            base_url: Базовий URL для резолюції відносних посилань
+            encoding: Кодування, якщо html — bytes (None — визначає парсер)
+
+        Returns:
+            Dict: title, text, links, meta_description, clean_html
+            (+ promo_html, promo_stats при PROMO_EXTRACTOR_ENABLED;
+            structured_offers, structured_stats при STRUCTURED_OFFERS_MODE != off)
+        """
+        content, clean_html, root = self._extract(html, base_url, encoding)
+        content['clean_html'] = clean_html[:MAX_HTML_LENGTH]
+
+        # Лише акційні блоки (повний clean_html, до обрізки) — в Gemini йде менше токенів
+        if settings.PROMO_EXTRACTOR_ENABLED:
+            options = {"top_k": settings.PROMO_TOP_K, "context": settings.PROMO_CONTEXT_BLOCKS}
+            if root is not None:
+                promo_html, promo_stats = select_promo_blocks(root, len(clean_html), **options)
+            else:
+                promo_html, promo_stats = extract_promo_blocks(clean_html, **options)
+            content['promo_html'] = promo_html
+            content['promo_stats'] = promo_stats
+            logger.info(
+                f"[Promo] {base_url}: {promo_stats['blocks_selected']} блоків, "
+                f"shrink_ratio={promo_stats['shrink_ratio']}"
+            )
+
+        return content
+
+    @abstractmethod
+    def _extract(
+        self, html: Union[str, bytes], base_url: str, encoding: Optional[str]
+    ) -> Tuple[Dict[str, Any], str, Optional[Any]]:
+        """
+        Returns:
+            (content без clean_html, повний clean_html, lxml дерево або None)
+        """
+
+
+class BeautifulSoupExtractor(HtmlExtractor):
+    """Попередня реалізація на BeautifulSoup"""
+
+    name = "bs4"
+
+    def _extract(self, html, base_url, encoding):
+        if isinstance(html, bytes) and encoding:
+            soup = BeautifulSoup(html, 'lxml', from_encoding=encoding)
+        else:
+            soup = BeautifulSoup(html, 'lxml')
+
+        # Структуровані дані — з окремого lxml дерева, до видалення <script>
+        structured = {}
+        if settings.STRUCTURED_OFFERS_MODE != "off" and html:
+            try:
+                structured = _structured_fields(_parse_lxml(html, encoding), base_url)
+            except (etree.ParserError, ValueError) as e:
+                logger.debug(f"lxml не зміг розпарсити {base_url}: {e}")
+
+        # Видаляємо непотрібні теги
+        for tag in soup(list(REMOVED_TAGS)):
+            tag.decompose()
+
+        # Витягуємо title
+        title = soup.title.string if soup.title else ""
+
+        # Витягуємо meta description
+        meta_desc = ""
+        meta_tag = soup.find('meta', attrs={'name': 'description'})
+        if meta_tag and meta_tag.get('content'):
+            meta_desc = meta_tag.get('content')
+
+        # Витягуємо видимий текст
+        text = soup.get_text(separator=' ', strip=True)
+        # Очищаємо множинні пробіли та переноси рядків
+        text = _WHITESPACE_RE.sub(' ', text).strip()
+
+        # Витягуємо посилання
+        links = []
+        for link in soup.find_all('a', href=True):
+            href = link['href']
+            # Резолвимо відносні посилання
+            absolute_url = urljoin(base_url, href)
+            link_text = link.get_text(strip=True)
+            if link_text:
+                links.append({
+                    'url': absolute_url,
+                    'text': link_text
+                })
+
+        content = {
+            'title': title.strip() if title else "",
+            'text': text[:MAX_TEXT_LENGTH],
+            'links': links[:MAX_LINKS_COUNT],
+            'meta_description': meta_desc.strip() if meta_desc else "",
+            **structured,
+        }
+        # Очищений HTML (для Gemini)
+        return content, str(soup), None
+
+
+class LxmlExtractor(HtmlExtractor):
+    """Пряма реалізація на lxml.html без побудови BeautifulSoup дерева"""
+
+    name = "lxml"
+
+    def _extract(self, html, base_url, encoding):
+        empty = {'title': "", 'text': "", 'links': [], 'meta_description': ""}
+        if not html or not html.strip():
+            return empty, "", None
+        try:
+            root = _parse_lxml(html, encoding)
+        except (etree.ParserError, ValueError) as e:
+            logger.debug(f"lxml не зміг розпарсити {base_url}: {e}")
+            return empty, "", None
+
+        structured = _structured_fields(root, base_url)
+
+        # Видаляємо непотрібні теги разом з вмістом (tail текст лишається)
+        etree.strip_elements(root, *REMOVED_TAGS, with_tail=False)
+
+        title = root.findtext('.//title') or ""
+
+        meta_desc = ""
+        for meta in root.iter('meta'):
+            if meta.get('name') == 'description' and meta.get('content'):
+                meta_desc = meta.get('content')
+                break
+
+        # Видимий текст: текстові вузли (без коментарів), як get_text(separator=' ', strip=True)
+        pieces = (t.strip() for t in root.xpath('//text()'))
+        text = _WHITESPACE_RE.sub(' ', ' '.join(p for p in pieces if p)).strip()
+
+        links: List[Dict[str, str]] = []
+        for link in root.iter('a'):
+            href = link.get('href')
+            if href is None:
+                continue
+            link_text = ''.join(t.strip() for t in link.itertext())
+            if link_text:
+                links.append({'url': urljoin(base_url, href), 'text': link_text})
+                if len(links) >= MAX_LINKS_COUNT:
+                    break
+
+        content = {
+            'title': title.strip(),
+            'text': text[:MAX_TEXT_LENGTH],
+            'links': links,
+            'meta_description': meta_desc.strip(),
+            **structured,
+        }
+        clean_html = lxml.html.tostring(root, encoding='unicode')
+        return content, clean_html, root
+
+
+EXTRACTORS = {
+    BeautifulSoupExtractor.name: BeautifulSoupExtractor,
+    LxmlExtractor.name: LxmlExtractor,
+}
+
+_extractors: Dict[str, HtmlExtractor] = {}
+
+
+def get_html_extractor(name: Optional[str] = None) -> HtmlExtractor:
+    """Екстрактор за назвою (за замовчуванням — HTML_EXTRACTOR_BACKEND)"""
+    name = name or settings.HTML_EXTRACTOR_BACKEND
+    extractor = _extractors.get(name)
+    if extractor is None:
+        if name not in EXTRACTORS:
+            logger.warning(f"Невідомий HTML_EXTRACTOR_BACKEND={name!r}, використовуємо lxml")
+            name = LxmlExtractor.name
+        extractor = _extractors.setdefault(name, EXTRACTORS[name]())
+    return extractor
@@ -1,11 +1,33 @@
 """
 Playwright-based scraper для обходу антибот захисту (Cloudflare, DataDome тощо)
 Оптимізовано для швидкодії та повторного використання браузера
+
+Браузер живе в event loop worker процесу (app.tasks.worker_loop), а рендери
+йдуть через пул з PLAYWRIGHT_POOL_SIZE прогрітих контекстів (context + page
+з init script та блокуванням ресурсів). Пул одночасно обмежує кількість
+рендерів: хто не отримав контекст — чекає. Між використаннями контекст
+скидається (cookies, about:blank), після PLAYWRIGHT_CONTEXT_MAX_USES або
+помилки — перестворюється.
+
+Метрики: playwright.acquire_wait (очікування контексту), playwright.render,
+playwright.context_created.
+
+PLAYWRIGHT_PRUNE_IN_BROWSER: замість page.content() (повний DOM, буває кілька
+МБ через pipe драйвера) сторінка чиститься прямо в браузері (PRUNE_DOM_SCRIPT) —
+повертається компактний HTML у тому ж форматі для extract_visible_content.
+
+Антибот cookies успішного рендеру (cf_clearance тощо) зберігаються до
+скидання контексту — ними користується aiohttp (app.services.clearance_cookies).
 """
 import asyncio
 import logging
-from typing import Optional, Tuple
-from playwright.async_api import async_playwright, Browser, Page, Playwright, Error as PlaywrightError
+import time
+from typing import Dict, Optional, Tuple
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page, Playwright, Error as PlaywrightError
+
+from app.core import metrics
+from app.core.config import settings
+from app.services.clearance_cookies import egress_id, save_clearance
 
 logger = logging.getLogger(__name__)
 
@@ -14,10 +36,90 @@ DEFAULT_TIMEOUT = 15000
 CLOUDFLARE_WAIT_TIMEOUT = 8000
 VIEWPORT_WIDTH = 1366
 VIEWPORT_HEIGHT = 768
+RENDER_TIMEOUT = 30.0  # загальний ліміт одного рендеру (секунди), без очікування контексту
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36'
+
+# Скрипт для приховування автоматизації (виконується в кожному документі контексту)
+STEALTH_INIT_SCRIPT = """
+    // Приховуємо webdriver
+    Object.defineProperty(navigator, 'webdriver', {
+        get: () => undefined
+    });
+    
+    // Приховуємо автоматизацію Chrome
+    window.chrome = {
+        runtime: {},
+        csi: function() {},
+        loadTimes: function() {}
+    };
+    
+    // Реалістичний plugins
+    Object.defineProperty(navigator, 'plugins', {
+        get: () => {
+            const plugins = [];
+            plugins.length = 3;
+            return plugins;
+        }
+    });
+    
+    // Фейковий languages
+    Object.defineProperty(navigator, 'languages', {
+        get: () => ['fr-FR', 'fr', 'en-US', 'en']
+    });
+    
+    // Permissions
+    const originalQuery = window.navigator.permissions.query;
+    window.navigator.permissions.query = (parameters) => (
+        parameters.name === 'notifications' ?
+            Promise.resolve({ state: Notification.permission }) :
+            originalQuery(parameters)
+    );
+"""
 
 # Блоковані типи ресурсів для прискорення
 BLOCKED_RESOURCE_TYPES = {'image', 'font', 'stylesheet', 'media', 'other'}
 
+# Очищення DOM у браузері (PLAYWRIGHT_PRUNE_IN_BROWSER): ті ж теги, що видаляє
+# html_extractors (REMOVED_TAGS) + медіа/вбудовані ресурси, коментарі, inline
+# стилі/обробники та приховані елементи. application/ld+json лишається для
+# structured_offers. Приховані елементи з акційним текстом (код у попапі,
+# що відкривається по кліку) не видаляються. Повертає {html, removed}.
+PRUNE_DOM_SCRIPT = """
+() => {
+    const REMOVED = 'style, noscript, iframe, nav, footer, header, svg, canvas, video, audio, picture, template, link:not([rel="canonical"])';
+    const PROMO_RE = /code|promo|coupon|soldes|r[ée]duction|offert|%|€/i;
+    let removed = 0;
+    const drop = (el) => { el.remove(); removed++; };
+
+    document.querySelectorAll('script').forEach((el) => {
+        if (!(el.type || '').toLowerCase().includes('ld+json')) drop(el);
+    });
+    document.querySelectorAll(REMOVED).forEach((el) => { if (el.isConnected) drop(el); });
+
+    if (document.body) {
+        for (const el of Array.from(document.body.querySelectorAll('*'))) {
+            if (!el.isConnected) continue;
+            const style = window.getComputedStyle(el);
+            const hidden = el.hidden || el.getAttribute('aria-hidden') === 'true'
+                || style.display === 'none' || style.visibility === 'hidden';
+            if (hidden && !PROMO_RE.test(el.textContent || '')) drop(el);
+        }
+    }
+
+    const walker = document.createTreeWalker(document.documentElement, NodeFilter.SHOW_COMMENT);
+    const comments = [];
+    while (walker.nextNode()) comments.push(walker.currentNode);
+    comments.forEach((node) => node.remove());
+
+    for (const el of document.querySelectorAll('[style], [onclick], [onload], [onerror], [onmouseover]')) {
+        for (const name of el.getAttributeNames()) {
+            if (name === 'style' || name.startsWith('on')) el.removeAttribute(name);
+        }
+    }
+    return {html: '<!DOCTYPE html>' + document.documentElement.outerHTML, removed: removed};
+}
+"""
+
 
 class PlaywrightScraper:
     """
@@ -30,6 +132,7 @@ class PlaywrightScraper:
     
     Оптимізації:
     - Повторне використання браузера
+    - Пул прогрітих контекстів/сторінок з обмеженням одночасних рендерів
     - Блокування зайвих ресурсів (images, fonts, CSS)
     - Правильне очищення ресурсів
     """
@@ -44,6 +147,9 @@ class PlaywrightScraper:
         self.proxy_config = proxy_config
         self._playwright: Optional[Playwright] = None
         self._browser: Optional[Browser] = None
+        # Пул контекстів: слот None — ще не створений (або скинутий після помилки)
+        self._slots: Optional[asyncio.Queue] = None
+        self._all_slots: Dict[int, Dict] = {}
     
     async def _get_browser(self) -> Browser:
         """Отримати або створити браузер (з правильним збереженням playwright)"""
@@ -69,9 +175,7 @@ class PlaywrightScraper:
             
             # Додаємо проксі якщо є
             if self.proxy_config and self.proxy_config.get('host'):
-                proxy = {
-                    'server': f"http://{self.proxy_config['host']}:{self.proxy_config.get('http_port', 59100)}"
-                }
+                proxy = {'server': self._proxy_base_url()}
                 if self.proxy_config.get('login') and self.proxy_config.get('password'):
                     proxy['username'] = self.proxy_config['login']
                     proxy['password'] = self.proxy_config['password']
@@ -82,9 +186,87 @@ class PlaywrightScraper:
         
         return self._browser
     
+    async def _new_slot(self) -> Dict:
+        """Прогрітий контекст: реалістичні налаштування, init script, сторінка з блокуванням ресурсів"""
+        browser = await self._get_browser()
+        context: BrowserContext = await browser.new_context(
+            viewport={'width': VIEWPORT_WIDTH, 'height': VIEWPORT_HEIGHT},
+            user_agent=USER_AGENT,
+            locale='fr-FR',
+            timezone_id='Europe/Paris',
+            ignore_https_errors=True,
+        )
+        await context.add_init_script(STEALTH_INIT_SCRIPT)
+        page = await context.new_page()
+        # Блокуємо зайві ресурси для прискорення
+        await page.route("**/*", self._route_handler)
+        await metrics.incr("playwright.context_created")
+        slot = {"browser": browser, "context": context, "page": page, "uses": 0}
+        self._all_slots[id(slot)] = slot
+        return slot
+
+    def _slot_queue(self) -> asyncio.Queue:
+        if self._slots is None:
+            self._slots = asyncio.Queue()
+            for _ in range(max(1, settings.PLAYWRIGHT_POOL_SIZE)):
+                self._slots.put_nowait(None)
+        return self._slots
+
+    async def warm_up(self):
+        """Створити всі контексти пулу заздалегідь (щоб перший рендер не платив за холодний старт)"""
+        queue = self._slot_queue()
+        slots = [queue.get_nowait() for _ in range(queue.qsize())]
+        for i, slot in enumerate(slots):
+            if slot is None:
+                try:
+                    slots[i] = await self._new_slot()
+                except Exception as e:
+                    logger.warning(f"Playwright: не вдалося прогріти контекст: {e}")
+        for slot in slots:
+            queue.put_nowait(slot)
+        logger.info(f"✓ Playwright: прогріто {sum(1 for s in slots if s)} контекстів")
+
+    async def _acquire_slot(self) -> Dict:
+        """Взяти контекст з пулу (чекаючи, якщо всі зайняті)"""
+        queue = self._slot_queue()
+        started = time.perf_counter()
+        slot = await asyncio.wait_for(queue.get(), settings.PLAYWRIGHT_ACQUIRE_TIMEOUT)
+        await metrics.record_timing("playwright.acquire_wait", time.perf_counter() - started)
+        if slot is not None and (slot["browser"] is not self._browser or not slot["browser"].is_connected()):
+            # Браузер перезапущено — контекст старого браузера недійсний
+            self._all_slots.pop(id(slot), None)
+            slot = None
+        if slot is None:
+            try:
+                slot = await self._new_slot()
+            except BaseException:
+                queue.put_nowait(None)
+                raise
+        return slot
+
+    async def _release_slot(self, slot: Dict, healthy: bool):
+        """Повернути контекст у пул: скинути стан або закрити, якщо зношений/зламаний"""
+        slot["uses"] += 1
+        if healthy and slot["uses"] < settings.PLAYWRIGHT_CONTEXT_MAX_USES:
+            try:
+                await slot["context"].clear_cookies()
+                await slot["page"].goto("about:blank")
+            except Exception:
+                healthy = False
+        else:
+            healthy = False
+        if not healthy:
+            self._all_slots.pop(id(slot), None)
+            try:
+                await slot["context"].close()
+            except Exception:
+                pass
+        if self._slots is not None:
+            self._slots.put_nowait(slot if healthy else None)
+
     async def fetch_with_browser(self, url: str) -> Tuple[Optional[str], Optional[str]]:
         """
-        Завантажити сторінку через браузер
+        Завантажити сторінку через браузер (контекст з пулу)
         
         Args:
             url: URL для завантаження
@@ -92,95 +274,23 @@ class PlaywrightScraper:
         Returns:
             Tuple[html_content, error_message]
         """
-        context = None
-        page = None
-        
         try:
-            browser = await self._get_browser()
-            
-            # Створюємо новий контекст з реалістичними налаштуваннями
-            context = await browser.new_context(
-                viewport={'width': VIEWPORT_WIDTH, 'height': VIEWPORT_HEIGHT},
-                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-                locale='fr-FR',
-                timezone_id='Europe/Paris',
-                ignore_https_errors=True,
-            )
-            
-            # Додаємо скрипт для приховування автоматизації
-            await context.add_init_script("""
-                // Приховуємо webdriver
-                Object.defineProperty(navigator, 'webdriver', {
-                    get: () => undefined
-                });
-                
-                // Приховуємо автоматизацію Chrome
-                window.chrome = {
-                    runtime: {},
-                    csi: function() {},
-                    loadTimes: function() {}
-                };
-                
-                // Реалістичний plugins
-                Object.defineProperty(navigator, 'plugins', {
-                    get: () => {
-                        const plugins = [];
-                        plugins.length = 3;
-                        return plugins;
-                    }
-                });
-                
-                // Фейковий languages
-                Object.defineProperty(navigator, 'languages', {
-                    get: () => ['fr-FR', 'fr', 'en-US', 'en']
-                });
-                
-                // Permissions
-                const originalQuery = window.navigator.permissions.query;
-                window.navigator.permissions.query = (parameters) => (
-                    parameters.name === 'notifications' ?
-                        Promise.resolve({ state: Notification.permission }) :
-                        originalQuery(parameters)
-                );
-            """)
-            
-            page = await context.new_page()
-            
-            # Блокуємо зайві ресурси для прискорення
-            await page.route("**/*", self._route_handler)
-            
-            logger.info(f"Playwright: завантаження {url}")
-            
-            # Переходимо на сторінку
-            response = await page.goto(
-                url,
-                timeout=self.timeout,
-                wait_until='domcontentloaded'
-            )
-            
-            if response is None:
-                return None, "Playwright: не вдалося отримати відповідь"
-            
-            status = response.status
-            
-            if status == 403:
-                # Спробуємо почекати на Cloudflare challenge
-                html_content = await self._wait_for_cloudflare(page)
-                if html_content:
-                    return html_content, None
-            
-            if status >= 400 and status != 403:
-                return None, f"Playwright: HTTP {status}"
-            
-            # Отримуємо HTML
-            html_content = await page.content()
-            
-            # Перевіряємо чи не Cloudflare challenge page
-            if self._is_cloudflare_challenge(html_content):
-                return None, "Playwright: застрягли на Cloudflare challenge"
-            
-            logger.info(f"✓ Playwright: успішно завантажено {url} ({len(html_content)} байт)")
-            return html_content, None
+            slot = await self._acquire_slot()
+        except asyncio.TimeoutError:
+            error_msg = f"Playwright: немає вільного контексту за {settings.PLAYWRIGHT_ACQUIRE_TIMEOUT}с"
+            logger.warning(error_msg)
+            return None, error_msg
+        except Exception as e:
+            error_msg = f"Playwright помилка запуску: {str(e)[:200]}"
+            logger.warning(error_msg)
+            return None, error_msg
+
+        healthy = False
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self._render(slot["page"], url), RENDER_TIMEOUT)
+            healthy = True
+            return result
             
         except PlaywrightError as e:
             error_msg = f"Playwright помилка: {str(e)[:200]}"
@@ -188,8 +298,8 @@ class PlaywrightScraper:
             return None, error_msg
             
         except asyncio.TimeoutError:
-            error_msg = f"Playwright: таймаут {self.timeout}мс"
-            logger.warning(error_msg)
+            error_msg = f"Playwright: загальний таймаут {RENDER_TIMEOUT}с"
+            logger.warning(f"{error_msg} для {url}")
             return None, error_msg
             
         except Exception as e:
@@ -198,17 +308,73 @@ class PlaywrightScraper:
             return None, error_msg
             
         finally:
-            # Закриваємо тільки page та context, browser залишаємо для reuse
-            if page:
-                try:
-                    await page.close()
-                except Exception:
-                    pass
-            if context:
-                try:
-                    await context.close()
-                except Exception:
-                    pass
+            await metrics.record_timing("playwright.render", time.perf_counter() - started)
+            # Контекст повертаємо в пул, browser залишаємо для reuse
+            await self._release_slot(slot, healthy)
+
+    async def _render(self, page: Page, url: str) -> Tuple[Optional[str], Optional[str]]:
+        """Перехід на сторінку та отримання HTML (з очікуванням Cloudflare challenge)"""
+        logger.info(f"Playwright: завантаження {url}")
+        
+        # Переходимо на сторінку
+        response = await page.goto(
+            url,
+            timeout=self.timeout,
+            wait_until='domcontentloaded'
+        )
+        
+        if response is None:
+            return None, "Playwright: не вдалося отримати відповідь"
+        
+        status = response.status
+        
+        if status == 403:
+            # Спробуємо почекати на Cloudflare challenge
+            html_content = await self._wait_for_cloudflare(page)
+            if html_content:
+                await self._store_clearance(page, url)
+                return html_content, None
+        
+        if status >= 400 and status != 403:
+            return None, f"Playwright: HTTP {status}"
+        
+        # Отримуємо HTML
+        html_content = await self._page_html(page)
+        
+        # Перевіряємо чи не Cloudflare challenge page
+        if self._is_cloudflare_challenge(html_content):
+            return None, "Playwright: застрягли на Cloudflare challenge"
+        
+        logger.info(f"✓ Playwright: успішно завантажено {url} ({len(html_content)} байт)")
+        await self._store_clearance(page, url)
+        return html_content, None
+    
+    async def _page_html(self, page: Page) -> str:
+        """HTML сторінки: очищений у браузері (PLAYWRIGHT_PRUNE_IN_BROWSER) або повний DOM"""
+        if settings.PLAYWRIGHT_PRUNE_IN_BROWSER:
+            try:
+                pruned = await page.evaluate(PRUNE_DOM_SCRIPT)
+                await metrics.incr("playwright.pruned")
+                logger.debug(f"Playwright: у браузері видалено {pruned['removed']} елементів")
+                return pruned['html']
+            except PlaywrightError as e:
+                # Напр. сторінка перейшла на інший документ під час скрипта
+                logger.debug(f"Playwright: не вдалося очистити DOM у браузері: {e}")
+        return await page.content()
+    
+    def _proxy_base_url(self) -> Optional[str]:
+        """Проксі браузера у форматі ProxyConfig.get_http_proxy_base_url (None — напряму)"""
+        if self.proxy_config and self.proxy_config.get('host'):
+            return f"http://{self.proxy_config['host']}:{self.proxy_config.get('http_port', 59100)}"
+        return None
+    
+    async def _store_clearance(self, page: Page, url: str):
+        """Зберегти антибот cookies сторінки разом з UA (до того, як _release_slot їх очистить)"""
+        try:
+            cookies = await page.context.cookies([url, page.url])
+            await save_clearance(url, cookies, USER_AGENT, egress_id(self._proxy_base_url()))
+        except Exception as e:
+            logger.debug(f"Playwright: не вдалося отримати cookies {url}: {e}")
     
     async def _route_handler(self, route):
         """Блокування зайвих ресурсів для прискорення"""
@@ -233,7 +399,7 @@ class PlaywrightScraper:
                 timeout=CLOUDFLARE_WAIT_TIMEOUT
             )
             
-            html_content = await page.content()
+            html_content = await self._page_html(page)
             if not self._is_cloudflare_challenge(html_content):
                 return html_content
                 
@@ -254,7 +420,15 @@ class PlaywrightScraper:
         return any(marker in html for marker in challenge_markers)
     
     async def close(self):
-        """Закрити браузер та playwright"""
+        """Закрити контексти пулу, браузер та playwright"""
+        for slot in list(self._all_slots.values()):
+            try:
+                await slot["context"].close()
+            except Exception:
+                pass
+        self._all_slots.clear()
+        self._slots = None
+        
         if self._browser:
             try:
                 await self._browser.close()
@@ -331,7 +505,8 @@ async def fetch_with_playwright(
     """
     Завантажити сторінку через Playwright (зручна функція)
     
-    Використовує глобальний browser instance для швидкодії
+    Використовує глобальний browser instance та пул контекстів для швидкодії.
+    Загальний таймаут (RENDER_TIMEOUT) рахується від отримання контексту з пулу.
     
     Args:
         url: URL для завантаження
@@ -341,19 +516,9 @@ async def fetch_with_playwright(
     Returns:
         Tuple[html_content, error_message]
     """
-    # Загальний timeout на всю операцію (30 секунд максимум)
-    overall_timeout = 30.0
-    
     try:
         scraper = await get_playwright_scraper(proxy_config=proxy_config, timeout=timeout)
-        result = await asyncio.wait_for(
-            scraper.fetch_with_browser(url),
-            timeout=overall_timeout
-        )
-        return result
-    except asyncio.TimeoutError:
-        logger.warning(f"Playwright: загальний таймаут {overall_timeout}с для {url}")
-        return None, f"Playwright: загальний таймаут {overall_timeout}с"
+        return await scraper.fetch_with_browser(url)
     except Exception as e:
         logger.error(f"Playwright fetch error: {e}")
         return None, f"Playwright error: {str(e)[:100]}"
@@ -0,0 +1,161 @@
+"""
+Локальний класифікатор наявності акцій на сторінці (шлюз перед Gemini)
+
+Значна частина сторінок взагалі не має акцій, але кожна коштує повний запит
+до Gemini та очікування квоти. Тут за дешевими ознаками (ключові слова/regex
+з promo_extractor, токени-коди, оцінка акційних блоків) оцінюється ймовірність
+того, що на сторінці є угоди:
+- за замовчуванням — фіксована логістична формула над ключовими словами
+- якщо задано PROMO_GATE_MODEL_PATH — маленька модель scikit-learn (CPU),
+  навчена на історичних результатах (scripts/train_promo_classifier.py)
+
+PROMO_GATE_MODE:
+- off    — шлюз вимкнено
+- shadow — рішення лише записується в метадані/метрики, Gemini викликається завжди
+- on     — нижче PROMO_GATE_THRESHOLD Gemini пропускається
+
+Після кожного реального виклику Gemini ознаки та результат (є угоди чи ні)
+записуються в Redis (promo_gate:samples) — це навчальна вибірка, а в shadow
+режимі ще й метрика promo_gate.false_negative для оцінки recall.
+"""
+import json
+import logging
+import math
+from typing import Dict, List, Optional
+
+from app.core import metrics
+from app.core.config import settings
+from app.services.promo_extractor import text_signal_counts
+
+logger = logging.getLogger(__name__)
+
+SAMPLES_REDIS_KEY = "promo_gate:samples"
+SAMPLES_MAX = 20000
+
+FEATURE_NAMES = (
+    # text_signal_counts: по одній ознаці на regex з promo_extractor + токени-коди
+    [f"signal_{i}" for i in range(len(text_signal_counts("")) - 1)]
+    + ["code_tokens", "promo_top_score", "promo_blocks", "text_length_log"]
+)
+
+# Ваги формули за ключовими словами (ознака → вага), решта — 0
+_KEYWORD_INTERCEPT = -3.0
+_KEYWORD_WEIGHTS = {
+    "signal_0": 2.0,  # code promo / coupon
+    "signal_1": 1.2,  # soldes / promo / livraison offerte
+    "signal_2": 1.5,  # -20%, 10€ offerts
+    "signal_3": 0.8,  # будь-який %
+    "signal_4": 0.5,  # таймер
+    "code_tokens": 0.5,
+    "promo_top_score": 0.3,
+}
+# Скільки збігів ознаки враховувати у формулі (далі насичення)
+_KEYWORD_CAP = 3
+
+_model = None
+_model_path: Optional[str] = None
+
+
+def page_features(content: Dict) -> Dict[str, float]:
+    """Ознаки сторінки з результату extract_visible_content"""
+    text = " ".join(
+        content.get(field) or "" for field in ("title", "meta_description", "text")
+    )
+    counts = text_signal_counts(text)
+    features = {name: float(count) for name, count in zip(FEATURE_NAMES, counts)}
+    promo_stats = content.get('promo_stats') or {}
+    features["promo_top_score"] = float(promo_stats.get("top_score", 0.0))
+    features["promo_blocks"] = float(promo_stats.get("blocks_selected", 0))
+    features["text_length_log"] = math.log1p(len(content.get('text') or ""))
+    return features
+
+
+def keyword_probability(features: Dict[str, float]) -> float:
+    """Ймовірність акцій за фіксованою формулою над ключовими словами"""
+    z = _KEYWORD_INTERCEPT + sum(
+        weight * min(features.get(name, 0.0), _KEYWORD_CAP)
+        for name, weight in _KEYWORD_WEIGHTS.items()
+    )
+    return 1.0 / (1.0 + math.exp(-z))
+
+
+def _load_model():
+    """Модель scikit-learn з PROMO_GATE_MODEL_PATH (None — не задано або не вдалося завантажити)"""
+    global _model, _model_path
+    path = settings.PROMO_GATE_MODEL_PATH
+    if path != _model_path:
+        _model_path, _model = path, None
+        if path:
+            try:
+                import joblib
+                _model = joblib.load(path)
+                logger.info(f"✓ Завантажено модель класифікатора акцій: {path}")
+            except Exception as e:
+                # scikit-learn/joblib необов'язкові — працюємо на ключових словах
+                logger.warning(f"Модель класифікатора акцій недоступна ({e}), використовуємо ключові слова")
+    return _model
+
+
+def feature_vector(features: Dict[str, float]) -> List[float]:
+    return [features.get(name, 0.0) for name in FEATURE_NAMES]
+
+
+def classify_page(content: Dict) -> Dict:
+    """
+    Рішення шлюзу для сторінки
+
+    Returns:
+        Dict: mode, probability, threshold, source (model/keywords), skip
+        (skip=True — Gemini пропускається; у shadow режимі лише would_skip), features
+    """
+    features = page_features(content)
+    model = _load_model()
+    probability, source = None, "keywords"
+    if model is not None:
+        try:
+            probability = float(model.predict_proba([feature_vector(features)])[0][1])
+            source = "model"
+        except Exception as e:
+            logger.debug(f"[PromoGate] Помилка моделі: {e}")
+    if probability is None:
+        probability = keyword_probability(features)
+
+    mode = settings.PROMO_GATE_MODE
+    would_skip = probability < settings.PROMO_GATE_THRESHOLD
+    return {
+        "mode": mode,
+        "probability": round(probability, 4),
+        "threshold": settings.PROMO_GATE_THRESHOLD,
+        "source": source,
+        "would_skip": would_skip,
+        "skip": would_skip and mode == "on",
+        "features": features,
+    }
+
+
+def gate_enabled() -> bool:
+    return settings.PROMO_GATE_MODE in ("shadow", "on")
+
+
+async def record_outcome(domain: str, decision: Dict, has_deals: bool):
+    """
+    Записати ознаки та фактичний результат Gemini (навчальна вибірка + recall метрики)
+    """
+    await metrics.incr("promo_gate.would_skip" if decision["would_skip"] else "promo_gate.would_pass")
+    if decision["would_skip"] and has_deals:
+        # Шлюз пропустив би сторінку з угодами
+        await metrics.incr("promo_gate.false_negative")
+        logger.info(f"[PromoGate] {domain}: p={decision['probability']} нижче порогу, але Gemini знайшов угоди")
+    sample = {
+        "domain": domain,
+        "features": decision["features"],
+        "probability": decision["probability"],
+        "has_deals": has_deals,
+    }
+    try:
+        from app.services.gemini import get_async_redis_client
+        client = await get_async_redis_client()
+        await client.lpush(SAMPLES_REDIS_KEY, json.dumps(sample))
+        await client.ltrim(SAMPLES_REDIS_KEY, 0, SAMPLES_MAX - 1)
+    except Exception as e:
+        logger.debug(f"[PromoGate] Не вдалося записати зразок {domain}: {e}")
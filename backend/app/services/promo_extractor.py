@@ -0,0 +1,203 @@
+"""
+Виділення акційних блоків сторінки перед відправкою в Gemini
+
+extract_visible_content прибирає лише script/style/nav/... і віддає до 100 KB
+clean_html, хоча промокоди зазвичай у кількох банерах, попапах та hero блоках.
+Тут кожен DOM блок оцінюється за ознаками акції ("code promo", "%", "soldes",
+"livraison offerte", токени схожі на код, таймери) і лишаються top-K блоків
+разом з невеликим контекстом (сусідні блоки).
+"""
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+
+import lxml.html
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# Блоки-кандидати
+BLOCK_TAGS = {
+    "div", "section", "aside", "article", "dialog", "form", "li",
+    "p", "table", "figure", "a", "button", "span", "h1", "h2", "h3", "h4",
+}
+
+# Блок більший за це — контейнер сторінки, а не акційний банер
+MAX_BLOCK_TEXT = 1500
+MIN_BLOCK_TEXT = 3
+
+# (regex, вага) для тексту блоку
+_TEXT_SIGNALS = [
+    (re.compile(
+        r"code\s*promo|promo\s*code|coupon|bon\s+de\s+r[ée]duction|code\s+r[ée]duction|"
+        r"промокод|промо-код|discount\s+code|voucher", re.I), 5),
+    (re.compile(
+        r"soldes|livraison\s+(?:offerte|gratuite)|frais\s+de\s+port\s+offerts|free\s+shipping|"
+        r"black\s+friday|r[ée]duction|remise|offre|promo|sale|discount|знижк|акці|розпродаж", re.I), 3),
+    (re.compile(r"[-−]\s?\d{1,2}\s?%|\d{1,2}\s?%\s*(?:off|de\s+r[ée]duction|sur)|\d{1,3}\s?(?:€|\$|£|грн)\s+(?:offert|off|de\s+r[ée]duction)", re.I), 3),
+    (re.compile(r"\d{1,3}\s?%"), 2),
+    (re.compile(r"\b\d{1,2}\s?(?:j|jours|h|heures|min|days|hours|дн|год)\b.{0,20}\b\d{1,2}\s?(?:h|min|s|heures|minutes|sec)", re.I), 2),
+]
+
+# Токен, схожий на промокод: великі літери + цифри, 4-15 символів (SAVE20, BF2025, WELCOME10)
+_CODE_TOKEN_RE = re.compile(r"\b(?=[A-Z0-9]*[A-Z])(?=[A-Z0-9]*\d)[A-Z0-9]{4,15}\b")
+
+# Підказки в class/id
+_ATTR_HINT_RE = re.compile(
+    r"promo|coupon|banner|popup|pop-up|modal|hero|offer|sale|discount|deal|announcement|"
+    r"topbar|top-bar|ribbon|countdown|timer|voucher|newsletter",
+    re.I
+)
+
+
+def _block_text(el) -> str:
+    return re.sub(r"\s+", " ", el.text_content() or "").strip()
+
+
+def score_block(el, text: Optional[str] = None) -> float:
+    """Оцінка акційності блоку (0 — ознак немає)"""
+    text = _block_text(el) if text is None else text
+    score = 0.0
+    for pattern, weight in _TEXT_SIGNALS:
+        if pattern.search(text):
+            score += weight
+    if _CODE_TOKEN_RE.search(text):
+        score += 3
+    attrs = f"{el.get('class', '')} {el.get('id', '')}"
+    if attrs.strip() and _ATTR_HINT_RE.search(attrs):
+        score += 2
+    # Менші блоки з тими ж ознаками — точніші
+    return score / (1 + len(text) / MAX_BLOCK_TEXT)
+
+
+def code_tokens(text: str) -> List[str]:
+    """Токени, схожі на промокод"""
+    return _CODE_TOKEN_RE.findall(text)
+
+
+def text_signal_counts(text: str, cap: int = 20) -> List[int]:
+    """Кількість збігів кожної текстової ознаки акції та токенів-кодів (з обмеженням cap)"""
+    counts = [min(len(pattern.findall(text)), cap) for pattern, _ in _TEXT_SIGNALS]
+    counts.append(min(len(_CODE_TOKEN_RE.findall(text)), cap))
+    return counts
+
+
+def _is_related(el, selected: List) -> bool:
+    """Чи є блок предком або нащадком вже вибраного"""
+    for other in selected:
+        if el is other:
+            return True
+        for ancestor in el.iterancestors():
+            if ancestor is other:
+                return True
+        for ancestor in other.iterancestors():
+            if ancestor is el:
+                return True
+    return False
+
+
+def extract_promo_blocks(
+    html: str,
+    top_k: int = 8,
+    context: int = 1,
+    min_score: float = 2.0
+) -> Tuple[str, Dict]:
+    """
+    Виділити top-K акційних блоків з HTML
+
+    Args:
+        html: Очищений HTML (clean_html)
+        top_k: Скільки блоків лишити
+        context: Скільки сусідніх блоків (до і після) додати до кожного
+        min_score: Мінімальна оцінка блоку
+
+    Returns:
+        (promo_html, stats): promo_html — порожній рядок, якщо акційних блоків не знайдено;
+        stats — blocks_scored, blocks_selected, top_score, original_length, promo_length, shrink_ratio
+    """
+    if not html:
+        return "", _empty_stats(0)
+
+    try:
+        root = lxml.html.fromstring(html)
+    except (etree.ParserError, ValueError) as e:
+        logger.debug(f"[Promo] Не вдалося розпарсити HTML: {e}")
+        return "", _empty_stats(len(html))
+
+    return select_promo_blocks(root, len(html), top_k=top_k, context=context, min_score=min_score)
+
+
+def _empty_stats(original_length: int) -> Dict:
+    return {
+        "blocks_scored": 0,
+        "blocks_selected": 0,
+        "top_score": 0.0,
+        "original_length": original_length,
+        "promo_length": 0,
+        "shrink_ratio": 1.0,
+    }
+
+
+def select_promo_blocks(
+    root,
+    original_length: int,
+    top_k: int = 8,
+    context: int = 1,
+    min_score: float = 2.0
+) -> Tuple[str, Dict]:
+    """
+    Те саме, що extract_promo_blocks, але над вже розпарсеним lxml деревом
+    (щоб екстрактор контенту не парсив сторінку двічі)
+    """
+    stats = _empty_stats(original_length)
+
+    candidates = []
+    for el in root.iter(*BLOCK_TAGS):
+        text = _block_text(el)
+        if not (MIN_BLOCK_TEXT <= len(text) <= MAX_BLOCK_TEXT):
+            continue
+        stats["blocks_scored"] += 1
+        score = score_block(el, text)
+        if score >= min_score:
+            candidates.append((score, el))
+
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    selected = []
+    for score, el in candidates:
+        if len(selected) >= top_k:
+            break
+        if not _is_related(el, selected):
+            selected.append(el)
+    if not selected:
+        return "", stats
+
+    # Контекст: сусідні елементи того ж батька
+    blocks = []
+    for el in selected:
+        if not _is_related(el, blocks):
+            blocks.append(el)
+        prev_el, next_el = el, el
+        for _ in range(context):
+            prev_el = prev_el.getprevious() if prev_el is not None else None
+            next_el = next_el.getnext() if next_el is not None else None
+            for sibling in (prev_el, next_el):
+                if sibling is None or isinstance(sibling, etree._Comment) or _is_related(sibling, blocks):
+                    continue
+                # Сусід-контейнер (напр. <main> з усім каталогом) контекстом не є
+                if len(_block_text(sibling)) <= MAX_BLOCK_TEXT:
+                    blocks.append(sibling)
+
+    # Порядок документа
+    position = {el: i for i, el in enumerate(root.iter())}
+    blocks.sort(key=lambda el: position.get(el, 0))
+
+    promo_html = "\n".join(
+        lxml.html.tostring(el, encoding="unicode", with_tail=False) for el in blocks
+    )
+    stats.update({
+        "blocks_selected": len(selected),
+        "top_score": round(candidates[0][0], 2),
+        "promo_length": len(promo_html),
+        "shrink_ratio": round(len(promo_html) / max(1, original_length), 4),
+    })
+    return promo_html, stats
@@ -1,26 +1,60 @@
 import aiohttp
 import asyncio
 import ssl
+import codecs
+import re
 import random
-from bs4 import BeautifulSoup
+import time
 from typing import Optional, Dict, Tuple, Any
 import logging
-from urllib.parse import urlparse, urljoin
-import re
+from urllib.parse import urlparse
 from app.services.proxy import ProxyRotator, ProxyConfig
 from app.core.config import settings
 from app.core.cache import get_cache
+from app.core import metrics
+from app.services.html_extractors import get_html_extractor
+from app.services.extraction_pool import extract_content
+from app.services.domain_state import content_hash
+from app.services.fetch_strategy import load_strategy, plan_strategies, save_strategy
+from app.services.clearance_cookies import cookie_header, drop_clearance, egress_id, load_clearance
 
 logger = logging.getLogger(__name__)
 
 # Константи
-MAX_TEXT_LENGTH = 50000
-MAX_LINKS_COUNT = 100
-MAX_HTML_LENGTH = 100000
 BACKOFF_BASE = 2
 BACKOFF_MAX = 30
 BACKOFF_JITTER = 0.1
 
+# Потокове читання відповіді
+READ_CHUNK_SIZE = 64 * 1024
+BODY_END_RE = re.compile(rb'</body\s*>', re.IGNORECASE)
+BODY_END_OVERLAP = 16
+CHROME_VERSION_RE = re.compile(r'Chrome/(\d+)')
+META_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+
+# fetch_page(browser_fallback=False): сайт відповів 403 (антибот) — далі лише браузер
+BLOCKED_ERROR = "HTTP 403: антибот захист"
+# fetch_with_strategy(browser=False): потрібен браузер — рендер на окремому worker-і (черга render)
+RENDER_REQUIRED = "Потрібен рендер браузером"
+
+PLAYWRIGHT_FALLBACK_TIMEOUT = 15000  # мс
+
+
+def _sniff_charset(head: bytes) -> Optional[str]:
+    """Кодування з <meta charset> / http-equiv на початку документа"""
+    match = META_CHARSET_RE.search(head[:4096])
+    return match.group(1).decode('ascii', errors='ignore') if match else None
+
+
+def _resolve_encoding(encoding: Optional[str]) -> str:
+    """Перевірене ім'я кодування (невідоме або порожнє → utf-8)"""
+    if encoding:
+        try:
+            return codecs.lookup(encoding).name
+        except LookupError:
+            logger.debug(f"Невідоме кодування {encoding!r}, використовуємо utf-8")
+    return 'utf-8'
+
 
 class WebScraper:
     """
@@ -165,6 +199,24 @@ class WebScraper:
             'Referer': f'https://www.google.com/search?q={domain}',
         }
     
+    def _apply_clearance(self, headers: dict, clearance: Dict) -> dict:
+        """Cookies перепустки та UA браузера, якому їх видано (Sec-Ch-Ua — тієї ж версії)"""
+        headers['User-Agent'] = clearance['user_agent']
+        headers['Cookie'] = cookie_header(clearance)
+        version = CHROME_VERSION_RE.search(clearance['user_agent'])
+        if version:
+            headers['Sec-Ch-Ua'] = (
+                f'"Not A(Brand";v="99", "Google Chrome";v="{version.group(1)}", "Chromium";v="{version.group(1)}"'
+            )
+        return headers
+    
+    def _pinned_proxy(self, proxy_base_url: str) -> Optional[Tuple[str, str, str]]:
+        """Проксі ротатора з заданим base URL у форматі get_next_proxy_for_aiohttp"""
+        for proxy in (self.proxy_rotator.proxy_configs if self.proxy_rotator else []):
+            if proxy.get_http_proxy_base_url() == proxy_base_url:
+                return proxy_base_url, proxy.login, proxy.password
+        return None
+    
     async def _try_playwright(self, url: str) -> Tuple[Optional[str], Optional[str]]:
         """
         Спробувати завантажити сторінку через Playwright (headless browser)
@@ -173,22 +225,34 @@ class WebScraper:
         try:
             from app.services.playwright_scraper import fetch_with_playwright
             
-            # Отримуємо proxy config якщо є
-            proxy_config = None
-            if self.proxy_rotator and self.proxy_rotator.proxy_configs:
-                proxy = self.proxy_rotator.proxy_configs[0]
-                proxy_config = {
-                    'host': proxy.host,
-                    'http_port': proxy.http_port,
-                    'login': proxy.login,
-                    'password': proxy.password
-                }
-            
-            return await fetch_with_playwright(url, proxy_config=proxy_config, timeout=15000)
+            return await fetch_with_playwright(
+                url, proxy_config=self._playwright_proxy_config(), timeout=PLAYWRIGHT_FALLBACK_TIMEOUT
+            )
         except Exception as e:
             logger.error(f"Playwright fallback помилка: {e}")
             return None, f"Playwright error: {str(e)[:100]}"
     
+    def _playwright_proxy_config(self) -> Optional[Dict]:
+        """Proxy config для Playwright (перший проксі ротатора) або None"""
+        if self.proxy_rotator and self.proxy_rotator.proxy_configs:
+            proxy = self.proxy_rotator.proxy_configs[0]
+            return {
+                'host': proxy.host,
+                'http_port': proxy.http_port,
+                'login': proxy.login,
+                'password': proxy.password
+            }
+        return None
+    
+    async def warm_up_browser(self):
+        """Запустити браузер і прогріти пул контекстів (render worker-и на старті)"""
+        from app.services.playwright_scraper import get_playwright_scraper
+        
+        playwright = await get_playwright_scraper(
+            proxy_config=self._playwright_proxy_config(), timeout=PLAYWRIGHT_FALLBACK_TIMEOUT
+        )
+        await playwright.warm_up()
+    
     async def fetch_website(self, url: str, use_proxy: bool = True) -> Tuple[Optional[str], Optional[str]]:
         """
         Завантажити HTML контент з вказаного URL
@@ -202,12 +266,45 @@ class WebScraper:
             - html_content: HTML контент або None при помилці
             - error_message: Повідомлення про помилку або None при успіху
         """
+        page, error = await self.fetch_page(url, use_proxy=use_proxy)
+        return (page['html'] if page else None), error
+    
+    async def fetch_page(
+        self,
+        url: str,
+        use_proxy: bool = True,
+        validators: Optional[Dict[str, Optional[str]]] = None,
+        browser_fallback: bool = True
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Завантажити сторінку разом із сирими bytes відповіді
+        
+        Args:
+            url: URL сайту
+            use_proxy: Використовувати проксі
+            validators: {'etag', 'last_modified'} попереднього завантаження — умовний запит
+            browser_fallback: На 403 пробувати Playwright (False — повернути BLOCKED_ERROR)
+        
+        Returns:
+            Tuple[page, error_message]
+            - page: {'html': str, 'body': bytes або None (Playwright), 'encoding': str або None,
+              'truncated': bool — тіло обрізано лімітом SCRAPING_MAX_BYTES / на </body>,
+              'not_modified': bool — 304 на умовний запит (html/body = None),
+              'validators': {'etag', 'last_modified', 'final_url'}}
+            - error_message: Повідомлення про помилку або None при успіху
+        """
         # Нормалізуємо URL
         if not url.startswith(('http://', 'https://')):
             url = 'https://' + url
         
         # Отримуємо сесію один раз
         session = await self._get_session(use_proxy=use_proxy and self.proxy_rotator is not None)
+        # Антибот cookies, отримані раніше браузером (cf_clearance тощо) — лише для
+        # тієї ж вихідної точки: на проксі браузера запит закріплюється за ним
+        clearance = await load_clearance(url)
+        pinned = None
+        if clearance and use_proxy and self.proxy_rotator:
+            pinned = self._pinned_proxy(clearance.get('egress') or "")
         
         for attempt in range(self.max_retries):
             proxy_base_url = None
@@ -216,7 +313,7 @@ class WebScraper:
             try:
                 # Отримуємо проксі
                 if use_proxy and self.proxy_rotator:
-                    parts = self.proxy_rotator.get_next_proxy_for_aiohttp(proxy_type="http")
+                    parts = pinned or self.proxy_rotator.get_next_proxy_for_aiohttp(proxy_type="http")
                     if not parts:
                         logger.error("Не вдалося отримати проксі")
                         return None, "Всі проксі недоступні"
@@ -224,6 +321,14 @@ class WebScraper:
                     proxy_auth = aiohttp.BasicAuth(login, password) if (login and password) else None
 
                 headers = self._get_headers(url)
+                clearance_sent = bool(clearance) and clearance.get('egress') == egress_id(proxy_base_url)
+                if clearance_sent:
+                    self._apply_clearance(headers, clearance)
+                if validators:
+                    if validators.get('etag'):
+                        headers['If-None-Match'] = validators['etag']
+                    if validators.get('last_modified'):
+                        headers['If-Modified-Since'] = validators['last_modified']
                 kwargs = {'headers': headers}
                 if proxy_base_url:
                     kwargs['proxy'] = proxy_base_url
@@ -236,26 +341,51 @@ class WebScraper:
                 )
 
                 async with session.get(url, **kwargs) as response:
+                        if response.status == 304 and validators:
+                            # Сторінка не змінилась з минулого разу — тіло не завантажуємо
+                            if proxy_base_url and self.proxy_rotator:
+                                self.proxy_rotator.mark_proxy_success(proxy_base_url)
+                            logger.info(f"✓ {url} не змінився (304)")
+                            return {
+                                'html': None, 'body': None, 'encoding': None, 'truncated': False,
+                                'not_modified': True, 'validators': self._response_validators(response)
+                            }, None
+                        
                         if response.status == 200:
-                            html_content = await response.text()
+                            # Сирі bytes лишаємо для парсингу в пулі процесів (без повторного кодування)
+                            page = await self._read_body(response)
+                            page['validators'] = self._response_validators(response)
                             
                             # Успішне завантаження - відмічаємо проксі як робочий
                             if proxy_base_url and self.proxy_rotator:
                                 self.proxy_rotator.mark_proxy_success(proxy_base_url)
                             
-                            logger.info(f"✓ Успішно завантажено {url} ({len(html_content)} байт)")
-                            return html_content, None
+                            if clearance_sent:
+                                await metrics.incr("clearance.hit")
+                            if page['truncated']:
+                                await metrics.incr("fetch.truncated")
+                            logger.info(
+                                f"✓ Успішно завантажено {url} ({len(page['body'])} байт"
+                                + (", обрізано" if page['truncated'] else "") + ")"
+                            )
+                            return page, None
                         
                         else:
                             error_msg = f"HTTP {response.status}: {response.reason}"
                             logger.warning(f"✗ {error_msg} для {url}")
                             
                             # 403 - антибот захист, пробуємо Playwright
+                            if response.status == 403 and clearance_sent:
+                                # Перепустка вже недійсна з цієї ж точки — браузер отримає нову
+                                await drop_clearance(url)
+                                clearance, pinned = None, None
+                            if response.status == 403 and not browser_fallback:
+                                return None, BLOCKED_ERROR
                             if response.status == 403:
                                 logger.info(f"🌐 Пробуємо Playwright для {url} (антибот 403)")
-                                playwright_html, playwright_error = await self._try_playwright(url)
-                                if playwright_html:
-                                    return playwright_html, None
+                                page, playwright_error = await self._fetch_browser_page(url)
+                                if page:
+                                    return page, None
                                 else:
                                     logger.warning(f"Playwright теж не зміг: {playwright_error}")
                                     return None, f"403 + Playwright failed: {playwright_error}"
@@ -301,9 +431,150 @@ class WebScraper:
         
         return None, f"Не вдалося завантажити після {self.max_retries} спроб"
     
+    async def _fetch_browser_page(self, url: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Сторінка через Playwright у форматі fetch_page"""
+        html, error = await self._try_playwright(url)
+        if not html:
+            return None, error
+        return {
+            'html': html, 'body': None, 'encoding': None, 'truncated': False,
+            'validators': {'final_url': url}
+        }, None
+
+    async def fetch_with_strategy(
+        self,
+        domain: str,
+        url: str,
+        use_proxy: bool = True,
+        validators: Optional[Dict[str, Optional[str]]] = None,
+        browser: bool = True
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str], Optional[str]]:
+        """
+        Завантажити сторінку, починаючи з відомої робочої стратегії домену
+        (direct / proxy / browser, див. app.services.fetch_strategy)
+        
+        До дорожчої стратегії переходимо лише після 403 (або якщо не вдалася
+        повторна перевірка дешевшої).
+        
+        Args:
+            browser: False — не запускати Playwright у цьому процесі, а повернути
+                RENDER_REQUIRED (рендер зробить render_domain на окремому worker-і)
+        
+        Returns:
+            Tuple[page, error_message, strategy] — як fetch_page + стратегія, що спрацювала
+        """
+        record = await load_strategy(domain)
+        clearance = await load_clearance(url) if record and record.get("strategy") == "browser" else None
+        if clearance:
+            # Є дійсна перепустка браузера — спершу HTTP з її cookies (з тієї ж вихідної
+            # точки, що й браузер), браузер лише після 403
+            strategy = "direct" if clearance.get('egress') == egress_id(None) else "proxy"
+            record = {"strategy": strategy, "updated_at": time.time()}
+        plan = plan_strategies(record, use_proxy and self.proxy_rotator is not None)
+        reprobe = bool(record) and plan[0] != record.get("strategy")
+        if reprobe:
+            await metrics.incr("fetch.strategy.reprobe")
+        
+        error = None
+        blocked = False
+        for index, strategy in enumerate(plan):
+            started = time.perf_counter()
+            if strategy == "browser" and not browser:
+                return None, RENDER_REQUIRED, strategy
+            if strategy == "browser":
+                logger.info(f"🌐 Playwright для {url}" + (" (антибот 403)" if blocked else " (відома стратегія домену)"))
+                page, error = await self._fetch_browser_page(url)
+                if not page and blocked:
+                    error = f"403 + Playwright failed: {error}"
+            else:
+                page, error = await self.fetch_page(
+                    url, use_proxy=strategy == "proxy", validators=validators, browser_fallback=False
+                )
+            if page:
+                await save_strategy(domain, strategy, time.perf_counter() - started)
+                await metrics.incr(f"fetch.strategy.{strategy}")
+                return page, None, strategy
+            
+            blocked = blocked or error == BLOCKED_ERROR
+            # Інші помилки (404, таймаути) дорожча стратегія не виправить — крім невдалої перевірки дешевшої
+            if error != BLOCKED_ERROR and not (reprobe and index == 0):
+                break
+        
+        return None, error, None
+
+    @staticmethod
+    def _response_validators(response: aiohttp.ClientResponse) -> Dict[str, Optional[str]]:
+        """ETag / Last-Modified / фінальний URL (після редіректів) для наступного умовного запиту"""
+        return {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'final_url': str(response.url)
+        }
+    
+    async def _read_body(self, response: aiohttp.ClientResponse) -> Dict[str, Any]:
+        """
+        Потокове читання тіла відповіді з лімітом SCRAPING_MAX_BYTES
+        
+        Читаємо частинами й декодуємо інкрементально кодуванням відповіді. Зупиняємось
+        на ліміті байт або (SCRAPING_STOP_AT_BODY_END) після </body> — далі зазвичай
+        лише вбудований JSON/скрипти, а трафік проксі оплачується за GB.
+        
+        Returns:
+            {'html': str, 'body': bytes, 'encoding': str, 'truncated': bool}
+        """
+        max_bytes = settings.SCRAPING_MAX_BYTES
+        stop_at_body_end = settings.SCRAPING_STOP_AT_BODY_END
+        
+        chunks = []
+        parts = []
+        size = 0
+        # truncated — лише обрізка лімітом байт (після </body> корисного контенту немає)
+        truncated = False
+        decoder = None
+        encoding = response.charset
+        tail = b""
+        
+        async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+            if max_bytes and size + len(chunk) > max_bytes:
+                chunk = chunk[:max_bytes - size]
+                truncated = True
+            
+            body_end = False
+            if stop_at_body_end:
+                # Шукаємо з невеликим перекриттям, бо тег може бути розрізаний між частинами
+                match = BODY_END_RE.search(tail + chunk)
+                if match:
+                    chunk = chunk[:max(0, match.end() - len(tail))]
+                    body_end = True
+                    truncated = False
+                tail = chunk[-BODY_END_OVERLAP:]
+            
+            if decoder is None:
+                # Кодування з заголовка, інакше з <meta charset> на початку сторінки
+                encoding = _resolve_encoding(encoding or _sniff_charset(chunk))
+                decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+            
+            chunks.append(chunk)
+            parts.append(decoder.decode(chunk))
+            size += len(chunk)
+            if body_end or truncated:
+                break
+        
+        if decoder is None:
+            encoding = _resolve_encoding(encoding)
+        else:
+            parts.append(decoder.decode(b"", final=True))
+        
+        return {
+            'html': "".join(parts),
+            'body': b"".join(chunks),
+            'encoding': encoding,
+            'truncated': truncated
+        }
+    
     def extract_visible_content(self, html: str, base_url: str) -> Dict[str, Any]:
         """
-        Витягнути видимий контент з HTML
+        Витягнути видимий контент з HTML (бекенд — HTML_EXTRACTOR_BACKEND)
         
         Args:
             html: HTML контент
@@ -316,52 +587,19 @@ class WebScraper:
             - links: Список посилань
             - meta_description: Meta опис
             - clean_html: Очищений HTML (без scripts, styles)
+            - promo_html, promo_stats: Акційні блоки та shrink ratio (PROMO_EXTRACTOR_ENABLED)
         """
-        soup = BeautifulSoup(html, 'lxml')
-        
-        # Видаляємо непотрібні теги
-        for tag in soup(['script', 'style', 'nav', 'footer', 'header', 'iframe', 'noscript']):
-            tag.decompose()
-        
-        # Витягуємо title
-        title = soup.title.string if soup.title else ""
-        
-        # Витягуємо meta description
-        meta_desc = ""
-        meta_tag = soup.find('meta', attrs={'name': 'description'})
-        if meta_tag and meta_tag.get('content'):
-            meta_desc = meta_tag.get('content')
-        
-        # Витягуємо видимий текст
-        text = soup.get_text(separator=' ', strip=True)
-        # Очищаємо множинні пробіли та переноси рядків
-        text = re.sub(r'\s+', ' ', text).strip()
-        
-        # Витягуємо посилання
-        links = []
-        for link in soup.find_all('a', href=True):
-            href = link['href']
-            # Резолвимо відносні посилання
-            absolute_url = urljoin(base_url, href)
-            link_text = link.get_text(strip=True)
-            if link_text:
-                links.append({
-                    'url': absolute_url,
-                    'text': link_text
-                })
-        
-        # Очищений HTML (для Gemini)
-        clean_html = str(soup)
-        
-        return {
-            'title': title.strip() if title else "",
-            'text': text[:MAX_TEXT_LENGTH],
-            'links': links[:MAX_LINKS_COUNT],
-            'meta_description': meta_desc.strip() if meta_desc else "",
-            'clean_html': clean_html[:MAX_HTML_LENGTH]
-        }
+        return get_html_extractor().extract(html, base_url)
     
-    async def scrape_domain(self, domain: str, use_proxy: bool = True, use_cache: bool = True) -> Dict[str, Any]:
+    async def scrape_domain(
+        self,
+        domain: str,
+        use_proxy: bool = True,
+        use_cache: bool = True,
+        extract: bool = True,
+        validators: Optional[Dict[str, Optional[str]]] = None,
+        render: bool = True
+    ) -> Dict[str, Any]:
         """
         Повний цикл парсингу домену з підтримкою кешування
         
@@ -369,6 +607,10 @@ class WebScraper:
             domain: Домен для парсингу (можна з або без https://)
             use_proxy: Використовувати проксі
             use_cache: Використовувати Redis кеш (TTL: 1 година)
+            extract: Витягувати контент одразу (False — тільки завантаження,
+                extract_visible_content викликається окремо, напр. на стадії extract)
+            validators: ETag / Last-Modified попереднього завантаження (умовний запит)
+            render: False — не рендерити браузером тут, а позначити needs_render
         
         Returns:
             Dict з результатами:
@@ -379,6 +621,12 @@ class WebScraper:
             - content: dict - витягнутий контент (може бути None)
             - error: str - повідомлення про помилку (може бути None)
             - cached: bool - чи отримано з кешу
+            - truncated: bool - чи обрізано завантаження (SCRAPING_MAX_BYTES / </body>)
+            - not_modified: bool - 304 на умовний запит (html_raw/content = None)
+            - validators: dict - ETag / Last-Modified / фінальний URL відповіді
+            - content_hash: str - hash тіла сторінки
+            - fetch_strategy: str - стратегія завантаження (direct / proxy / browser)
+            - needs_render: bool - потрібен браузер (лише при render=False)
         """
         # Нормалізуємо домен
         if not domain.startswith(('http://', 'https://')):
@@ -420,15 +668,34 @@ class WebScraper:
                 logger.warning(f"Помилка читання кешу: {e}")
         
         # Завантажуємо HTML
-        html, error = await self.fetch_website(url, use_proxy=use_proxy)
+        page, error, strategy = await self.fetch_with_strategy(
+            domain, url, use_proxy=use_proxy, validators=validators, browser=render
+        )
+        result['fetch_strategy'] = strategy
+        if error == RENDER_REQUIRED:
+            result['needs_render'] = True
+            result['error'] = error
+            return result
+        html = page['html'] if page else None
+        
+        if page and page.get('not_modified'):
+            result['success'] = True
+            result['not_modified'] = True
+            result['validators'] = page['validators']
+            return result
         
         if html:
             result['success'] = True
             result['html_raw'] = html
-            result['content'] = self.extract_visible_content(html, url)
+            result['truncated'] = page['truncated']
+            result['validators'] = page.get('validators')
+            result['content_hash'] = content_hash(page['body'] or html)
+            if extract:
+                # Парсинг великих сторінок — у пулі процесів, щоб не блокувати event loop
+                result['content'] = await extract_content(page['body'] or html, url, page['encoding'])
             
-            # Зберегти в кеш
-            if cache:
+            # Зберегти в кеш (тільки повний результат з контентом)
+            if cache and extract:
                 try:
                     await cache.set_html(domain, {
                         'html_raw': html,
@@ -441,6 +708,38 @@ class WebScraper:
         
         return result
     
+    async def render_domain(self, domain: str, url: str) -> Dict[str, Any]:
+        """
+        Завантажити сторінку браузером (задача render після scrape_domain(render=False))
+        
+        Returns:
+            Dict як у scrape_domain(extract=False)
+        """
+        started = time.perf_counter()
+        page, error = await self._fetch_browser_page(url)
+        result = {
+            'success': False,
+            'domain': domain,
+            'url': url,
+            'html_raw': None,
+            'content': None,
+            'error': None,
+            'cached': False,
+            'fetch_strategy': 'browser'
+        }
+        if not page:
+            result['error'] = f"Playwright failed: {error}"
+            return result
+        
+        await save_strategy(domain, 'browser', time.perf_counter() - started)
+        await metrics.incr("fetch.strategy.browser")
+        result['success'] = True
+        result['html_raw'] = page['html']
+        result['truncated'] = False
+        result['validators'] = page['validators']
+        result['content_hash'] = content_hash(page['html'])
+        return result
+    
     @classmethod
     def create_with_config(cls, proxy_config: Optional[Dict] = None) -> "WebScraper":
         """
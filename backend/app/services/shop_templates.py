@@ -0,0 +1,205 @@
+"""
+Вивчені шаблони магазинів: повторне використання угод Gemini за DOM локаторами
+
+Для магазинів, які парсяться кожні кілька годин, Gemini знаходить той самий
+банер у тому самому місці сторінки. Після успішного аналізу кожна угода
+зіставляється з clean_html: якір (промокод, інакше розмір знижки) шукається
+в DOM і запам'ятовується XPath локатор елемента, що його містить (від
+найближчого стабільного id). Шаблон — це локатор + якір + сама угода
+(Redis, shop_template:{domain}).
+
+На наступних запусках шаблон застосовується першим:
+- кожен локатор знаходить елемент і в ньому досі є якір
+- в акційному тексті немає нових кодів чи розмірів знижок (-30%), яких не
+  було при вивченні
+Тоді угоди беруться з шаблону без Gemini (template.hit). Інакше — дрейф
+(template.drift), шаблон видаляється і сторінка йде в Gemini, після чого
+шаблон вивчається заново. Після SHOP_TEMPLATE_MAX_HITS попадань сторінка
+все одно йде в Gemini — щоб описи/дати угод не застарівали непомітно.
+
+Шаблон прив'язаний до відбитку промпту та моделі, як і стан домену.
+"""
+import json
+import logging
+import re
+from datetime import datetime
+from itertools import chain
+from typing import Dict, List, Optional
+
+import lxml.html
+from lxml import etree
+
+from app.core import metrics
+from app.core.config import settings
+from app.services.domain_state import promo_tokens
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_PREFIX = "shop_template:"
+TEMPLATE_TTL = 14 * 86400  # 14 днів
+
+NOT_FOUND = "Не знайдено"
+
+# id з числами/hash генеруються фреймворками і змінюються між запусками
+_VOLATILE_ID_RE = re.compile(r"\d{3,}|[0-9a-f]{8,}", re.I)
+
+
+async def _client():
+    from app.services.gemini import get_async_redis_client
+    return await get_async_redis_client()
+
+
+def _parse(html: str):
+    try:
+        return lxml.html.document_fromstring(html) if html else None
+    except (etree.ParserError, ValueError):
+        return None
+
+
+def _anchor(deal: Dict) -> Optional[str]:
+    """Текст, за яким угода знаходиться в DOM: промокод, інакше розмір знижки"""
+    for field in ("code", "discount"):
+        value = (deal.get(field) or "").strip()
+        if value and value != NOT_FOUND and len(value) >= 2:
+            return value
+    return None
+
+
+def _locator(el) -> str:
+    """XPath елемента від найближчого предка зі стабільним id (інакше від кореня)"""
+    tree = el.getroottree()
+    el_path = tree.getpath(el)
+    for anchor in chain([el], el.iterancestors()):
+        anchor_id = anchor.get("id")
+        if anchor_id and '"' not in anchor_id and not _VOLATILE_ID_RE.search(anchor_id):
+            return f'//*[@id="{anchor_id}"]' + el_path[len(tree.getpath(anchor)):]
+    return el_path
+
+
+def _locate(root, anchor: str):
+    """Найглибший елемент body, текст якого містить якір"""
+    matches = root.xpath("//body//*[contains(., $anchor)]", anchor=anchor)
+    return matches[-1] if matches else None
+
+
+def _page_tokens(content: Dict, root) -> List[str]:
+    """Коди та розміри знижок акційного тексту (promo_html, інакше весь body)"""
+    promo_html = content.get('promo_html')
+    if promo_html:
+        text = re.sub(r"<[^>]+>", " ", promo_html)
+    else:
+        body = root.find("body")
+        text = " ".join(body.itertext()) if body is not None else ""
+    return promo_tokens(text)
+
+
+def learn_template(content: Dict, deals: List[Dict]) -> Optional[Dict]:
+    """
+    Зіставити угоди Gemini з HTML
+
+    Returns:
+        {entries: [{locator, anchor, deal}], tokens} або None, якщо хоча б
+        одну угоду не знайдено в DOM
+    """
+    root = _parse(content.get('clean_html') or "")
+    if root is None or not deals:
+        return None
+    entries = []
+    for deal in deals:
+        anchor = _anchor(deal)
+        el = _locate(root, anchor) if anchor else None
+        if el is None:
+            return None
+        entries.append({"locator": _locator(el), "anchor": anchor, "deal": deal})
+    return {"entries": entries, "tokens": _page_tokens(content, root)}
+
+
+def apply_template(content: Dict, template: Dict) -> Optional[List[Dict]]:
+    """
+    Застосувати шаблон до поточного HTML
+
+    Returns:
+        Угоди шаблону, якщо всі локатори знайшли свій якір і нових кодів чи
+        знижок на сторінці немає; None — дрейф
+    """
+    root = _parse(content.get('clean_html') or "")
+    if root is None:
+        return None
+    entries = template["entries"]
+    for entry in entries:
+        try:
+            found = root.xpath(entry["locator"])
+        except etree.XPathError:
+            return None
+        if not found or entry["anchor"] not in found[0].text_content():
+            return None
+
+    # Новий промокод чи знижка на сторінці — шаблон вже не описує всі акції
+    if set(_page_tokens(content, root)) - set(template.get("tokens", [])):
+        return None
+    return [entry["deal"] for entry in entries]
+
+
+async def load_template(domain: str) -> Optional[Dict]:
+    try:
+        client = await _client()
+        raw = await client.get(f"{TEMPLATE_PREFIX}{domain}")
+        return json.loads(raw) if raw else None
+    except Exception as e:
+        logger.debug(f"[Template] Не вдалося прочитати шаблон {domain}: {e}")
+        return None
+
+
+async def _save(domain: str, template: Optional[Dict]):
+    try:
+        client = await _client()
+        key = f"{TEMPLATE_PREFIX}{domain}"
+        if template is None:
+            await client.delete(key)
+        else:
+            await client.setex(key, TEMPLATE_TTL, json.dumps(template, default=str))
+    except Exception as e:
+        logger.debug(f"[Template] Не вдалося зберегти шаблон {domain}: {e}")
+
+
+async def match_template(domain: str, content: Dict, fingerprint: str) -> Optional[List[Dict]]:
+    """
+    Угоди з шаблону домену або None (шаблону немає, дрейф або час перевірити через Gemini)
+    """
+    template = await load_template(domain)
+    if not template or template.get("prompt_fingerprint") != fingerprint:
+        await metrics.incr("template.miss")
+        return None
+    if template.get("hits", 0) >= settings.SHOP_TEMPLATE_MAX_HITS:
+        # Періодична перевірка шаблону через Gemini (він же і перевивчить шаблон)
+        await metrics.incr("template.recheck")
+        return None
+
+    await metrics.incr("template.applied")
+    deals = apply_template(content, template)
+    if deals is None:
+        await metrics.incr("template.drift")
+        logger.info(f"[Template] {domain}: сторінка змінилась, шаблон скинуто")
+        await _save(domain, None)
+        return None
+
+    await metrics.incr("template.hit")
+    template["hits"] = template.get("hits", 0) + 1
+    await _save(domain, template)
+    return deals
+
+
+async def save_template(domain: str, content: Dict, deals: List[Dict], fingerprint: str):
+    """Вивчити шаблон з угод Gemini (або скинути, якщо угоди не знаходяться в DOM)"""
+    learned = learn_template(content, deals)
+    if learned is None:
+        await metrics.incr("template.learn_failed")
+        await _save(domain, None)
+        return
+    await metrics.incr("template.learned")
+    await _save(domain, {
+        **learned,
+        "prompt_fingerprint": fingerprint,
+        "hits": 0,
+        "learned_at": datetime.utcnow().isoformat(),
+    })
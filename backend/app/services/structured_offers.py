@@ -0,0 +1,248 @@
+"""
+Детермінований витяг акцій зі структурованих даних сторінки
+
+Багато французьких магазинів вбудовують schema.org Offer/PriceSpecification
+у application/ld+json, microdata (itemtype=.../Offer) або Open Graph мета теги
+(product:sale_price:*). extract_visible_content видаляє всі <script>, тож ці
+дані треба зібрати до очищення дерева.
+
+Акцією вважається пропозиція, що має:
+- ціну нижчу за перекреслену/каталожну (StrikethroughPrice, ListPrice, sale_price)
+- discountCode
+- або ознаки акції в назві/описі (code promo, soldes, -20%) разом з терміном дії
+
+Результат — dict-и у форматі DealSchema (content['structured_offers']).
+STRUCTURED_OFFERS_MODE:
+- off     — не збирати
+- merge   — додавати до угод Gemini (без дублікатів)
+- replace — якщо структуровані угоди покривають усі акційні ознаки сторінки,
+            Gemini не викликається (covers_page)
+"""
+import json
+import logging
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+from app.services.promo_extractor import code_tokens, text_signal_counts
+
+logger = logging.getLogger(__name__)
+
+MAX_STRUCTURED_OFFERS = 10
+NOT_FOUND = "Не знайдено"
+
+OFFER_TYPES = {"offer", "aggregateoffer", "saleevent"}
+LIST_PRICE_TYPES = ("strikethroughprice", "listprice", "msrp")
+
+_DATE_RE = re.compile(r"(\d{4}-\d{2}-\d{2})(?:[T ](\d{2}:\d{2}))?")
+_PRICE_RE = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+def _types(node: Dict) -> set:
+    value = node.get("@type") or []
+    values = value if isinstance(value, list) else [value]
+    return {str(v).rsplit("/", 1)[-1].lower() for v in values}
+
+
+def _text(value: Any) -> str:
+    if isinstance(value, dict):
+        value = value.get("name") or value.get("@value") or ""
+    if isinstance(value, list):
+        value = value[0] if value else ""
+    return re.sub(r"\s+", " ", str(value or "")).strip()
+
+
+def _price(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _PRICE_RE.search(str(value or "").replace("\u00a0", "").replace(" ", ""))
+    return float(match.group().replace(",", ".")) if match else None
+
+
+def _date(value: Any, end: bool = False) -> Optional[str]:
+    """Дата у форматі DealSchema: YYYY-MM-DD HH:MM"""
+    match = _DATE_RE.search(_text(value))
+    if not match:
+        return None
+    return f"{match.group(1)} {match.group(2) or ('23:59' if end else '00:00')}"
+
+
+def _walk(data: Any, parent: Optional[Dict] = None) -> Iterator[Tuple[Dict, Optional[Dict]]]:
+    """Усі вузли JSON-LD разом з батьківським (Product для Offer)"""
+    if isinstance(data, list):
+        for item in data:
+            yield from _walk(item, parent)
+    elif isinstance(data, dict):
+        yield data, parent
+        for value in data.values():
+            if isinstance(value, (dict, list)):
+                yield from _walk(value, data)
+
+
+def _list_price(offer: Dict) -> Optional[float]:
+    specs = offer.get("priceSpecification") or []
+    for spec in specs if isinstance(specs, list) else [specs]:
+        if isinstance(spec, dict) and any(t in _text(spec.get("priceType")).lower() for t in LIST_PRICE_TYPES):
+            return _price(spec.get("price"))
+    return _price(offer.get("listPrice") or offer.get("highPrice"))
+
+
+def offer_to_deal(offer: Dict, parent: Optional[Dict], base_url: str, shop: str) -> Optional[Dict]:
+    """Offer (JSON-LD або зібраний з microdata) → dict DealSchema, або None якщо це не акція"""
+    parent = parent or {}
+    name = _text(offer.get("name")) or _text(parent.get("name"))
+    description = _text(offer.get("description")) or _text(parent.get("description"))
+    code = _text(offer.get("discountCode"))
+
+    price = _price(offer.get("price") or offer.get("lowPrice"))
+    list_price = _list_price(offer)
+    percent = None
+    if price is not None and list_price and 0 < price < list_price:
+        percent = round((list_price - price) / list_price * 100)
+
+    date_end = _date(offer.get("validThrough") or offer.get("priceValidUntil"), end=True)
+    signals = text_signal_counts(f"{name} {description}")[:3]
+    is_sale_event = "saleevent" in _types(offer)
+    if not (percent or code or is_sale_event or (any(signals) and date_end)):
+        return None
+
+    discount = f"{percent}%" if percent else _text(offer.get("discount")) or NOT_FOUND
+    title = name or description or "Акція"
+    url = _text(offer.get("url")) or _text(parent.get("url"))
+    return {
+        "shop": shop,
+        "domain": urlparse(base_url).netloc.removeprefix("www."),
+        "description": f"-{percent}% {title}" if percent else title,
+        "full_description": description or title,
+        "code": code or NOT_FOUND,
+        "date_start": _date(offer.get("validFrom") or offer.get("startDate")),
+        "date_end": date_end or _date(offer.get("endDate"), end=True),
+        "offer_type": 1 if code else 2,
+        "target_url": urljoin(base_url, url) if url else base_url,
+        "click_url": NOT_FOUND,
+        "discount": discount,
+        "categories": [],
+    }
+
+
+def _json_ld_offers(root) -> Iterator[Tuple[Dict, Optional[Dict]]]:
+    for script in root.iter("script"):
+        if "ld+json" not in (script.get("type") or "").lower() or not script.text:
+            continue
+        try:
+            data = json.loads(script.text)
+        except ValueError:
+            continue
+        for node, parent in _walk(data):
+            if _types(node) & OFFER_TYPES:
+                yield node, parent
+
+
+def _itemprop_value(el) -> str:
+    return el.get("content") or el.get("href") or el.get("datetime") or el.text_content()
+
+
+def _microdata_offers(root) -> Iterator[Tuple[Dict, Optional[Dict]]]:
+    for scope in root.xpath("//*[@itemscope][contains(@itemtype, 'schema.org/Offer')]"):
+        offer: Dict[str, Any] = {}
+        for prop in scope.xpath(".//*[@itemprop]"):
+            # Лише власні властивості, не вкладених itemscope
+            owner = next(prop.iterancestors(), None)
+            while owner is not None and owner is not scope and owner.get("itemscope") is None:
+                owner = owner.getparent()
+            if owner is scope:
+                offer.setdefault(prop.get("itemprop"), _itemprop_value(prop))
+        product = next((a for a in scope.iterancestors() if a.get("itemscope") is not None), None)
+        parent = None
+        if product is not None:
+            names = product.xpath(".//*[@itemprop='name']")
+            parent = {"name": _itemprop_value(names[0])} if names else None
+        yield offer, parent
+
+
+def _meta_offers(root) -> Iterator[Tuple[Dict, Optional[Dict]]]:
+    meta = {}
+    for el in root.iter("meta"):
+        key = (el.get("property") or el.get("name") or "").lower()
+        if key and el.get("content") and key not in meta:
+            meta[key] = el.get("content")
+    sale_price = meta.get("product:sale_price:amount")
+    if not sale_price:
+        return
+    yield {
+        "name": meta.get("og:title"),
+        "description": meta.get("og:description"),
+        "url": meta.get("og:url"),
+        "price": sale_price,
+        "listPrice": meta.get("product:price:amount") or meta.get("og:price:amount"),
+        "validFrom": meta.get("product:sale_price_dates:start"),
+        "validThrough": meta.get("product:sale_price_dates:end"),
+    }, None
+
+
+def extract_structured_offers(root, base_url: str) -> Tuple[List[Dict], Dict]:
+    """
+    Зібрати акції з JSON-LD, microdata та мета тегів (викликати до видалення <script>)
+
+    Returns:
+        (deals, stats): deals — dict-и DealSchema (найбільші знижки першими, до
+        MAX_STRUCTURED_OFFERS); stats — offers_seen і кількість угод за джерелами
+    """
+    site_name = ""
+    for el in root.iter("meta"):
+        if el.get("property") == "og:site_name" and el.get("content"):
+            site_name = el.get("content").strip()
+            break
+    shop = site_name or urlparse(base_url).netloc.removeprefix("www.")
+
+    deals: List[Dict] = []
+    seen = set()
+    stats = {"offers_seen": 0, "json_ld": 0, "microdata": 0, "meta": 0}
+    sources = (("json_ld", _json_ld_offers), ("microdata", _microdata_offers), ("meta", _meta_offers))
+    for source, offers in sources:
+        try:
+            for offer, parent in offers(root):
+                stats["offers_seen"] += 1
+                deal = offer_to_deal(offer, parent, base_url, shop)
+                if deal is None:
+                    continue
+                key = (deal["code"].upper(), deal["description"].lower())
+                if key not in seen:
+                    seen.add(key)
+                    deals.append(deal)
+                    stats[source] += 1
+        except Exception as e:
+            logger.debug(f"[Structured] {base_url}: помилка розбору {source}: {e}")
+
+    deals.sort(key=lambda d: _price(d["discount"]) or 0, reverse=True)
+    return deals[:MAX_STRUCTURED_OFFERS], stats
+
+
+def covers_page(content: Dict) -> bool:
+    """
+    Чи пояснюють структуровані угоди всі акційні ознаки сторінки
+
+    Так — якщо угоди є, а у видимому акційному тексті немає ні промокодів,
+    відсутніх серед угод, ні згадок "code promo" без жодного коду в угодах.
+    """
+    deals = content.get('structured_offers') or []
+    if not deals:
+        return False
+    promo_html = content.get('promo_html')
+    text = re.sub(r"<[^>]+>", " ", promo_html) if promo_html else content.get('text', "")
+    codes = {d["code"].upper() for d in deals if d["code"] != NOT_FOUND}
+    if set(code_tokens(text)) - codes:
+        return False
+    return not (text_signal_counts(text)[0] and not codes)
+
+
+def merge_deals(primary: List[Any], extra: List[Any]) -> List[Any]:
+    """Додати до primary угоди з extra, яких ще немає (за кодом або описом)"""
+    codes = {d.code.upper() for d in primary if d.code != NOT_FOUND}
+    descriptions = {d.description.lower() for d in primary}
+    merged = list(primary)
+    for deal in extra:
+        if deal.code.upper() in codes or deal.description.lower() in descriptions:
+            continue
+        merged.append(deal)
+    return merged
@@ -0,0 +1,211 @@
+"""
+Бюджет вхідних токенів для Gemini
+
+Раніше контент обрізався за символами (GEMINI_MAX_CONTENT_LENGTH), що погано
+відповідає токенам (французький текст і розмітка токенізуються по-різному)
+і могло різати посеред тегу. Тут:
+- estimate_tokens — локальна оцінка кількості токенів без запиту до API
+- fit_to_budget — розбиває контент на секції по межах блочних тегів і заповнює
+  бюджет спершу секціями з ознаками акцій, потім рештою в порядку документа;
+  залишок бюджету заповнює початком першої секції, що не вмістилась (обрізаною
+  по межі тегу/рядка) — інакше сторінка з однією великою секцією лишалась порожньою
+- cut_to_budget — обрізати текст по межі тегу/рядка до бюджету токенів
+- split_to_chunks — ділить контент на частини в межах бюджету (chunked режим Gemini)
+"""
+import re
+from typing import Dict, List, Tuple
+
+# Слова, групи цифр та окремі символи розмітки/пунктуації
+_TOKEN_RE = re.compile(r"[^\W\d_]+|\d+|[^\w\s]")
+
+# Межа секції — перед відкриваючим блочним тегом
+_SECTION_BOUNDARY_RE = re.compile(
+    r"(?=<(?:div|section|article|aside|main|form|table|ul|ol|p|h[1-6]|dialog|figure)\b)",
+    re.IGNORECASE
+)
+
+# Ознаки акційного блоку (класи/id банерів і попапів, ключові слова, відсотки)
+_PRIORITY_HINT_RE = re.compile(
+    r"promo|coupon|code|discount|sale|soldes|offre|offer|banner|popup|modal|hero|"
+    r"r[ée]duc|remise|livraison|знижк|акці|промокод|\d\s?%",
+    re.IGNORECASE
+)
+
+TRUNCATED_MARKER = "\n...(контент обрізано)"
+
+# Менший залишок бюджету не заповнюємо обрізаною секцією
+MIN_CUT_TOKENS = 50
+
+
+def _token_cost(token: str) -> int:
+    if token[0].isdigit():
+        return (len(token) + 2) // 3
+    if token[0].isalpha():
+        per_token = 4 if token.isascii() else 3
+        return (len(token) + per_token - 1) // per_token
+    return 1
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Локальна оцінка кількості токенів
+
+    ASCII слова ~4 символи на токен, не-ASCII (кирилиця, діакритика) ~3,
+    цифри групами по 3, кожен символ розмітки/пунктуації — окремий токен.
+    """
+    if not text:
+        return 0
+    return sum(_token_cost(match.group(0)) for match in _TOKEN_RE.finditer(text))
+
+
+def cut_to_budget(text: str, max_tokens: int) -> str:
+    """
+    Найдовший початок тексту в межах бюджету токенів, обрізаний по межі
+    тегу (після '>') або рядка; якщо такої межі немає в другій половині — по пробілу
+    """
+    used = 0
+    end = len(text)
+    for match in _TOKEN_RE.finditer(text):
+        used += _token_cost(match.group(0))
+        if used > max_tokens:
+            end = match.start()
+            break
+    else:
+        return text
+
+    boundary = max(text.rfind(">", 0, end) + 1, text.rfind("\n", 0, end) + 1)
+    if boundary <= end // 2:
+        # Не ріжемо посеред тегу: відступаємо до його початку, інакше до пробілу
+        tag_start = text.rfind("<", 0, end)
+        if tag_start > text.rfind(">", 0, end):
+            boundary = tag_start
+        else:
+            boundary = text.rfind(" ", 0, end) + 1
+    return text[:boundary if boundary > 0 else end]
+
+
+def split_sections(content: str) -> List[str]:
+    """Розбити HTML на секції по блочних тегах (текст без розмітки — по рядках)"""
+    if "<" in content:
+        sections = _SECTION_BOUNDARY_RE.split(content)
+    else:
+        sections = content.splitlines(keepends=True)
+    return [s for s in sections if s]
+
+
+def section_priority(section: str) -> int:
+    """0 — секція з ознаками акції, 1 — решта"""
+    return 0 if _PRIORITY_HINT_RE.search(section) else 1
+
+
+def fit_to_budget(content: str, max_tokens: int) -> Tuple[str, Dict]:
+    """
+    Вмістити контент у бюджет токенів
+
+    Args:
+        content: HTML або текст
+        max_tokens: Бюджет токенів для контенту (0 = без обмеження)
+
+    Returns:
+        (content, info): info — content_tokens, budget_tokens, truncated, dropped_sections,
+        cut_sections (1 — одну секцію вміщено частково)
+    """
+    content_tokens = estimate_tokens(content)
+    info = {
+        "content_tokens": content_tokens,
+        "budget_tokens": max_tokens,
+        "truncated": False,
+        "dropped_sections": 0,
+    }
+    if not max_tokens or content_tokens <= max_tokens:
+        return content, info
+
+    sections = split_sections(content)
+    costs = [estimate_tokens(s) for s in sections]
+    order = sorted(range(len(sections)), key=lambda i: (section_priority(sections[i]), i))
+
+    budget = max_tokens - estimate_tokens(TRUNCATED_MARKER)
+    parts: Dict[int, str] = {}
+    used = 0
+    for i in order:
+        if used + costs[i] <= budget:
+            parts[i] = sections[i]
+            used += costs[i]
+
+    # Залишок бюджету — початок найважливішої секції, що не вмістилась
+    cut_sections = 0
+    remaining = budget - used
+    first_dropped = next((i for i in order if i not in parts), None)
+    if first_dropped is not None and remaining >= MIN_CUT_TOKENS:
+        piece = cut_to_budget(sections[first_dropped], remaining)
+        if piece:
+            parts[first_dropped] = piece
+            used += estimate_tokens(piece)
+            cut_sections = 1
+
+    fitted = "".join(parts[i] for i in sorted(parts)) + TRUNCATED_MARKER
+    info.update({
+        "content_tokens": used,
+        "original_tokens": content_tokens,
+        "truncated": True,
+        "dropped_sections": len(sections) - len(parts),
+        "cut_sections": cut_sections,
+    })
+    return fitted, info
+
+
+def _split_oversized(section: str, max_tokens: int) -> List[str]:
+    """Секцію, більшу за бюджет, ріжемо на шматки в межах бюджету (виміряно, по межах тегів/рядків)"""
+    pieces = []
+    rest = section
+    while rest:
+        piece = cut_to_budget(rest, max_tokens) or rest[:max(1, len(rest) // 2)]
+        pieces.append(piece)
+        rest = rest[len(piece):]
+    return pieces
+
+
+def split_to_chunks(content: str, max_tokens: int, max_chunks: int = 0) -> Tuple[List[str], Dict]:
+    """
+    Розбити контент на частини по межах секцій, кожна в межах бюджету
+
+    Args:
+        content: HTML або текст
+        max_tokens: Бюджет токенів однієї частини
+        max_chunks: Макс. кількість частин (0 = без обмеження); якщо контенту більше,
+            спершу він вміщується в max_chunks * max_tokens через fit_to_budget
+            (секція, що не вмістилась, обрізається, а не відкидається)
+
+    Returns:
+        (chunks, info): info — content_tokens, chunks, truncated, dropped_sections
+    """
+    info = {"content_tokens": estimate_tokens(content), "truncated": False, "dropped_sections": 0}
+    if max_chunks and info["content_tokens"] > max_chunks * max_tokens:
+        # Запас 10%: секції не заповнюють частини щільно
+        content, fit_info = fit_to_budget(content, int(max_chunks * max_tokens * 0.9))
+        info.update(truncated=True, dropped_sections=fit_info["dropped_sections"])
+        if content.endswith(TRUNCATED_MARKER):
+            # Маркер лише для одиночного промпту — частини отримають його як звичайний текст
+            content = content[:-len(TRUNCATED_MARKER)]
+
+    chunks: List[str] = []
+    current: List[str] = []
+    used = 0
+    for section in split_sections(content):
+        cost = estimate_tokens(section)
+        pieces = _split_oversized(section, max_tokens) if cost > max_tokens else [section]
+        for piece in pieces:
+            piece_cost = estimate_tokens(piece) if len(pieces) > 1 else cost
+            if current and used + piece_cost > max_tokens:
+                chunks.append("".join(current))
+                current, used = [], 0
+            current.append(piece)
+            used += piece_cost
+    if current:
+        chunks.append("".join(current))
+    if max_chunks and len(chunks) > max_chunks:
+        # Хвіст понад ліміт (якщо запасу не вистачило) відкидаємо
+        info.update(truncated=True, dropped_chunks=len(chunks) - max_chunks)
+        chunks = chunks[:max_chunks]
+    info["chunks"] = len(chunks)
+    return chunks, info
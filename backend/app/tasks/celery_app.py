@@ -6,7 +6,7 @@ celery_app = Celery(
     "web_scraper",
     broker=settings.CELERY_BROKER_URL,
     backend=settings.CELERY_RESULT_BACKEND,
-    include=['app.tasks.scraping_tasks']
+    include=['app.tasks.scraping_tasks', 'app.tasks.pipeline_tasks']
 )
 
 # Конфігурація Celery
@@ -38,6 +38,19 @@ celery_app.conf.update(
     # Оптимізація
     worker_pool='solo',  # Для Windows compatibility (можна змінити на 'prefork' для Linux)
     worker_max_tasks_per_child=100,  # Перезапускати worker після 100 задач
+    
+    # Staged pipeline (SCRAPING_PIPELINE_MODE=staged): кожна стадія у своїй черзі,
+    # конкурентність задається окремими worker-ами (див. docker-compose, profile "staged").
+    # render — Playwright (PLAYWRIGHT_RENDER_QUEUE): prefork worker-и, браузер живе між
+    # задачами. --max-memory-per-child бачить лише Python процес, тому Chromium
+    # перезапускається окремо за пам'яттю всього дерева (PLAYWRIGHT_MAX_TREE_MEMORY_MB)
+    task_routes={
+        'pipeline_fetch_task': {'queue': 'fetch'},
+        'pipeline_render_task': {'queue': 'render'},
+        'pipeline_extract_task': {'queue': 'extract'},
+        'pipeline_llm_task': {'queue': 'llm'},
+        'pipeline_sink_task': {'queue': 'sink'},
+    },
 )
 
 # Автоматичне відкриття задач
@@ -0,0 +1,273 @@
+"""
+Staged pipeline парсингу: fetch (→ render) → extract → llm → sink
+
+Кожна стадія — окрема Celery задача у своїй черзі, тому повільний webhook
+або backoff Gemini не тримає слот завантаження:
+- fetch   — завантаження HTML (IO, висока конкурентність)
+- render  — Playwright для сторінок за антиботом (PLAYWRIGHT_RENDER_QUEUE):
+            окремі worker-и з власною конкурентністю, тож Chromium не роздуває
+            fetch worker-и; браузер перезапускається, коли пам'ять усього дерева
+            процесів перевищує PLAYWRIGHT_MAX_TREE_MEMORY_MB
+- extract — extract_visible_content (CPU)
+- llm     — Gemini (обмежено rate limiter)
+- sink    — БД, Redis результати та webhook
+
+Між стадіями передається лише посилання на payload у Redis (pipeline:*).
+Сирий HTML (до SCRAPING_MAX_BYTES) лежить окремим ключем (pipeline:*:html) і
+не входить ні в повідомлення брокера, ні в JSON payload — extract читає його
+за html_ref. Увімкнення: SCRAPING_PIPELINE_MODE=staged.
+"""
+import json
+import logging
+from typing import Dict, Optional
+
+from celery.signals import task_postrun
+
+from app.tasks.celery_app import celery_app
+from app.tasks.worker_loop import process_tree_rss_kb, run_in_worker_loop
+from app.tasks.scraping_tasks import (
+    CallbackTask,
+    redis_client,
+    _add_ui_log,
+    _is_stop_requested,
+    _load_session_config,
+    _new_domain_result,
+    _fetch_step,
+    _render_step,
+    _analyze_step,
+    _sink_step,
+    _update_task_status,
+    _update_session_in_db,
+)
+from app.core.config import settings
+from app.services.scraper import WebScraper
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_PAYLOAD_TTL = 7200  # 2 години
+
+
+def _put_payload(session_id: int, domain: str, stage: str, data: Dict) -> str:
+    """Зберегти payload стадії в Redis та повернути посилання на нього"""
+    ref = f"pipeline:{session_id}:{domain}:{stage}"
+    redis_client.setex(ref, PIPELINE_PAYLOAD_TTL, json.dumps(data))
+    return ref
+
+
+def _get_payload(ref: str) -> Optional[Dict]:
+    """Отримати payload стадії (видаляється після передачі далі, щоб пережити повтор задачі)"""
+    raw = redis_client.get(ref)
+    return json.loads(raw) if raw else None
+
+
+def _put_html(session_id: int, domain: str, scraped_data: Dict):
+    """Винести сирий HTML з scraped_data в окремий ключ Redis (scraped_data['html_ref'])"""
+    html = scraped_data.get('html_raw')
+    if html is None:
+        return
+    ref = f"pipeline:{session_id}:{domain}:html"
+    redis_client.setex(ref, PIPELINE_PAYLOAD_TTL, html)
+    scraped_data['html_ref'] = ref
+    scraped_data['html_raw'] = None
+
+
+def _get_html(scraped_data: Dict) -> str:
+    """Сирий HTML для стадії extract (з html_ref або, для старих payload, з html_raw)"""
+    ref = scraped_data.get('html_ref')
+    if not ref:
+        return scraped_data['html_raw']
+    raw = redis_client.get(ref)
+    if raw is None:
+        raise RuntimeError(f"HTML {ref} не знайдено (TTL минув?)")
+    return raw.decode('utf-8') if isinstance(raw, bytes) else raw
+
+
+def _drop_payload(ref: str):
+    try:
+        redis_client.delete(ref)
+    except Exception as e:
+        logger.debug(f"Не вдалося видалити payload {ref}: {e}")
+
+
+def _finish_domain(status_id: str, domain: str, session_id: int, status: str, result: Dict) -> Dict:
+    """Фінальний статус домену: Redis прогрес, лічильники сесії в БД та UI лог"""
+    _update_task_status(status_id, domain, status, session_id, result)
+    _update_session_in_db(session_id, result)
+
+    if status == "failed":
+        _add_ui_log("ERROR", f"✗ Критична помилка парсингу {domain}: {str(result.get('error'))[:100]}", domain)
+    elif result.get('success'):
+        deals_count = result.get('deals_count', 0)
+        _add_ui_log("INFO", f"✓ Завершено парсинг {domain}: {deals_count} угод", domain, {"deals_count": deals_count})
+    elif status != "skipped":
+        _add_ui_log("WARNING", f"⚠ Парсинг {domain}: {str(result.get('error') or 'Unknown error')[:100]}", domain)
+    return result
+
+
+def _fail_domain(status_id: str, domain: str, session_id: int, error: Exception, stage: str) -> Dict:
+    logger.error(f"[Pipeline {status_id}] ✗ Стадія {stage} для {domain}: {error}", exc_info=True)
+    error_result = {
+        "success": False,
+        "domain": domain,
+        "error": f"{stage}: {error}",
+        "deals_count": 0
+    }
+    return _finish_domain(status_id, domain, session_id, "failed", error_result)
+
+
+def _skip_domain(status_id: str, domain: str, session_id: int) -> Dict:
+    logger.info(f"[Pipeline {status_id}] ⏹ Пропускаємо {domain} - зупинка запрошена")
+    skipped_result = {
+        "success": False,
+        "domain": domain,
+        "session_id": session_id,
+        "deals_count": 0,
+        "deals": [],
+        "error": "Зупинка запрошена",
+        "skipped": True
+    }
+    return _finish_domain(status_id, domain, session_id, "skipped", skipped_result)
+
+
+def _load_stage_payload(payload_ref: str) -> Dict:
+    payload = _get_payload(payload_ref)
+    if payload is None:
+        raise RuntimeError(f"payload {payload_ref} не знайдено (TTL минув?)")
+    return payload
+
+
+@celery_app.task(bind=True, base=CallbackTask, name='pipeline_fetch_task')
+def pipeline_fetch_task(self, domain: str, session_id: int, config_ref: str) -> Dict:
+    """Стадія fetch: завантажити HTML та передати його на extract"""
+    status_id = self.request.id
+    if _is_stop_requested():
+        return _skip_domain(status_id, domain, session_id)
+
+    logger.info(f"[Pipeline {status_id}] Початок парсингу домену: {domain}")
+    _add_ui_log("INFO", f"Початок парсингу домену: {domain}", domain)
+    _update_task_status(status_id, domain, "running", session_id)
+
+    try:
+        config = _load_session_config(config_ref)
+        result = _new_domain_result(domain, session_id)
+        scraped_data = run_in_worker_loop(
+            _fetch_step(domain, config, result, extract=False, render=not settings.PLAYWRIGHT_RENDER_QUEUE)
+        )
+        if scraped_data is None:
+            return _finish_domain(status_id, domain, session_id, "completed", result)
+
+        if scraped_data.get('needs_render'):
+            # Браузер — на render worker-ах, цей слот fetch одразу вільний
+            ref = _put_payload(session_id, domain, "render", {"result": result, "scraped_data": scraped_data})
+            pipeline_render_task.delay(ref, status_id, domain, session_id, config_ref)
+            return {"domain": domain, "stage": "fetch", "payload_ref": ref, "handoff": "render"}
+
+        _put_html(session_id, domain, scraped_data)
+        ref = _put_payload(session_id, domain, "fetched", {"result": result, "scraped_data": scraped_data})
+        pipeline_extract_task.delay(ref, status_id, domain, session_id, config_ref)
+        return {"domain": domain, "stage": "fetch", "payload_ref": ref}
+    except Exception as e:
+        return _fail_domain(status_id, domain, session_id, e, "fetch")
+
+
+@celery_app.task(bind=True, base=CallbackTask, name='pipeline_render_task')
+def pipeline_render_task(self, payload_ref: str, status_id: str, domain: str, session_id: int, config_ref: str) -> Dict:
+    """Стадія render: завантажити сторінку браузером та передати її на extract"""
+    try:
+        payload = _load_stage_payload(payload_ref)
+        config = _load_session_config(config_ref)
+        result = payload['result']
+
+        scraped_data = run_in_worker_loop(_render_step(domain, config, result, payload['scraped_data']))
+        if scraped_data is None:
+            _drop_payload(payload_ref)
+            return _finish_domain(status_id, domain, session_id, "completed", result)
+
+        _put_html(session_id, domain, scraped_data)
+        ref = _put_payload(session_id, domain, "fetched", {"result": result, "scraped_data": scraped_data})
+        pipeline_extract_task.delay(ref, status_id, domain, session_id, config_ref)
+        _drop_payload(payload_ref)
+        return {"domain": domain, "stage": "render", "payload_ref": ref}
+    except Exception as e:
+        return _fail_domain(status_id, domain, session_id, e, "render")
+
+
+@task_postrun.connect(sender=pipeline_render_task)
+def _recycle_browser_on_memory(**kwargs):
+    """
+    Після рендеру: якщо процес разом з Chromium/драйвером займає понад
+    PLAYWRIGHT_MAX_TREE_MEMORY_MB — закрити браузер (наступний рендер запустить новий).
+    Пам'ять самого Python процесу обмежує --max-memory-per-child.
+    """
+    limit_mb = settings.PLAYWRIGHT_MAX_TREE_MEMORY_MB
+    if not limit_mb:
+        return
+    rss_kb = process_tree_rss_kb()
+    if rss_kb is None or rss_kb <= limit_mb * 1024:
+        return
+    logger.info(f"Render worker: {rss_kb // 1024} МБ з браузером (ліміт {limit_mb}), перезапускаємо браузер")
+    try:
+        from app.services.playwright_scraper import close_playwright_scraper
+        run_in_worker_loop(close_playwright_scraper(), timeout=30)
+    except Exception as e:
+        logger.warning(f"Не вдалося закрити браузер: {e}")
+
+
+@celery_app.task(bind=True, base=CallbackTask, name='pipeline_extract_task')
+def pipeline_extract_task(self, payload_ref: str, status_id: str, domain: str, session_id: int, config_ref: str) -> Dict:
+    """Стадія extract: витягнути видимий контент (CPU) та передати на llm"""
+    try:
+        payload = _load_stage_payload(payload_ref)
+        scraped_data = payload['scraped_data']
+        # 304 — тіла немає, угоди візьме стадія llm з попереднього стану домену
+        if not scraped_data.get('not_modified'):
+            scraped_data['content'] = WebScraper().extract_visible_content(
+                _get_html(scraped_data), scraped_data['url']
+            )
+        # Сирий HTML далі не потрібен — не тягнемо його через Redis
+        scraped_data['html_raw'] = None
+        html_ref = scraped_data.pop('html_ref', None)
+
+        ref = _put_payload(session_id, domain, "extracted", payload)
+        pipeline_llm_task.delay(ref, status_id, domain, session_id, config_ref)
+        _drop_payload(payload_ref)
+        if html_ref:
+            _drop_payload(html_ref)
+        return {"domain": domain, "stage": "extract", "payload_ref": ref}
+    except Exception as e:
+        return _fail_domain(status_id, domain, session_id, e, "extract")
+
+
+@celery_app.task(bind=True, base=CallbackTask, name='pipeline_llm_task')
+def pipeline_llm_task(self, payload_ref: str, status_id: str, domain: str, session_id: int, config_ref: str) -> Dict:
+    """Стадія llm: витягнути угоди через Gemini та передати на sink"""
+    try:
+        payload = _load_stage_payload(payload_ref)
+        config = _load_session_config(config_ref)
+        result = payload['result']
+
+        if not run_in_worker_loop(_analyze_step(domain, payload['scraped_data'], config, result)):
+            _drop_payload(payload_ref)
+            return _finish_domain(status_id, domain, session_id, "completed", result)
+
+        ref = _put_payload(session_id, domain, "analyzed", {"result": result})
+        pipeline_sink_task.delay(ref, status_id, domain, session_id, config_ref)
+        _drop_payload(payload_ref)
+        return {"domain": domain, "stage": "llm", "payload_ref": ref}
+    except Exception as e:
+        return _fail_domain(status_id, domain, session_id, e, "llm")
+
+
+@celery_app.task(bind=True, base=CallbackTask, name='pipeline_sink_task')
+def pipeline_sink_task(self, payload_ref: str, status_id: str, domain: str, session_id: int, config_ref: str) -> Dict:
+    """Стадія sink: зберегти угоди в Redis/БД, відправити webhook та завершити домен"""
+    try:
+        payload = _load_stage_payload(payload_ref)
+        config = _load_session_config(config_ref)
+        result = payload['result']
+
+        run_in_worker_loop(_sink_step(domain, session_id, config, result))
+        _drop_payload(payload_ref)
+        return _finish_domain(status_id, domain, session_id, "completed", result)
+    except Exception as e:
+        return _fail_domain(status_id, domain, session_id, e, "sink")
@@ -2,10 +2,26 @@ import asyncio
 import logging
 from typing import Dict, List, Optional
 from celery import Task
+from app.core import metrics
 from app.tasks.celery_app import celery_app
 from app.services.scraper import WebScraper
 from app.services.gemini import GeminiService
+from app.services.domain_state import (
+    conditional_validators,
+    load_domain_state,
+    page_promo_tokens,
+    page_simhash,
+    prompt_fingerprint,
+    reuse_reason,
+    save_domain_state,
+    usable_state,
+)
+from app.services.promo_classifier import classify_page, gate_enabled, record_outcome
+from app.services.structured_offers import covers_page, merge_deals
+from app.services.shop_templates import match_template, save_template
+from app.schemas.deals import DealSchema
 from app.services.proxy import ProxyRotator
+from app.tasks.worker_loop import run_in_worker_loop, get_shared_scraper
 import redis
 import json
 from datetime import datetime
@@ -16,6 +32,12 @@ logger = logging.getLogger(__name__)
 from app.core.config import settings
 redis_client = redis.from_url(settings.REDIS_URL)
 
+# Конфігурація сесії живе довше за прогрес — великі сесії обробляються годинами
+SESSION_CONFIG_TTL = 86400
+
+# Як часто перевіряти прапорець зупинки під час запиту до Gemini (секунди)
+STOP_POLL_INTERVAL = 1.0
+
 
 def _add_ui_log(level: str, message: str, domain: str = None, extra: dict = None):
     """Додати лог для UI (в Redis)"""
@@ -44,6 +66,28 @@ def _is_stop_requested() -> bool:
         return False
 
 
+async def _run_until_stopped(coro, poll_interval: float = STOP_POLL_INTERVAL):
+    """
+    Виконати корутину, скасувавши її, якщо під час виконання запрошено зупинку
+    
+    Returns:
+        (finished, result): finished=False якщо корутину скасовано через зупинку
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return True, task.result()
+            if await asyncio.to_thread(_is_stop_requested):
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                return False, None
+    finally:
+        if not task.done():
+            task.cancel()
+
+
 @celery_app.task(bind=True, base=CallbackTask, name='scrape_domain_task')
 def scrape_domain_task(self, domain: str, session_id: int, config: Optional[Dict] = None) -> Dict:
     """
@@ -57,11 +101,119 @@ def scrape_domain_task(self, domain: str, session_id: int, config: Optional[Dict
     Returns:
         Dict з результатами парсингу
     """
+    # Запускаємо асинхронну обробку в довгоживучому loop процесу
+    return run_in_worker_loop(
+        _process_domain_async(self.request.id, domain, session_id, config or {})
+    )
+
+
+@celery_app.task(bind=True, base=CallbackTask, name='scrape_domains_chunk_task')
+def scrape_domains_chunk_task(self, domains: List[str], session_id: int, config_ref: str) -> Dict:
+    """
+    Celery задача для парсингу пачки доменів конкурентно в одному event loop
+    
+    Більшість часу домен чекає на мережу або Gemini, тому один worker процес
+    обробляє до SCRAPING_CHUNK_CONCURRENCY доменів одночасно (asyncio.Semaphore).
+    Статуси та прогрес оновлюються для кожного домену окремо, як і раніше.
+    
+    Args:
+        domains: Домени пачки
+        session_id: ID сесії парсингу
+        config_ref: Ключ Redis з конфігурацією сесії (див. _store_session_config)
+    
+    Returns:
+        Dict зі зведенням по пачці
+    """
     task_id = self.request.id
+    config = _load_session_config(config_ref)
+    
+    logger.info(f"[Task {task_id}] Пачка з {len(domains)} доменів, сесія {session_id}")
+    results = run_in_worker_loop(
+        _scrape_chunk_async(task_id, domains, session_id, config, deadline=_chunk_deadline(len(domains)))
+    )
     
+    return {
+        "session_id": session_id,
+        "total": len(results),
+        "successful": sum(1 for r in results if r.get('success')),
+        "deals_count": sum(r.get('deals_count', 0) for r in results),
+    }
+
+
+def _chunk_deadline(chunk_len: int) -> float:
+    """Ліміт часу пачки: хвилі по SCRAPING_CHUNK_CONCURRENCY доменів, кожна до SCRAPING_DOMAIN_TIMEOUT"""
+    waves = -(-chunk_len // max(1, settings.SCRAPING_CHUNK_CONCURRENCY))
+    return waves * settings.SCRAPING_DOMAIN_TIMEOUT + 60
+
+
+async def _scrape_chunk_async(
+    task_id: str, domains: List[str], session_id: int, config: Dict, deadline: Optional[float] = None
+) -> List[Dict]:
+    """
+    Обробити домени пачки під семафором (не більше SCRAPING_CHUNK_CONCURRENCY одночасно)
+    
+    deadline — ліміт часу всієї пачки в секундах. Він діє всередині event loop, бо
+    solo та threads пули Celery не застосовують soft/hard time limit. Після нього
+    домени без фінального статусу позначаються failed.
+    """
+    semaphore = asyncio.Semaphore(max(1, settings.SCRAPING_CHUNK_CONCURRENCY))
+    # Домени, що вже почали записувати фінальний статус (записує _process_domain_async)
+    finished = set()
+    results = {}
+    
+    async def run_one(domain: str):
+        async with semaphore:
+            results[domain] = await _process_domain_async(
+                f"{task_id}:{domain}", domain, session_id, config,
+                timeout=settings.SCRAPING_DOMAIN_TIMEOUT, finished=finished
+            )
+    
+    try:
+        await asyncio.wait_for(asyncio.gather(*(run_one(domain) for domain in domains)), deadline)
+    except asyncio.TimeoutError:
+        # Інакше необроблені домени (і ті, що оброблялись) лишились би без фінального
+        # статусу — лічильники та прогрес сесії не дійшли б до кінця
+        unfinished = [d for d in domains if d not in finished]
+        logger.error(f"[Task {task_id}] Ліміт часу пачки {deadline}с, не оброблено {len(unfinished)} доменів")
+        _add_ui_log("ERROR", f"✗ Ліміт часу пачки: {len(unfinished)} доменів не оброблено")
+        for domain in unfinished:
+            error_result = {
+                "success": False,
+                "domain": domain,
+                "error": "Перевищено ліміт часу пачки",
+                "deals_count": 0
+            }
+            await _finish_domain(finished, f"{task_id}:{domain}", domain, "failed", session_id, error_result)
+            results[domain] = error_result
+    
+    # Домени, скасовані під час запису фінального статусу, свій статус уже записали
+    return [results.get(domain, {"success": False, "domain": domain, "deals_count": 0}) for domain in domains]
+
+
+async def _process_domain_async(
+    status_id: str,
+    domain: str,
+    session_id: int,
+    config: Dict,
+    timeout: Optional[float] = None,
+    finished: Optional[set] = None
+) -> Dict:
+    """
+    Обробка одного домену з оновленням статусу задачі, прогресу сесії та БД
+    
+    Args:
+        status_id: Ідентифікатор для task:{status_id} в Redis (task_id або task_id:domain)
+        domain: Домен для парсингу
+        session_id: ID сесії парсингу
+        config: Конфігурація сесії
+        timeout: Ліміт часу на домен в секундах (None = без ліміту)
+        finished: Сюди домен додається перед записом фінального статусу, щоб
+            скасування пачки не записало його вдруге
+    """
+    finished = finished if finished is not None else set()
     # Перевіряємо чи не було запрошено зупинку
     if _is_stop_requested():
-        logger.info(f"[Task {task_id}] ⏹ Пропускаємо {domain} - зупинка запрошена")
+        logger.info(f"[Task {status_id}] ⏹ Пропускаємо {domain} - зупинка запрошена")
         
         # Update task status with "skipped" terminal state so counters remain consistent
         skipped_result = {
@@ -73,43 +225,39 @@ def scrape_domain_task(self, domain: str, session_id: int, config: Optional[Dict
             "error": "Зупинка запрошена",
             "skipped": True
         }
-        _update_task_status(task_id, domain, "skipped", session_id, skipped_result)
-        
-        # Also update database session counters to keep DB in sync with Redis
+        # Also updates database session counters to keep DB in sync with Redis
         # Without this, processed_domains in DB would be lower than Redis counter
-        _update_session_in_db(session_id, skipped_result)
+        await _finish_domain(finished, status_id, domain, "skipped", session_id, skipped_result)
         
         return skipped_result
     
-    logger.info(f"[Task {task_id}] Початок парсингу домену: {domain}")
+    logger.info(f"[Task {status_id}] Початок парсингу домену: {domain}")
     _add_ui_log("INFO", f"Початок парсингу домену: {domain}", domain)
     
     # Оновлюємо статус в Redis
-    _update_task_status(task_id, domain, "running", session_id)
+    await asyncio.to_thread(_update_task_status, status_id, domain, "running", session_id)
     
     try:
-        # Запускаємо асинхронну обробку
-        result = asyncio.run(_scrape_domain_async(domain, session_id, config or {}))
-        
-        # Оновлюємо статус
-        _update_task_status(task_id, domain, "completed", session_id, result)
+        result = await asyncio.wait_for(_scrape_domain_async(domain, session_id, config), timeout)
         
-        # Оновлюємо сесію в БД
-        _update_session_in_db(session_id, result)
+        # Оновлюємо статус та сесію в БД
+        await _finish_domain(finished, status_id, domain, "completed", session_id, result)
         
         deals_count = result.get('deals_count', 0)
         if result.get('success'):
-            logger.info(f"[Task {task_id}] ✓ Завершено парсинг {domain}: {deals_count} угод")
+            logger.info(f"[Task {status_id}] ✓ Завершено парсинг {domain}: {deals_count} угод")
             _add_ui_log("INFO", f"✓ Завершено парсинг {domain}: {deals_count} угод", domain, {"deals_count": deals_count})
         else:
             error_msg = result.get('error', 'Unknown error')
-            logger.warning(f"[Task {task_id}] ⚠ Парсинг {domain} завершено з помилкою: {error_msg}")
+            logger.warning(f"[Task {status_id}] ⚠ Парсинг {domain} завершено з помилкою: {error_msg}")
             _add_ui_log("WARNING", f"⚠ Парсинг {domain}: {error_msg[:100]}", domain)
         
         return result
     
     except Exception as e:
-        logger.error(f"[Task {task_id}] ✗ Помилка парсингу {domain}: {str(e)}", exc_info=True)
+        if isinstance(e, asyncio.TimeoutError):
+            e = TimeoutError(f"Перевищено ліміт {timeout}с на домен")
+        logger.error(f"[Task {status_id}] ✗ Помилка парсингу {domain}: {str(e)}", exc_info=True)
         _add_ui_log("ERROR", f"✗ Критична помилка парсингу {domain}: {str(e)[:100]}", domain)
         
         error_result = {
@@ -119,21 +267,54 @@ def scrape_domain_task(self, domain: str, session_id: int, config: Optional[Dict
             "deals_count": 0
         }
         
-        _update_task_status(task_id, domain, "failed", session_id, error_result)
-        
-        # Оновлюємо сесію в БД
-        _update_session_in_db(session_id, error_result)
+        await _finish_domain(finished, status_id, domain, "failed", session_id, error_result)
         
         return error_result
 
 
+async def _finish_domain(finished: set, status_id: str, domain: str, status: str, session_id: int, result: Dict):
+    """
+    Записати фінальний статус домену (Redis + БД) рівно один раз
+    
+    Домен позначається у finished до запису, а сам запис захищений від скасування
+    (asyncio.shield) — якщо ліміт пачки спрацює посеред запису, статус все одно
+    буде записано повністю, а обробник ліміту цей домен пропустить.
+    """
+    finished.add(domain)
+    
+    def write():
+        _update_task_status(status_id, domain, status, session_id, result)
+        _update_session_in_db(session_id, result)
+    
+    await asyncio.shield(asyncio.to_thread(write))
+
+
 async def _scrape_domain_async(domain: str, session_id: int, config: Dict) -> Dict:
     """
     Асинхронна функція для парсингу домену
     
-    Повний цикл: WebScraper → GeminiService → збереження результату
+    Повний цикл: WebScraper → GeminiService → збереження результату.
+    Ті самі кроки окремо використовує staged pipeline (app.tasks.pipeline_tasks).
     """
-    result = {
+    result = _new_domain_result(domain, session_id)
+    
+    # Крок 1: Завантажуємо HTML через WebScraper
+    scraped_data = await _fetch_step(domain, config, result)
+    if scraped_data is None:
+        return result
+    
+    # Крок 2: Аналізуємо через Gemini AI
+    if not await _analyze_step(domain, scraped_data, config, result):
+        return result
+    
+    # Крок 3-4: Зберігаємо результат та відправляємо в webhook
+    await _sink_step(domain, session_id, config, result)
+    return result
+
+
+def _new_domain_result(domain: str, session_id: int) -> Dict:
+    """Початковий результат обробки домену"""
+    return {
         "success": False,
         "domain": domain,
         "session_id": session_id,
@@ -143,72 +324,224 @@ async def _scrape_domain_async(domain: str, session_id: int, config: Dict) -> Di
         "scraped_at": datetime.utcnow().isoformat(),
         "metadata": {}
     }
+
+
+async def _fetch_step(
+    domain: str, config: Dict, result: Dict, extract: bool = True, render: bool = True
+) -> Optional[Dict]:
+    """
+    Завантажити HTML домену (та витягнути контент, якщо extract=True)
     
-    # Крок 1: Завантажуємо HTML через WebScraper
-    scraper = None
+    render=False — сторінки, яким потрібен браузер, не рендеряться тут, а
+    повертаються з needs_render (staged pipeline передає їх у чергу render)
+    
+    Returns:
+        scraped_data від WebScraper або None при помилці (помилка записується в result)
+    """
     scraped_data = None
     try:
-        # Створюємо scraper з проксі якщо є конфігурація
+        # Спільний scraper процесу (з проксі якщо є конфігурація) — сесії та пул з'єднань
+        # живуть між доменами, тому тут його не закриваємо
         proxy_config = config.get('proxy')
-        scraper = WebScraper.create_with_config(proxy_config) if proxy_config else WebScraper()
+        scraper = await get_shared_scraper(proxy_config)
         
         logger.info(f"Завантаження HTML для {domain}...")
         _add_ui_log("DEBUG", f"Завантаження HTML для {domain}...", domain)
         
-        # use_cache=False — async Redis кеш дає "Event loop is closed" у Celery
-        scraped_data = await scraper.scrape_domain(domain, use_proxy=bool(proxy_config), use_cache=False)
+        # Попередній стан домену (якщо отриманий з тим самим промптом) — для умовного запиту
+        previous_state = usable_state(await load_domain_state(domain), _prompt_fingerprint(config))
+        
+        # use_cache=False — відповідь з HTML кешу не має validators / content_hash /
+        # fetch_strategy, тож обійшла б умовний запит і повторне використання
+        # стану домену; свіжість тепер забезпечують ETag/304 та domain_state
+        scraped_data = await scraper.scrape_domain(
+            domain, use_proxy=bool(proxy_config), use_cache=False, extract=extract,
+            validators=conditional_validators(previous_state), render=render
+        )
+        if scraped_data is not None:
+            scraped_data['previous_state'] = previous_state
         
     except Exception as e:
         logger.error(f"Помилка WebScraper для {domain}: {e}")
         _add_ui_log("ERROR", f"WebScraper помилка для {domain}: {str(e)[:100]}", domain)
         result['error'] = f"WebScraper error: {str(e)}"
-    finally:
-        # Закриваємо HTTP сесію
-        if scraper:
-            try:
-                await scraper.close()
-            except Exception:
-                pass
-    
-    # Перевіряємо результат scraping
+    
+    if scraped_data is not None and scraped_data.get('needs_render'):
+        result['metadata']['fetch_strategy'] = 'browser'
+        _add_ui_log("DEBUG", f"{domain}: потрібен браузер, передано в чергу render", domain)
+        return scraped_data
+    
+    return _check_fetched(domain, scraped_data, result)
+
+
+async def _render_step(domain: str, config: Dict, result: Dict, scraped_data: Dict) -> Optional[Dict]:
+    """
+    Відрендерити сторінку браузером (після _fetch_step з render=False)
+    
+    Returns:
+        scraped_data як у _fetch_step або None при помилці
+    """
+    previous_state = scraped_data.get('previous_state')
+    rendered = None
+    try:
+        scraper = await get_shared_scraper(config.get('proxy'))
+        logger.info(f"🌐 Рендер браузером для {domain}...")
+        rendered = await scraper.render_domain(domain, scraped_data['url'])
+        rendered['previous_state'] = previous_state
+    except Exception as e:
+        logger.error(f"Помилка рендеру для {domain}: {e}")
+        _add_ui_log("ERROR", f"Playwright помилка для {domain}: {str(e)[:100]}", domain)
+        result['error'] = f"Playwright error: {str(e)}"
+    return _check_fetched(domain, rendered, result)
+
+
+def _check_fetched(domain: str, scraped_data: Optional[Dict], result: Dict) -> Optional[Dict]:
+    """Перевірити результат завантаження та записати його метадані в result"""
     if scraped_data is None:
-        return result
+        return None
     
     if not scraped_data['success']:
         error_msg = scraped_data.get('error', 'Scraping failed')
         result['error'] = error_msg
         _add_ui_log("ERROR", f"Помилка завантаження {domain}: {error_msg[:100]}", domain)
-        return result
+        return None
+    
+    if scraped_data.get('fetch_strategy'):
+        result['metadata']['fetch_strategy'] = scraped_data['fetch_strategy']
     
-    html_len = len(scraped_data.get('html_raw', ''))
+    if scraped_data.get('not_modified'):
+        result['metadata']['not_modified'] = True
+        _add_ui_log("INFO", f"✓ {domain} не змінився з минулого разу (304)", domain)
+        return scraped_data
+    
+    html_len = len(scraped_data.get('html_raw') or '')
     result['metadata']['html_length'] = html_len
+    result['metadata']['html_truncated'] = scraped_data.get('truncated', False)
     _add_ui_log("INFO", f"✓ Завантажено HTML для {domain} ({html_len} байт)", domain, {"html_length": html_len})
+    return scraped_data
+
+
+def _prompt_fingerprint(config: Dict) -> str:
+    """Відбиток промпту та моделі сесії (угоди з іншим промптом не перевикористовуються)"""
+    return prompt_fingerprint(config.get('prompt') or GeminiService.DEFAULT_PROMPT, settings.GEMINI_MODEL)
+
+
+def _structured_deals(content: Optional[Dict]) -> List[DealSchema]:
+    """Валідні угоди зі структурованих даних сторінки (JSON-LD / microdata / meta)"""
+    deals = []
+    for data in (content or {}).get('structured_offers') or []:
+        try:
+            deals.append(DealSchema(**data))
+        except Exception as e:
+            logger.debug(f"Невалідна структурована угода: {e}")
+    return deals
+
+
+async def _analyze_step(domain: str, scraped_data: Dict, config: Dict, result: Dict) -> bool:
+    """
+    Витягнути угоди через Gemini AI та записати їх у result
     
+    Returns:
+        True якщо можна переходити до збереження результату
+    """
     # Перевірка зупинки перед Gemini
     if _is_stop_requested():
         result['error'] = "Зупинка запрошена"
         result['skipped'] = True
-        return result
+        return False
     
-    # Крок 2: Аналізуємо через Gemini AI
     try:
-        gemini_key = config.get('gemini_key')
-        prompt_template = config.get('prompt')
-        gemini = GeminiService(
-            api_key=gemini_key or None,
-            prompt_template=prompt_template
+        scraped_data['simhash'] = page_simhash(scraped_data.get('content'))
+        scraped_data['promo_tokens'] = page_promo_tokens(scraped_data.get('content'))
+        reason = reuse_reason(scraped_data)
+        if 'simhash_distance' in scraped_data:
+            result['metadata']['simhash_distance'] = scraped_data['simhash_distance']
+        # Акції зі структурованих даних: у режимі replace замість Gemini, якщо покривають сторінку
+        content = scraped_data.get('content')
+        structured_mode = settings.STRUCTURED_OFFERS_MODE
+        structured = _structured_deals(content) if structured_mode != "off" else []
+        resolved_by_structured = (
+            not reason and structured_mode == "replace" and bool(structured) and covers_page(content)
         )
-        
-        logger.info(f"Аналіз через Gemini AI для {domain}...")
-        _add_ui_log("DEBUG", f"Аналіз через Gemini AI для {domain}...", domain)
-        
-        deals, error, metadata = await gemini.extract_deals_from_scraped_data(scraped_data)
-        
-        if error:
-            result['error'] = error
-            result['metadata']['gemini'] = metadata
-            _add_ui_log("WARNING", f"Gemini помилка для {domain}: {error[:100]}", domain)
-            return result
+        if not reason and structured_mode != "off" and content:
+            await metrics.incr("structured.domains")
+            if structured:
+                await metrics.incr("structured.with_offers")
+            if resolved_by_structured:
+                await metrics.incr("structured.resolved")
+        
+        # Вивчений шаблон магазину: ті самі банери в тих самих місцях DOM — без Gemini
+        template_deals = None
+        if not reason and not resolved_by_structured and settings.SHOP_TEMPLATES_ENABLED and content:
+            template_deals = await match_template(domain, content, _prompt_fingerprint(config))
+        
+        # Шлюз: сторінки без ознак акцій не відправляємо в Gemini (у shadow режимі — лише рішення)
+        gate = None
+        if not reason and not resolved_by_structured and template_deals is None and gate_enabled() and content:
+            gate = classify_page(content)
+            result['metadata']['promo_gate'] = {k: v for k, v in gate.items() if k != 'features'}
+        
+        if reason:
+            # Сторінка не змінилась — попередні угоди без запиту до Gemini
+            previous = scraped_data['previous_state']
+            deals = [DealSchema(**d) for d in previous['deals']]
+            metadata = {"reused": reason, "reused_from": previous.get('updated_at')}
+            if reason == "simhash":
+                metadata["simhash_distance"] = scraped_data['simhash_distance']
+                # Відбиток тексту, з якого реально отримано угоди — дрібні зміни не накопичуються
+                scraped_data['simhash'] = previous['simhash']
+            logger.info(f"↺ {domain} не змінився ({reason}), використано {len(deals)} попередніх угод")
+            _add_ui_log("INFO", f"↺ {domain} не змінився, використано {len(deals)} попередніх угод (без Gemini)", domain)
+        elif resolved_by_structured:
+            deals = structured
+            metadata = {"resolved_by": "structured", "structured_stats": content.get('structured_stats')}
+            logger.info(f"✓ {domain}: {len(deals)} угод зі структурованих даних, Gemini не потрібен")
+            _add_ui_log("INFO", f"✓ {domain}: {len(deals)} угод зі структурованих даних (без Gemini)", domain)
+        elif template_deals is not None:
+            deals = [DealSchema(**d) for d in template_deals]
+            metadata = {"resolved_by": "template"}
+            logger.info(f"✓ {domain}: {len(deals)} угод за вивченим шаблоном, Gemini не потрібен")
+            _add_ui_log("INFO", f"✓ {domain}: {len(deals)} угод за шаблоном магазину (без Gemini)", domain)
+        elif gate and gate['skip']:
+            # Структуровані угоди (якщо є) не губимо навіть без Gemini
+            deals = structured
+            metadata = {"skipped": "promo_gate", "probability": gate['probability']}
+            await metrics.incr("promo_gate.skipped")
+            logger.info(f"⊘ {domain}: ознак акцій немає (p={gate['probability']}), Gemini пропущено")
+            _add_ui_log("INFO", f"⊘ {domain}: ознак акцій немає, Gemini пропущено", domain)
+        else:
+            gemini_key = config.get('gemini_key')
+            prompt_template = config.get('prompt')
+            gemini = GeminiService(
+                api_key=gemini_key or None,
+                prompt_template=prompt_template
+            )
+            
+            logger.info(f"Аналіз через Gemini AI для {domain}...")
+            _add_ui_log("DEBUG", f"Аналіз через Gemini AI для {domain}...", domain)
+            
+            # Запит у польоті скасовується, якщо під час нього натиснули "Зупинити"
+            finished, extracted = await _run_until_stopped(gemini.extract_deals_from_scraped_data(scraped_data))
+            if not finished:
+                logger.info(f"⏹ Запит до Gemini для {domain} скасовано - зупинка запрошена")
+                result['error'] = "Зупинка запрошена"
+                result['skipped'] = True
+                return False
+            deals, error, metadata = extracted
+            
+            if error:
+                result['error'] = error
+                result['metadata']['gemini'] = metadata
+                _add_ui_log("WARNING", f"Gemini помилка для {domain}: {error[:100]}", domain)
+                return False
+            if gate:
+                await record_outcome(domain, gate, bool(deals))
+            if settings.SHOP_TEMPLATES_ENABLED and content and deals and not metadata.get("chunk_errors"):
+                await save_template(domain, content, [d.model_dump() for d in deals], _prompt_fingerprint(config))
+            if structured:
+                merged = merge_deals(deals, structured)
+                metadata["structured_added"] = len(merged) - len(deals)
+                deals = merged
         
         # Підставляємо назву магазину з API (якщо є), а не з Gemini
         shop_name = config.get('domain_names', {}).get(domain)
@@ -227,8 +560,19 @@ async def _scrape_domain_async(domain: str, session_id: int, config: Dict) -> Di
         result['deals'] = [deal.dict() for deal in deals]
         result['metadata']['gemini'] = metadata
         
-        logger.info(f"✓ Знайдено {len(deals)} угод для {domain}")
-        _add_ui_log("INFO", f"✓ Gemini знайшов {len(deals)} угод для {domain}", domain, {"deals_count": len(deals)})
+        if metadata.get("skipped"):
+            return True
+        
+        # Валідатори, hash сторінки та угоди — для наступного запуску.
+        # Частково невдалий chunked аналіз не зберігаємо: інакше неповні угоди
+        # перевикористовувались би за hash/304 до 7 днів
+        if not metadata.get("chunk_errors"):
+            await save_domain_state(domain, scraped_data, result['deals'], _prompt_fingerprint(config))
+        
+        if not reason and not metadata.get("resolved_by"):
+            logger.info(f"✓ Знайдено {len(deals)} угод для {domain}")
+            _add_ui_log("INFO", f"✓ Gemini знайшов {len(deals)} угод для {domain}", domain, {"deals_count": len(deals)})
+        return True
         
     except Exception as e:
         err_s = str(e).strip()
@@ -239,33 +583,19 @@ async def _scrape_domain_async(domain: str, session_id: int, config: Dict) -> Di
         logger.error(f"Помилка Gemini для {domain}: {msg}")
         _add_ui_log("ERROR", f"Gemini помилка для {domain}: {msg[:100]}", domain)
         result['error'] = msg
-        return result
-    
+        return False
+
+
+async def _sink_step(domain: str, session_id: int, config: Dict, result: Dict):
+    """Зберегти результат в Redis та БД і відправити угоди в webhook"""
     # Крок 3: Зберігаємо результат в БД та Redis
     try:
         # Зберігаємо в Redis для швидкого доступу
         _save_scraping_result(session_id, domain, result)
         
-        # Зберігаємо в БД для постійного зберігання
+        # Зберігаємо в БД для постійного зберігання (sync SQLAlchemy — поза event loop)
         if result['success'] and result['deals_count'] > 0:
-            from app.db.session import SessionLocal
-            from app.db import crud
-            
-            db = SessionLocal()
-            try:
-                # Зберігаємо кожну угоду в БД
-                for deal_data in result['deals']:
-                    crud.create_scraped_deal(
-                        db=db,
-                        session_id=session_id,
-                        domain=domain,
-                        deal_data=deal_data
-                    )
-                logger.info(f"✓ Збережено {result['deals_count']} угод в БД для {domain}")
-            except Exception as db_error:
-                logger.error(f"Помилка збереження в БД: {db_error}")
-            finally:
-                db.close()
+            await asyncio.to_thread(_save_deals_to_db, session_id, domain, result)
     except Exception as e:
         logger.warning(f"Не вдалося зберегти результат: {e}")
     
@@ -299,8 +629,28 @@ async def _scrape_domain_async(domain: str, session_id: int, config: Dict) -> Di
             _add_ui_log("ERROR", f"Webhook помилка для {domain}: {str(e)[:100]}", domain)
             result['webhook_sent'] = False
             result['webhook_error'] = str(e)
+
+
+def _save_deals_to_db(session_id: int, domain: str, result: Dict):
+    """Зберегти угоди домену в БД"""
+    from app.db.session import SessionLocal
+    from app.db import crud
     
-    return result
+    db = SessionLocal()
+    try:
+        # Зберігаємо кожну угоду в БД
+        for deal_data in result['deals']:
+            crud.create_scraped_deal(
+                db=db,
+                session_id=session_id,
+                domain=domain,
+                deal_data=deal_data
+            )
+        logger.info(f"✓ Збережено {result['deals_count']} угод в БД для {domain}")
+    except Exception as db_error:
+        logger.error(f"Помилка збереження в БД: {db_error}")
+    finally:
+        db.close()
 
 
 def _update_task_status(task_id: str, domain: str, status: str, session_id: int, result: Optional[Dict] = None):
@@ -482,21 +832,36 @@ def start_batch_scraping(domains: List[str], session_id: int, config: Optional[D
     # Ініціалізуємо прогрес сесії
     _init_session_progress(session_id, domains)
     
-    # Запускаємо задачі для кожного домену
+    # Конфіг зберігаємо в Redis один раз — задачі отримують лише посилання на нього
+    config_ref = _store_session_config(session_id, config or {})
+    
+    if settings.SCRAPING_PIPELINE_MODE == "staged":
+        return _start_staged_pipeline(domains, session_id, config_ref)
+    
+    # Запускаємо задачі пачками по SCRAPING_CHUNK_SIZE доменів
+    chunk_size = max(1, settings.SCRAPING_CHUNK_SIZE)
     task_ids = []
     task_id_list = []  # Для збереження в Redis
-    for domain in domains:
-        task = scrape_domain_task.delay(domain, session_id, config)
+    for start in range(0, len(domains), chunk_size):
+        chunk = domains[start:start + chunk_size]
+        # Основний ліміт пачки діє в event loop (_chunk_deadline); soft/hard time limit
+        # Celery — лише запобіжник для prefork, solo та threads пули їх не застосовують
+        soft_limit = _chunk_deadline(len(chunk)) + 60
+        task = scrape_domains_chunk_task.apply_async(
+            args=(chunk, session_id, config_ref),
+            soft_time_limit=soft_limit,
+            time_limit=soft_limit + 60
+        )
         task_ids.append({
             "task_id": task.id,
-            "domain": domain
+            "domains": chunk
         })
         task_id_list.append(task.id)
     
     # Зберігаємо task_ids в Redis для можливості скасування
     redis_client.set("scraping:task_ids", json.dumps(task_id_list))
     
-    logger.info(f"Запущено {len(task_ids)} задач для сесії {session_id}")
+    logger.info(f"Запущено {len(task_ids)} задач ({len(domains)} доменів) для сесії {session_id}")
     _add_ui_log("INFO", f"📋 Запущено {len(task_ids)} задач для обробки", extra={"task_count": len(task_ids)})
     
     return {
@@ -507,6 +872,53 @@ def start_batch_scraping(domains: List[str], session_id: int, config: Optional[D
     }
 
 
+def _start_staged_pipeline(domains: List[str], session_id: int, config_ref: str) -> Dict:
+    """Запустити staged pipeline: кожен домен стартує зі стадії fetch"""
+    from app.tasks.pipeline_tasks import pipeline_fetch_task
+    
+    task_ids = []
+    task_id_list = []
+    for domain in domains:
+        task = pipeline_fetch_task.delay(domain, session_id, config_ref)
+        task_ids.append({
+            "task_id": task.id,
+            "domain": domain
+        })
+        task_id_list.append(task.id)
+    
+    # Скасувати через /stop можна лише fetch задачі; наступні стадії перевіряють stop флаг
+    redis_client.set("scraping:task_ids", json.dumps(task_id_list))
+    
+    logger.info(f"Запущено staged pipeline: {len(task_ids)} доменів для сесії {session_id}")
+    _add_ui_log("INFO", f"📋 Запущено {len(task_ids)} задач для обробки (staged pipeline)", extra={"task_count": len(task_ids)})
+    
+    return {
+        "session_id": session_id,
+        "total_domains": len(domains),
+        "task_ids": task_ids,
+        "started_at": datetime.utcnow().isoformat()
+    }
+
+
+def _store_session_config(session_id: int, config: Dict) -> str:
+    """Зберегти конфігурацію сесії в Redis та повернути ключ (config_ref)"""
+    config_ref = f"session:{session_id}:config"
+    redis_client.setex(config_ref, SESSION_CONFIG_TTL, json.dumps(config))
+    return config_ref
+
+
+def _load_session_config(config_ref: str) -> Dict:
+    """Завантажити конфігурацію сесії з Redis за config_ref"""
+    try:
+        raw = redis_client.get(config_ref)
+        if raw:
+            return json.loads(raw)
+        logger.warning(f"Конфігурацію {config_ref} не знайдено, використовуються налаштування за замовчуванням")
+    except Exception as e:
+        logger.error(f"Помилка завантаження конфігурації {config_ref}: {e}")
+    return {}
+
+
 def _init_session_progress(session_id: int, domains: List[str]):
     """
     Ініціалізувати прогрес сесії (використовує Redis hashes для атомних операцій)
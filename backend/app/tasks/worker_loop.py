@@ -0,0 +1,228 @@
+"""
+Довгоживучий event loop для Celery worker процесу
+
+Раніше кожна задача викликала asyncio.run(), який створює і закриває loop,
+а разом з ним WebScraper, TCPConnector, SSL контекст, DNS кеш та async Redis
+клієнти. Тепер кожен worker процес тримає один loop у фоновому потоці
+(стартує на worker_process_init), а задачі відправляють у нього корутини.
+Завдяки цьому keep-alive, ttl_dns_cache та пул з'єднань працюють між доменами.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+from typing import Any, Coroutine, Dict, Optional
+
+from celery.signals import worker_process_init, worker_process_shutdown, worker_ready, worker_shutdown
+
+from app.core.config import settings
+from app.services.scraper import WebScraper
+
+logger = logging.getLogger(__name__)
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_start_lock = threading.Lock()
+
+# Спільні WebScraper інстанси (ключ — конфіг проксі). Доступ тільки з потоку loop.
+_scrapers: Dict[str, WebScraper] = {}
+
+
+def _run_loop(loop: asyncio.AbstractEventLoop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def start_worker_loop() -> asyncio.AbstractEventLoop:
+    """Запустити (або повернути вже запущений) loop цього процесу."""
+    global _loop, _thread
+
+    with _start_lock:
+        if _loop is not None and _thread is not None and _thread.is_alive():
+            return _loop
+
+        _loop = asyncio.new_event_loop()
+        _thread = threading.Thread(
+            target=_run_loop, args=(_loop,), name="worker-event-loop", daemon=True
+        )
+        _thread.start()
+        logger.info("✓ Запущено event loop worker процесу")
+        return _loop
+
+
+def run_in_worker_loop(coro: Coroutine, timeout: Optional[float] = None) -> Any:
+    """
+    Виконати корутину в loop процесу та дочекатися результату (з sync коду задачі).
+
+    Якщо очікування перервано (SoftTimeLimitExceeded, revoke) — корутину скасовуємо,
+    щоб вона не продовжувала працювати в loop після завершення задачі.
+    """
+    loop = start_worker_loop()
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+def _proxy_key(proxy_config: Optional[Dict]) -> str:
+    if not proxy_config:
+        return ""
+    return json.dumps(proxy_config, sort_keys=True, default=str)
+
+
+async def get_shared_scraper(proxy_config: Optional[Dict] = None) -> WebScraper:
+    """
+    Отримати спільний WebScraper для конфігурації проксі.
+    Викликати тільки з loop процесу (всередині корутин задач).
+    """
+    key = _proxy_key(proxy_config)
+    scraper = _scrapers.get(key)
+    if scraper is None:
+        scraper = WebScraper.create_with_config(proxy_config) if proxy_config else WebScraper()
+        _scrapers[key] = scraper
+    return scraper
+
+
+async def _warm_up_browser():
+    """
+    Прогріти браузер спільного scraper-а (render worker-и, PLAYWRIGHT_WARM_UP)
+
+    З тим самим проксі, що й задачі (Redis config:proxy_* → .env), інакше перший
+    рендер з проксі перезапустив би браузер і прогрітий пул пропав би.
+    """
+    try:
+        from app.services.scheduler import _get_current_config
+        config = await asyncio.to_thread(_get_current_config)
+        scraper = await get_shared_scraper(config.get('proxy'))
+        await scraper.warm_up_browser()
+    except Exception as e:
+        logger.warning(f"Не вдалося прогріти Playwright: {e}")
+
+
+def process_tree_rss_kb(pid: Optional[int] = None) -> Optional[int]:
+    """
+    RSS процесу разом з усіма нащадками (КБ), за /proc (Linux)
+
+    Потрібно для render worker-ів: Chromium і драйвер Playwright — окремі
+    процеси, тож ru_maxrss самого Python процесу (--max-memory-per-child) їх не бачить.
+    None — /proc недоступний.
+    """
+    pid = pid or os.getpid()
+    children: Dict[int, list] = {}
+    rss: Dict[int, int] = {}
+    try:
+        entries = [e for e in os.listdir("/proc") if e.isdigit()]
+    except OSError:
+        return None
+    for entry in entries:
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # comm у дужках може містити пробіли — поля рахуємо після ")"
+                fields = f.read().rsplit(")", 1)[1].split()
+            ppid, pages = int(fields[1]), int(fields[21])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+        rss[int(entry)] = pages
+    if pid not in rss:
+        return None
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += rss.get(current, 0)
+        stack.extend(children.get(current, []))
+    return total * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+async def _close_resources():
+    """Закрити спільні ресурси loop (HTTP сесії, Redis клієнти, gRPC клієнти Gemini, браузер)."""
+    for scraper in list(_scrapers.values()):
+        try:
+            await scraper.close()
+        except Exception as e:
+            logger.debug(f"Помилка закриття WebScraper: {e}")
+    _scrapers.clear()
+
+    try:
+        from app.services.gemini import close_async_redis_client
+        await close_async_redis_client()
+    except Exception as e:
+        logger.debug(f"Помилка закриття async Redis: {e}")
+
+    try:
+        from app.services.gemini import close_async_clients
+        await close_async_clients()
+    except Exception as e:
+        logger.debug(f"Помилка закриття gRPC клієнтів Gemini: {e}")
+
+    try:
+        from app.services.playwright_scraper import close_playwright_scraper
+        await close_playwright_scraper()
+    except Exception as e:
+        logger.debug(f"Помилка закриття Playwright: {e}")
+
+
+def stop_worker_loop(timeout: float = 10.0):
+    """Закрити ресурси та зупинити loop процесу."""
+    global _loop, _thread
+
+    with _start_lock:
+        loop, thread = _loop, _thread
+        _loop, _thread = None, None
+
+    if loop is None or thread is None or not thread.is_alive():
+        return
+
+    try:
+        asyncio.run_coroutine_threadsafe(_close_resources(), loop).result(timeout)
+    except Exception as e:
+        logger.warning(f"Помилка закриття ресурсів event loop: {e}")
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout)
+
+    from app.services.extraction_pool import shutdown_extraction_pool
+    shutdown_extraction_pool()
+    logger.info("Event loop worker процесу зупинено")
+
+
+@worker_process_init.connect
+def _on_worker_process_init(**kwargs):
+    """Після fork стан батьківського процесу недійсний — стартуємо власний loop."""
+    global _loop, _thread
+    _loop, _thread = None, None
+    _scrapers.clear()
+    loop = start_worker_loop()
+    if settings.PLAYWRIGHT_WARM_UP:
+        # Не блокуємо старт процесу — перший рендер дочекається пулу контекстів
+        asyncio.run_coroutine_threadsafe(_warm_up_browser(), loop)
+
+
+@worker_ready.connect
+def _on_worker_ready(sender=None, **kwargs):
+    """
+    solo / threads пули не надсилають worker_process_init — прогріваємо браузер тут.
+    Для prefork цей сигнал приходить у батьківський процес, де браузер не потрібен.
+    """
+    if not settings.PLAYWRIGHT_WARM_UP:
+        return
+    pool_cls = getattr(getattr(sender, 'controller', None), 'pool_cls', None)
+    if pool_cls is None:
+        return
+    pool_module = pool_cls if isinstance(pool_cls, str) else pool_cls.__module__
+    if 'prefork' in pool_module:
+        return
+    asyncio.run_coroutine_threadsafe(_warm_up_browser(), start_worker_loop())
+
+
+@worker_process_shutdown.connect
+def _on_worker_process_shutdown(**kwargs):
+    stop_worker_loop()
+
+
+@worker_shutdown.connect
+def _on_worker_shutdown(**kwargs):
+    # Для pool='solo' worker_process_* сигнали не надсилаються
+    stop_worker_loop()
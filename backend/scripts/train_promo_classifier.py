@@ -0,0 +1,96 @@
+"""
+Навчання класифікатора наявності акцій для шлюзу перед Gemini
+
+Вибірка — зразки promo_gate:samples з Redis (ознаки сторінки + чи знайшов
+Gemini угоди), які накопичуються при PROMO_GATE_MODE=shadow/on.
+З --db-labels домени, для яких у scraped_deals вже є угоди, вважаються позитивними.
+
+Запуск з каталогу backend (потрібні scikit-learn та joblib):
+    python -m scripts.train_promo_classifier --output promo_gate.joblib [--min-recall 0.98]
+
+Виводить precision/recall на відкладеній вибірці та рекомендований
+PROMO_GATE_THRESHOLD (найбільший поріг із recall не нижче --min-recall).
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import settings  # noqa: E402
+from app.services.promo_classifier import FEATURE_NAMES, SAMPLES_REDIS_KEY, feature_vector  # noqa: E402
+
+
+def load_samples():
+    import redis
+    client = redis.from_url(settings.REDIS_URL)
+    return [json.loads(raw) for raw in client.lrange(SAMPLES_REDIS_KEY, 0, -1)]
+
+
+def domains_with_deals():
+    from sqlalchemy import distinct
+    from app.db.session import SessionLocal
+    from app.models.scraped_deal import ScrapedDeal
+    db = SessionLocal()
+    try:
+        return {row[0] for row in db.query(distinct(ScrapedDeal.domain)).all()}
+    finally:
+        db.close()
+
+
+def pick_threshold(probabilities, labels, min_recall):
+    """Найбільший поріг, за якого recall (частка сторінок з угодами, що не пропускаються) >= min_recall"""
+    positives = sorted(p for p, y in zip(probabilities, labels) if y)
+    if not positives:
+        return 0.0
+    allowed_misses = int(len(positives) * (1 - min_recall))
+    return positives[allowed_misses]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="promo_gate.joblib")
+    parser.add_argument("--min-recall", type=float, default=0.98)
+    parser.add_argument("--db-labels", action="store_true", help="позначити домени зі scraped_deals як позитивні")
+    args = parser.parse_args()
+
+    import joblib
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.metrics import precision_score, recall_score
+    from sklearn.model_selection import train_test_split
+
+    samples = load_samples()
+    if not samples:
+        print(f"Немає зразків у {SAMPLES_REDIS_KEY} — увімкніть PROMO_GATE_MODE=shadow")
+        return 1
+
+    positive_domains = domains_with_deals() if args.db_labels else set()
+    X = [feature_vector(s["features"]) for s in samples]
+    y = [int(s["has_deals"] or s["domain"] in positive_domains) for s in samples]
+    print(f"Зразків: {len(y)}, з угодами: {sum(y)}, ознаки: {', '.join(FEATURE_NAMES)}")
+    if len(set(y)) < 2:
+        print("Потрібні зразки обох класів")
+        return 1
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+    model = LogisticRegression(class_weight="balanced", max_iter=1000)
+    model.fit(X_train, y_train)
+
+    probabilities = model.predict_proba(X_test)[:, 1]
+    threshold = pick_threshold(probabilities, y_test, args.min_recall)
+    predicted = [int(p >= threshold) for p in probabilities]
+    skipped = predicted.count(0) / len(predicted)
+    print(f"Поріг: {threshold:.4f}")
+    print(f"Recall: {recall_score(y_test, predicted):.3f}, precision: {precision_score(y_test, predicted):.3f}")
+    print(f"Пропущено б Gemini запитів: {skipped:.1%}")
+
+    joblib.dump(model, args.output)
+    print(f"✓ Модель збережено: {args.output}")
+    print(f"  PROMO_GATE_MODEL_PATH={os.path.abspath(args.output)}")
+    print(f"  PROMO_GATE_THRESHOLD={threshold:.4f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,7 +9,8 @@ echo "=== Migrations complete ==="
 
 # Start Celery worker in background with output to stdout
 echo "=== Starting Celery worker ==="
-celery -A app.tasks.celery_app worker --loglevel=info 2>&1 &
+# Слухаємо також черги staged pipeline, щоб SCRAPING_PIPELINE_MODE=staged працював і з одним worker
+celery -A app.tasks.celery_app worker -Q celery,fetch,render,extract,llm,sink --loglevel=info 2>&1 &
 CELERY_PID=$!
 echo "=== Celery worker started with PID: $CELERY_PID ==="
 
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.tasks import scraping_tasks
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """Фінальні статуси, записані в Redis та БД (домен → кількість записів)"""
+    lock = threading.Lock()
+    statuses, db_updates = [], []
+
+    def update_task_status(status_id, domain, status, session_id, result=None):
+        if result and result.get("slow_write"):
+            time.sleep(0.3)
+        with lock:
+            statuses.append((domain, status))
+
+    def update_session_in_db(session_id, result):
+        with lock:
+            db_updates.append(result["domain"])
+
+    monkeypatch.setattr(scraping_tasks, "_update_task_status", update_task_status)
+    monkeypatch.setattr(scraping_tasks, "_update_session_in_db", update_session_in_db)
+    monkeypatch.setattr(scraping_tasks, "_is_stop_requested", lambda: False)
+    monkeypatch.setattr(scraping_tasks, "_add_ui_log", lambda *args, **kwargs: None)
+    monkeypatch.setattr(scraping_tasks.settings, "SCRAPING_CHUNK_CONCURRENCY", 2)
+    monkeypatch.setattr(scraping_tasks.settings, "SCRAPING_DOMAIN_TIMEOUT", 10)
+    return statuses, db_updates
+
+
+def _fake_scrape(delays, slow_write=()):
+    async def scrape(domain, session_id, config):
+        await asyncio.sleep(delays[domain])
+        return {"success": True, "domain": domain, "deals_count": 1, "slow_write": domain in slow_write}
+    return scrape
+
+
+def _terminal(statuses):
+    return [(domain, status) for domain, status in statuses if status != "running"]
+
+
+def test_deadline_marks_unfinished_domains_failed(monkeypatch, writes):
+    statuses, db_updates = writes
+    # concurrency=2: waiting.com так і не отримує семафор
+    domains = ["fast.com", "slow.com", "hung.com", "waiting.com"]
+    delays = {"fast.com": 0, "slow.com": 5, "hung.com": 5, "waiting.com": 0}
+    monkeypatch.setattr(scraping_tasks, "_scrape_domain_async", _fake_scrape(delays))
+
+    results = asyncio.run(scraping_tasks._scrape_chunk_async("t", domains, 1, {}, deadline=0.2))
+
+    assert [r["domain"] for r in results] == domains
+    assert [r["success"] for r in results] == [True, False, False, False]
+    assert results[1]["error"] == "Перевищено ліміт часу пачки"
+    assert sorted(_terminal(statuses)) == [
+        ("fast.com", "completed"), ("hung.com", "failed"), ("slow.com", "failed"), ("waiting.com", "failed"),
+    ]
+    assert sorted(db_updates) == sorted(domains)
+
+
+def test_deadline_during_status_write_does_not_double_count(monkeypatch, writes):
+    statuses, db_updates = writes
+    delays = {"a.com": 0, "b.com": 5}
+    monkeypatch.setattr(scraping_tasks, "_scrape_domain_async", _fake_scrape(delays, slow_write={"a.com"}))
+
+    async def run():
+        results = await scraping_tasks._scrape_chunk_async("t", ["a.com", "b.com"], 1, {}, deadline=0.1)
+        # Захищений від скасування запис a.com завершується у своєму потоці
+        await asyncio.sleep(0.5)
+        return results
+
+    asyncio.run(run())
+
+    assert _terminal(statuses).count(("a.com", "completed")) == 1
+    assert ("a.com", "failed") not in statuses
+    assert sorted(db_updates) == ["a.com", "b.com"]
+
+
+def test_chunk_deadline_covers_waves_of_domains(monkeypatch):
+    monkeypatch.setattr(scraping_tasks.settings, "SCRAPING_CHUNK_CONCURRENCY", 20)
+    monkeypatch.setattr(scraping_tasks.settings, "SCRAPING_DOMAIN_TIMEOUT", 300)
+
+    assert scraping_tasks._chunk_deadline(20) == 360
+    assert scraping_tasks._chunk_deadline(21) == 660
@@ -0,0 +1,40 @@
+from app.services.clearance_cookies import (
+    CLEARANCE_MAX_TTL,
+    CLEARANCE_SESSION_TTL,
+    clearance_ttl,
+    cookie_header,
+    egress_id,
+)
+
+NOW = 1_700_000_000.0
+
+
+def test_ttl_is_the_earliest_clearance_expiry():
+    cookies = [
+        {"name": "cf_clearance", "value": "a", "expires": NOW + 3600},
+        {"name": "__cf_bm", "value": "b", "expires": NOW + 1800},
+        {"name": "session", "value": "c", "expires": NOW + 60},
+    ]
+
+    assert clearance_ttl(cookies, now=NOW) == 1800
+
+
+def test_session_cookie_gets_session_ttl():
+    assert clearance_ttl([{"name": "datadome", "value": "a", "expires": -1}], now=NOW) == CLEARANCE_SESSION_TTL
+
+
+def test_ttl_is_capped():
+    cookies = [{"name": "cf_clearance", "value": "a", "expires": NOW + 30 * 86400}]
+
+    assert clearance_ttl(cookies, now=NOW) == CLEARANCE_MAX_TTL
+
+
+def test_no_clearance_or_expired_clearance_is_not_saved():
+    assert clearance_ttl([{"name": "session", "value": "a", "expires": NOW + 60}], now=NOW) is None
+    assert clearance_ttl([{"name": "cf_clearance", "value": "a", "expires": NOW - 1}], now=NOW) is None
+
+
+def test_egress_and_cookie_header():
+    assert egress_id(None) == "direct"
+    assert egress_id("http://10.0.0.1:59100") == "http://10.0.0.1:59100"
+    assert cookie_header({"cookies": {"cf_clearance": "a", "__cf_bm": "b"}}) == "cf_clearance=a; __cf_bm=b"
@@ -0,0 +1,73 @@
+from app.services.domain_state import (
+    hamming_distance,
+    page_promo_tokens,
+    page_simhash,
+    reuse_reason,
+    simhash,
+)
+
+CATALOGUE = " ".join(f"article{i} disponible en boutique" for i in range(60))
+BANNER = (
+    "Profitez de nos offres de la semaine sur toute la boutique en ligne, "
+    "livraison offerte des 50 euros d achat et retours gratuits pendant trente jours. "
+    "Utilisez le code {code} pour obtenir {amount} de remise sur votre commande. "
+) + CATALOGUE
+
+
+def _content(code="ETE15", amount="-15%"):
+    return {"text": BANNER.format(code=code, amount=amount)}
+
+
+def _scraped(content, previous_content):
+    return {
+        "content_hash": "new",
+        "simhash": page_simhash(content),
+        "promo_tokens": page_promo_tokens(content),
+        "previous_state": {
+            "content_hash": "old",
+            "simhash": page_simhash(previous_content),
+            "promo_tokens": page_promo_tokens(previous_content),
+        },
+    }
+
+
+def test_similar_texts_have_close_simhash():
+    a = simhash(BANNER.format(code="ETE15", amount="-15%"))
+    b = simhash(BANNER.format(code="ETE15", amount="-15%") + " Offre limitee.")
+
+    assert hamming_distance(a, b) < hamming_distance(a, simhash("texte completement different " * 5))
+
+
+def test_short_text_has_no_simhash():
+    assert simhash("Code ETE15") is None
+
+
+def test_promo_tokens_include_codes_and_amounts():
+    tokens = page_promo_tokens(_content())
+
+    assert "ETE15" in tokens
+    assert "15%" in tokens
+
+
+def test_unchanged_body_and_304_reuse_deals():
+    assert reuse_reason({"not_modified": True, "previous_state": {"content_hash": "x"}}) == "not_modified"
+    assert reuse_reason({"content_hash": "x", "previous_state": {"content_hash": "x"}}) == "content_hash"
+
+
+def test_same_promo_with_small_text_change_reuses_deals():
+    previous = _content()
+    current = {"text": previous["text"].replace("article59", "article60")}
+
+    assert reuse_reason(_scraped(current, previous)) == "simhash"
+
+
+def test_new_code_is_never_reused_even_if_simhash_is_close():
+    assert reuse_reason(_scraped(_content(code="HIVER30"), _content(code="ETE15"))) is None
+
+
+def test_new_amount_is_never_reused():
+    assert reuse_reason(_scraped(_content(amount="-30%"), _content(amount="-15%"))) is None
+
+
+def test_no_previous_state_means_no_reuse():
+    assert reuse_reason({"content_hash": "x"}) is None
@@ -0,0 +1,40 @@
+import time
+
+import pytest
+
+from app.services import fetch_strategy
+from app.services.fetch_strategy import plan_strategies
+
+
+@pytest.fixture(autouse=True)
+def no_reprobe(monkeypatch):
+    monkeypatch.setattr(fetch_strategy.settings, "FETCH_STRATEGY_REPROBE_RATE", 0.0)
+    monkeypatch.setattr(fetch_strategy.settings, "FETCH_STRATEGY_MAX_AGE", 86400)
+
+
+def _record(strategy, age=0):
+    return {"strategy": strategy, "latency": 1.0, "updated_at": time.time() - age}
+
+
+def test_without_record_starts_with_proxy_if_available():
+    assert plan_strategies(None, proxy_available=True) == ["proxy", "browser"]
+    assert plan_strategies(None, proxy_available=False) == ["direct", "browser"]
+
+
+def test_known_strategy_is_tried_first():
+    assert plan_strategies(_record("browser"), proxy_available=True) == ["browser"]
+    assert plan_strategies(_record("direct"), proxy_available=True) == ["direct", "proxy", "browser"]
+
+
+def test_unavailable_known_strategy_falls_back_to_default():
+    assert plan_strategies(_record("proxy"), proxy_available=False) == ["direct", "browser"]
+
+
+def test_stale_record_reprobes_the_cheapest_first():
+    assert plan_strategies(_record("browser", age=2 * 86400), proxy_available=True) == ["direct", "browser"]
+
+
+def test_reprobe_rate_reprobes_the_cheapest_first(monkeypatch):
+    monkeypatch.setattr(fetch_strategy.settings, "FETCH_STRATEGY_REPROBE_RATE", 1.0)
+
+    assert plan_strategies(_record("proxy"), proxy_available=True) == ["direct", "proxy", "browser"]
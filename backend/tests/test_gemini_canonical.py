@@ -0,0 +1,47 @@
+from app.services.gemini import canonicalize_content
+
+PAGE = '<div class="promo"><p>valable jusqu au {end} … {clock}</p><a href="{href}">{code}</a></div>'
+
+
+def _page(end="2026-10-31T23:59:00", clock="23:59", href="/promo?id=5", code="ETE15", noise=""):
+    return PAGE.format(end=end, clock=clock, href=href, code=code) + noise
+
+
+def test_deal_fields_change_the_canonical_form():
+    base = canonicalize_content(_page())
+
+    assert canonicalize_content(_page(end="2026-11-30T23:59:00")) != base
+    assert canonicalize_content(_page(clock="18:00")) != base
+    assert canonicalize_content(_page(href="/promo?id=6")) != base
+    assert canonicalize_content(_page(code="HIVER30")) != base
+
+
+def test_deal_fields_are_kept_verbatim():
+    canonical = canonicalize_content(_page())
+
+    assert "2026-10-31T23:59:00" in canonical
+    assert "23:59" in canonical
+    assert 'href="/promo?id=5"' in canonical
+
+
+def test_noise_does_not_change_the_canonical_form():
+    base = canonicalize_content(_page(noise='<script>var nonce = "a1";</script>'))
+    noisy = canonicalize_content(_page(noise=(
+        '<script>var nonce = "b2";</script><!-- render 2026-10-17 -->'
+        '<input name="csrf" value="aZ9kQ2mP7xW3nR8tY1uV5bC6dE0fG4hJ">'
+        '\n\n   <span data-request="550e8400-e29b-41d4-a716-446655440000">'
+    )))
+    other = canonicalize_content(_page(noise=(
+        '<style>.a{}</style>'
+        '<input name="csrf" value="Qw3Er5Ty7Ui9Op1As3Df5Gh7Jk9Lz1Xc">'
+        ' <span data-request="6ba7b810-9dad-11d1-80b4-00c04fd430c8">'
+    )))
+
+    assert noisy == other
+    assert base in noisy
+
+
+def test_url_paths_are_not_treated_as_tokens():
+    href = "/Summer-Sale-2026-Final-Offer-Now-Extended-Again"
+
+    assert href in canonicalize_content(_page(href=href))
@@ -0,0 +1,49 @@
+import pytest
+
+from app.services.gemini import GeminiService
+
+
+@pytest.fixture
+def parse():
+    # Парсер не використовує стан сервісу — обходимо конфігурацію Gemini в __init__
+    return GeminiService.__new__(GeminiService)._parse_json_response
+
+
+DEAL = '{"code": "ETE15", "description": "-15% sur tout", "categories": ["1", "2"]}'
+
+
+@pytest.mark.parametrize("reply", [
+    f"[{DEAL}]",
+    f'{{"deals": [{DEAL}]}}',
+    f'```json\n{{"data": [{DEAL}]}}\n```',
+    DEAL,
+    f"Voici la promotion trouvée : {DEAL}",
+])
+def test_deals_are_extracted(parse, reply):
+    deals = parse(reply)
+
+    assert [deal["code"] for deal in deals] == ["ETE15"]
+
+
+@pytest.mark.parametrize("reply", [
+    "[]",
+    "{}",
+    '{"deals": []}',
+    '{"status": "ok"}',
+    "null",
+    "Aucune promotion trouvée sur cette page.",
+    "No promotions found.",
+])
+def test_valid_replies_without_deals_are_empty(parse, reply):
+    assert parse(reply) == []
+
+
+@pytest.mark.parametrize("reply", [
+    "",
+    "   ",
+    '[{"code": "ETE15", "description": "-15% sur',
+    '{"deals": [{"code": "ETE15"}',
+    "```json\n[{\"code\": \n```",
+])
+def test_truncated_or_broken_replies_are_errors(parse, reply):
+    assert parse(reply) is None
@@ -0,0 +1,51 @@
+import pytest
+
+from app.services import promo_classifier
+from app.services.promo_classifier import classify_page, keyword_probability, page_features
+
+PROMO_PAGE = {
+    "title": "Soldes d'ete",
+    "text": "Code promo ETE15 : -20% sur tout le site, livraison offerte. Offre valable 2 jours.",
+}
+PLAIN_PAGE = {
+    "title": "Mentions legales",
+    "text": "Siege social a Lyon. Directeur de la publication : Jean Martin. Hebergeur : OVH.",
+}
+
+
+@pytest.fixture(autouse=True)
+def keywords_only(monkeypatch):
+    monkeypatch.setattr(promo_classifier.settings, "PROMO_GATE_MODEL_PATH", "")
+    monkeypatch.setattr(promo_classifier.settings, "PROMO_GATE_THRESHOLD", 0.08)
+
+
+def test_promo_page_scores_higher_than_plain_page():
+    promo = keyword_probability(page_features(PROMO_PAGE))
+    plain = keyword_probability(page_features(PLAIN_PAGE))
+
+    assert promo > 0.5
+    assert plain < 0.08
+
+
+def test_keyword_signals_saturate():
+    many = {"signal_0": 100.0}
+    capped = {"signal_0": 3.0}
+
+    assert keyword_probability(many) == keyword_probability(capped)
+
+
+def test_shadow_mode_never_skips(monkeypatch):
+    monkeypatch.setattr(promo_classifier.settings, "PROMO_GATE_MODE", "shadow")
+
+    decision = classify_page(PLAIN_PAGE)
+
+    assert decision["would_skip"]
+    assert not decision["skip"]
+    assert decision["source"] == "keywords"
+
+
+def test_on_mode_skips_only_below_threshold(monkeypatch):
+    monkeypatch.setattr(promo_classifier.settings, "PROMO_GATE_MODE", "on")
+
+    assert classify_page(PLAIN_PAGE)["skip"]
+    assert not classify_page(PROMO_PAGE)["skip"]
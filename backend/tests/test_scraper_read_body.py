@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from app.services import scraper
+from app.services.scraper import WebScraper
+
+
+class _Content:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.read = 0
+
+    async def iter_chunked(self, size):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+class _Response:
+    def __init__(self, chunks, charset="utf-8"):
+        self.charset = charset
+        self.content = _Content(chunks)
+
+
+def _read(chunks, charset="utf-8"):
+    response = _Response(chunks, charset)
+    page = asyncio.run(WebScraper.__new__(WebScraper)._read_body(response))
+    return page, response.content.read
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(scraper.settings, "SCRAPING_MAX_BYTES", 1000)
+    monkeypatch.setattr(scraper.settings, "SCRAPING_STOP_AT_BODY_END", True)
+
+
+def test_stops_after_body_end():
+    page, read = _read([b"<html><body>Code ETE15</body>", b"<script>huge()</script>", b"</html>"])
+
+    assert page["html"] == "<html><body>Code ETE15</body>"
+    assert not page["truncated"]
+    assert read == 1
+
+
+def test_body_end_split_between_chunks():
+    page, read = _read([b"<html><body>-15%</bo", b"dy><script>x()</script>", b"more"])
+
+    assert page["html"] == "<html><body>-15%</body>"
+    assert read == 2
+
+
+def test_byte_limit_truncates(monkeypatch):
+    monkeypatch.setattr(scraper.settings, "SCRAPING_MAX_BYTES", 20)
+
+    page, read = _read([b"<html><body>" + b"x" * 50, b"</body></html>"])
+
+    assert page["truncated"]
+    assert len(page["body"]) == 20
+    assert read == 1
+
+
+def test_multibyte_characters_split_between_chunks():
+    text = "<html><body>Réduction été</body>".encode("utf-8")
+    split = text.index("é".encode("utf-8")) + 1
+
+    page, _ = _read([text[:split], text[split:]])
+
+    assert page["html"] == "<html><body>Réduction été</body>"
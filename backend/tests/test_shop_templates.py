@@ -0,0 +1,32 @@
+from app.services.shop_templates import apply_template, learn_template
+
+DEAL = {"code": "ETE15", "discount": "15%", "description": "-15% sur tout"}
+
+
+def _content(extra=""):
+    return {"clean_html": (
+        '<html><body><div id="promo-banner"><p>Code ETE15 : -15% sur tout</p></div>'
+        f"<div>{extra}</div></body></html>"
+    )}
+
+
+def test_unchanged_page_reuses_deals():
+    template = learn_template(_content(), [DEAL])
+
+    assert apply_template(_content(), template) == [DEAL]
+
+
+def test_new_code_outside_locators_is_drift():
+    template = learn_template(_content(), [DEAL])
+
+    assert apply_template(_content("Code HIVER30 valable ce week-end"), template) is None
+
+
+def test_new_discount_only_banner_is_drift():
+    template = learn_template(_content(), [DEAL])
+
+    assert apply_template(_content("Soldes : -30% sur les manteaux"), template) is None
+
+
+def test_deal_missing_from_page_is_not_learned():
+    assert learn_template(_content(), [{"code": "HIVER30", "discount": "30%"}]) is None
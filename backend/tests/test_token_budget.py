@@ -0,0 +1,76 @@
+from app.services.token_budget import (
+    TRUNCATED_MARKER,
+    cut_to_budget,
+    estimate_tokens,
+    fit_to_budget,
+    split_to_chunks,
+)
+
+
+def _sections(count, words=50, promo_at=None):
+    sections = []
+    for i in range(count):
+        text = " ".join(f"mot{i}" for _ in range(words))
+        if i == promo_at:
+            text = "Code ETE15 : -15% sur tout " + text
+        sections.append(f"<div>{text}</div>")
+    return "".join(sections)
+
+
+def test_content_within_budget_is_unchanged():
+    content = _sections(3)
+
+    fitted, info = fit_to_budget(content, estimate_tokens(content))
+
+    assert fitted == content
+    assert not info["truncated"]
+
+
+def test_promo_section_is_kept_first():
+    content = _sections(20, promo_at=15)
+
+    fitted, info = fit_to_budget(content, 300)
+
+    assert "ETE15" in fitted
+    assert fitted.endswith(TRUNCATED_MARKER)
+    assert estimate_tokens(fitted) <= 300
+    assert info["dropped_sections"] > 0
+
+
+def test_single_oversized_section_is_cut_not_dropped():
+    content = "<p>" + " ".join(f"ligne{i}" for i in range(20000)) + "</p>"
+
+    fitted, info = fit_to_budget(content, 1000)
+
+    assert info["cut_sections"] == 1
+    assert 900 < estimate_tokens(fitted) <= 1000
+
+
+def test_cut_to_budget_stops_at_a_tag_boundary():
+    text = "<div><p>premier bloc</p><p>second bloc plus long que le reste</p></div>"
+
+    cut = cut_to_budget(text, estimate_tokens("<div><p>premier bloc</p><p>second"))
+
+    assert cut.startswith("<div><p>premier bloc</p>")
+    assert cut.endswith(">")
+    assert "second" not in cut
+
+
+def test_chunks_stay_within_budget_and_keep_everything():
+    content = _sections(40)
+
+    chunks, info = split_to_chunks(content, 500)
+
+    assert info["chunks"] == len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 500 for chunk in chunks)
+    assert "".join(chunks) == content
+
+
+def test_oversized_section_is_split_by_measured_cost():
+    content = "<p>" + " ".join(f"ligne{i}" for i in range(50000)) + "</p>"
+
+    chunks, info = split_to_chunks(content, 10000, max_chunks=4)
+
+    assert len(chunks) == 4
+    assert all(estimate_tokens(chunk) <= 10000 for chunk in chunks)
+    assert not any(TRUNCATED_MARKER in chunk for chunk in chunks)